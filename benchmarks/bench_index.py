@@ -0,0 +1,88 @@
+"""Placement of reads on precursors: k-mer index vs pairwise alignment
+
+It compares mirtop.mirna.index.kmer_index.map() with the alignment to
+the mature window that the prost importer did for each read, and the
+time to build the index with the time to read it from disk.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_index.py [precursors] [reads]
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from mirtop.importer.prost import _align_to_mature
+from mirtop.mirna import index
+
+
+def precursors(n, seed=42):
+    """Random precursors of 60-110 nts."""
+    rnd = random.Random(seed)
+    return dict(("pre%s" % idx, "".join(rnd.choice("ACGT") for _ in
+                                         range(rnd.randint(60, 110))))
+                for idx in range(n))
+
+
+def reads(hairpins, n, seed=42):
+    """Reads of 18-25 nts with one substitution in 10% of them."""
+    rnd = random.Random(seed)
+    names = sorted(hairpins)
+    out = []
+    for _ in range(n):
+        name = rnd.choice(names)
+        size = rnd.randint(18, 25)
+        start = rnd.randint(0, len(hairpins[name]) - size)
+        seq = list(hairpins[name][start:start + size])
+        if rnd.random() < 0.1:
+            pos = rnd.randint(0, size - 4)
+            seq[pos] = rnd.choice([nt for nt in "ACGT" if nt != seq[pos]])
+        out.append((name, start, "".join(seq)))
+    return out
+
+
+def _time(fn):
+    start = time.time()
+    value = fn()
+    return time.time() - start, value
+
+
+def main():
+    n_pre = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_reads = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    hairpins = precursors(n_pre)
+    sample = reads(hairpins, n_reads)
+    tmp = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmp, "hairpin.fa")
+        with open(fn, 'w') as out_handle:
+            for name in sorted(hairpins):
+                out_handle.write(">%s\n%s\n" % (name, hairpins[name]))
+        build, idx = _time(lambda: index.load(hairpins, fn))
+        cached, _ = _time(lambda: index.load(hairpins, fn))
+        print("precursors\t%s\tkmers\t%s" % (n_pre, len(idx.kmers)))
+        print("build\t%.3fs\tfrom disk\t%.3fs" % (build, cached))
+        seconds, placed = _time(lambda: [idx.map(seq)
+                                         for _, _, seq in sample])
+        found = sum(1 for (name, start, _), hits in zip(sample, placed)
+                    if (name, start) in [hit[:2] for hit in hits])
+        print("index\t%s reads\t%.3fs\t%.0f reads/s\tplaced %s" % (
+            len(sample), seconds, len(sample) / seconds, found))
+        subset = sample[:min(len(sample), 2000)]
+        seconds, _ = _time(lambda: [
+            _align_to_mature(seq, hairpins[name],
+                             [max(start - 2, 0), start + len(seq) + 1])
+            for name, start, seq in subset])
+        print("align\t%s reads\t%.3fs\t%.0f reads/s" % (
+            len(subset), seconds, len(subset) / seconds))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
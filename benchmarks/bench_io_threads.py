@@ -0,0 +1,100 @@
+"""Scaling of BAM reading and writing with --io-threads
+
+It writes a name-sorted BAM file with random reads aligned to the
+precursors of data/examples/annotate/hairpin.fa, and times writing it,
+decompressing all the records, and mirtop.bam.bam.stream_bam(), with
+htslib using 1, 2, 4... threads for BGZF (de)compression.
+
+The speedup is bounded by the number of CPUs, printed in the first line.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_io_threads.py [reads] [max_threads]
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pysam
+
+from mirtop.bam import bam
+from mirtop.mirna import fasta
+
+HAIRPIN = "data/examples/annotate/hairpin.fa"
+
+
+def records(precursors, n, seed=42):
+    """Reads of 18-25 nts as (name, precursor, start, sequence)."""
+    rnd = random.Random(seed)
+    names = sorted(precursors)
+    for idx in range(n):
+        name = rnd.choice(names)
+        size = rnd.randint(18, 25)
+        start = rnd.randint(0, len(precursors[name]) - size)
+        yield ("seq_%s_x%s" % (idx, rnd.randint(1, 100)), name, start,
+               precursors[name][start:start + size])
+
+
+def write(precursors, reads, fn, threads):
+    names = sorted(precursors)
+    header = {'HD': {'VN': '1.0', 'SO': 'queryname'},
+              'SQ': [{'SN': name, 'LN': len(precursors[name])}
+                     for name in names]}
+    ref_id = dict((name, idx) for idx, name in enumerate(names))
+    with pysam.AlignmentFile(fn, "wb", header=header,
+                             threads=threads) as out_handle:
+        for query_name, name, start, seq in reads:
+            record = pysam.AlignedSegment()
+            record.query_name = query_name
+            record.query_sequence = seq
+            record.flag = 0
+            record.reference_id = ref_id[name]
+            record.reference_start = start
+            record.mapping_quality = 60
+            record.cigartuples = [(0, len(seq))]
+            out_handle.write(record)
+
+
+def scan(fn, threads):
+    with pysam.AlignmentFile(fn, "rb", threads=threads) as handle:
+        return sum(1 for _ in handle)
+
+
+def _time(fn):
+    start = time.time()
+    value = fn()
+    return time.time() - start, value
+
+
+def main():
+    n_reads = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    precursors = fasta.read_precursor(HAIRPIN, "hsa")
+    reads = list(records(precursors, n_reads))
+    steps = [1]
+    while steps[-1] * 2 <= max_threads:
+        steps.append(steps[-1] * 2)
+    print("cpus\t%s\treads\t%s" % (multiprocessing.cpu_count(), n_reads))
+    print("threads\twrite\tdecompress\tstream_bam")
+    tmp = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmp, "reads_sort.bam")
+        for threads in steps:
+            written, _ = _time(lambda: write(precursors, reads, fn, threads))
+            decompress, _ = _time(lambda: scan(fn, threads))
+            streamed, _ = _time(lambda: sum(
+                1 for _ in bam.stream_bam(fn, precursors, threads=threads)))
+            print("%s\t%.3fs\t%.3fs\t%.3fs" % (threads, written, decompress,
+                                               streamed))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
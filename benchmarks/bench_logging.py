@@ -0,0 +1,96 @@
+"""Time per read of the BAM pipeline (read_bam, annotate and
+body.create) with debug messages disabled and enabled.
+
+With debug disabled the hot loops should not pay for building
+the debug messages. With debug enabled messages go to a null
+stream, so the difference is the cost of formatting them.
+The records of the SAM fixtures are copied *copies* times with
+new query names so the fixed cost of opening files is small.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_logging.py [copies] [repeat]
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import timeit
+
+import pysam
+
+from mirtop.bam import bam
+from mirtop.gff import body
+from mirtop.mirna import annotate, fasta, mapper
+import mirtop.libs.logger as mylog
+
+HAIRPIN = "data/examples/annotate/hairpin.fa"
+GTF = "data/examples/annotate/hsa.gff3"
+SAMS = ["data/examples/annotate/sim_isomir.sam",
+        "data/aligments/collapsing-isomirs.sam"]
+
+
+def prepare_bam(sam_fn, tmp_dir, copies):
+    """Name-sorted BAM file next to the name read_bam() expects"""
+    name = os.path.splitext(os.path.basename(sam_fn))[0]
+    bam_fn = os.path.join(tmp_dir, "%s.bam" % name)
+    records = list(pysam.AlignmentFile(sam_fn, "r"))
+    with pysam.AlignmentFile(sam_fn, "r") as in_handle:
+        out_handle = pysam.AlignmentFile(bam_fn, "wb", template=in_handle)
+    for copy in range(copies):
+        for record in records:
+            query_name = record.query_name
+            counts = query_name.split("_x")
+            record.query_name = "c%s_%s" % (copy, query_name)
+            if len(counts) < 2:
+                record.query_name = "%s_x1" % record.query_name
+            out_handle.write(record)
+            record.query_name = query_name
+    out_handle.close()
+    pysam.sort("-n", "-o", os.path.join(tmp_dir, "%s_sort.bam" % name),
+               bam_fn)
+    return bam_fn
+
+
+def pipeline(bam_fn, args):
+    reads = bam.read_bam(bam_fn, args, clean=True)
+    reads = annotate.annotate(reads, args.matures, args.precursors)
+    body.create(reads, "miRBase21", "sample", args)
+    return len(reads)
+
+
+def main(copies=100, repeat=5):
+    args = argparse.Namespace(hairpin=HAIRPIN, sps="hsa", gtf=GTF,
+                              add_extra=True, add_seq=False,
+                              out_format="gff")
+    args.precursors = fasta.read_precursor(HAIRPIN, "hsa")
+    args.matures = mapper.read_gtf_to_precursor(GTF)
+    logger = logging.getLogger(mylog.__name__)
+    logger.propagate = False
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    logger.addHandler(handler)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print("file\treads\tdebug_off_us/read\tdebug_on_us/read")
+        for sam_fn in SAMS:
+            bam_fn = prepare_bam(sam_fn, tmp_dir, copies)
+            n = pipeline(bam_fn, args)
+            times = []
+            for level in [logging.INFO, logging.DEBUG]:
+                logger.setLevel(level)
+                times.append(min(timeit.repeat(
+                    lambda: pipeline(bam_fn, args),
+                    number=1, repeat=repeat)) * 1e6 / n)
+            print("%s\t%s\t%.1f\t%.1f" % (os.path.basename(sam_fn), n,
+                                          times[0], times[1]))
+    finally:
+        logger.removeHandler(handler)
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    import sys
+    main(*[int(a) for a in sys.argv[1:]])
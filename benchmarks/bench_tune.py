@@ -0,0 +1,107 @@
+"""Time and allocations per read of mirtop.bam.filter.tune and
+mirtop.mirna.annotate.annotate over the alignments of a SAM file.
+
+The memory allocated while processing each read is measured with
+tracemalloc, only available with Python >= 3.9.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_tune.py [file.sam] [repeat]
+"""
+from __future__ import print_function
+
+import copy
+import sys
+import timeit
+
+import pysam
+
+from mirtop.bam import filter
+from mirtop.mirna import annotate, fasta, mapper
+from mirtop.mirna.realign import hits, isomir
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HAIRPIN = "data/examples/annotate/hairpin.fa"
+GTF = "data/examples/annotate/hsa.gff3"
+SAM = "data/examples/annotate/sim_isomir.sam"
+
+
+def load_alignments(sam_fn):
+    """Alignments on + strand as (name, sequence, precursor, start, cigar)"""
+    alignments = []
+    sequences = dict()
+    handle = pysam.AlignmentFile(sam_fn, "r")
+    for line in handle:
+        if line.query_sequence:
+            sequences[line.query_name] = line.query_sequence
+        if line.reference_id < 0 or line.is_reverse:
+            continue
+        alignments.append((line.query_name, sequences[line.query_name],
+                           handle.get_reference_name(line.reference_id),
+                           line.reference_start, line.cigartuples))
+    handle.close()
+    return alignments
+
+
+def tune_reads(alignments, precursors):
+    """One *hits* object with the tuned isomiR for each alignment"""
+    reads = []
+    for name, seq, chrom, start, cigar in alignments:
+        if len(precursors[chrom]) < start + len(seq):
+            continue
+        read = hits()
+        read.set_sequence(seq)
+        iso = isomir()
+        iso.set_pos(start, len(seq))
+        iso.subs, iso.add, iso.cigar = filter.tune(seq, precursors[chrom],
+                                                   start, cigar)
+        read.set_precursor(chrom, iso)
+        reads.append((name, read))
+    return reads
+
+
+def _peak(fn, items):
+    """Mean of the highest memory used by fn(item) over the items"""
+    if not tracemalloc or not hasattr(tracemalloc, "reset_peak"):
+        return "NA"
+    total = 0
+    tracemalloc.start()
+    for item in items:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        fn(item)
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return "%.0f" % (total * 1.0 / len(items))
+
+
+def main(sam_fn=SAM, repeat=200):
+    precursors = fasta.read_precursor(HAIRPIN, "hsa")
+    matures = mapper.read_gtf_to_precursor(GTF)
+    alignments = load_alignments(sam_fn)
+    reads = tune_reads(alignments, precursors)
+
+    def _tune(aln):
+        return filter.tune(aln[1], precursors[aln[2]], aln[3], aln[4])
+
+    def _annotate(read):
+        # annotate replaces the isomiRs of the read, so it works over a copy
+        new = copy.copy(read[1])
+        new.precursors = dict(read[1].precursors)
+        return annotate.annotate({read[0]: new}, matures, precursors)
+
+    print("stage\tus/read\tpeak_bytes/read")
+    for stage, fn, items in [("tune", _tune, alignments),
+                             ("annotate", _annotate, reads)]:
+        best = min(timeit.repeat(lambda: [fn(i) for i in items],
+                                 number=1, repeat=repeat))
+        print("%s\t%.1f\t%s" % (stage, best * 1e6 / len(items),
+                                  _peak(fn, items)))
+
+
+if __name__ == "__main__":
+    main(*[int(a) if a.isdigit() else a for a in sys.argv[1:]])
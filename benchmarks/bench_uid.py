@@ -0,0 +1,79 @@
+"""Throughput of the UID codec: mirtop.mirna.realign.make_id/read_id
+
+Run from the root of the repository:
+
+    python benchmarks/bench_uid.py
+"""
+from __future__ import print_function
+
+import random
+import timeit
+
+from mirtop.mirna import realign
+from mirtop.mirna.keys import CODE2NT, NT2CODE
+from mirtop.mirna.realign import make_id, make_ids, read_id, read_ids
+
+
+def _make_id_loop(seq):
+    """Character by character encoder used before the table codec."""
+    start = 0
+    idu = ""
+    for i in range(0, len(seq) + 1, 3):
+        if i == 0:
+            continue
+        idu += NT2CODE[seq[start:i]]
+        start = i
+    if len(seq) > i:
+        dummy = "A" * (3 - (len(seq) - i))
+        idu += NT2CODE["%s%s" % (seq[i:len(seq)], dummy)]
+        idu += str(len(dummy))
+    return idu
+
+
+def _read_id_loop(idu):
+    """Character by character decoder used before the table codec."""
+    seq = ""
+    for i in idu:
+        if i == "1" or i == "2":
+            return seq[:-int(i)]
+        else:
+            seq += CODE2NT[i]
+    return seq
+
+
+def sequences(n=100000, seed=42):
+    """Random miRNA-like sequences between 18 and 26 nts."""
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice("ACGT") for _ in range(rnd.randint(18, 26)))
+            for _ in range(n)]
+
+
+def _rate(fn, data, repeat=3, cold=True):
+    """Items per second, emptying the UID cache before each run if cold."""
+    def run():
+        if cold:
+            realign.UID_CACHE.clear()
+        fn(data)
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return len(data) / best
+
+
+def main():
+    seqs = sequences()
+    idus = [make_id(s) for s in seqs]
+    print("function\tsequences/s")
+    print("make_id loop\t%.0f" % _rate(lambda d: [_make_id_loop(s) for s in d], seqs))
+    print("make_id\t%.0f" % _rate(lambda d: [make_id(s) for s in d], seqs))
+    print("make_ids\t%.0f" % _rate(make_ids, seqs))
+    print("read_id loop\t%.0f" % _rate(lambda d: [_read_id_loop(s) for s in d], idus))
+    print("read_id\t%.0f" % _rate(lambda d: [read_id(s) for s in d], idus))
+    print("read_ids\t%.0f" % _rate(read_ids, idus))
+    # the same UIDs are found in many lines and files
+    repeated = idus[:len(idus) // 10] * 10
+    print("read_id repeated\t%.0f" % _rate(lambda d: [read_id(s) for s in d], repeated))
+    print("read_ids repeated\t%.0f" % _rate(read_ids, repeated))
+    print("read_ids cached\t%.0f" % _rate(read_ids, idus, cold=False))
+
+
+if __name__ == "__main__":
+    main()
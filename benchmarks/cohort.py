@@ -0,0 +1,146 @@
+"""Deterministic synthetic cohort of N samples x M unique sequences.
+
+Unique sequences come from mirtop.libs.simulator: reads around each
+mature miRNA with trimming variants, non-template additions and
+substitutions, and noise along the precursor. Each sample expresses
+most of the sequences with random counts.
+
+For each sample it writes `<sample>.bam`, the name-sorted
+`<sample>_sort.bam` that mirtop.bam.bam.read_bam() reads, and
+`<sample>.gtf` plus the merged `mirtop.gtf` made by mirtop gff.
+
+Run from the root of the repository:
+
+    python benchmarks/cohort.py out_dir [samples] [sequences] [seed]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+import pysam
+
+from mirtop import gff
+from mirtop.libs import simulator
+from mirtop.mirna import fasta, mapper
+
+HAIRPIN = "data/examples/annotate/hairpin.fa"
+GTF = "data/examples/annotate/hsa.gff3"
+SPS = "hsa"
+
+
+def unique_sequences(precursors, matures, n, seed=42):
+    """
+    Get *n* unique sequences as (precursor, start, sequence).
+
+    Args:
+        *precursors(dict)*: from *mirtop.mirna.fasta.read_precursor()*.
+
+        *matures(dict)*: from *mirtop.mirna.mapper.read_gtf_to_precursor()*.
+
+        *n(int)*: number of sequences.
+
+        *seed(int)*: seed of the random generator.
+
+    Returns:
+        *(list)*: sorted by precursor and start.
+    """
+    rng = np.random.RandomState(seed)
+    rates = {'isomir': 0.3, 'snp': 0.1, 'addition': 0.2, 'noise': 0.1}
+    pool = dict()
+    while len(pool) < n:
+        before = len(pool)
+        for name in sorted(precursors):
+            seq = precursors[name][:-len(fasta.PADDING)]
+            spots = simulator._get_spot(seq, matures.get(name))
+            keys, _ = simulator._random_sequences(rng, len(seq), spots,
+                                                  n, rates)
+            for key in keys.tolist():
+                read = simulator._decode(key, seq)
+                if read[0] not in pool:
+                    pool[read[0]] = (name, read[1], read[0])
+        if len(pool) == before:
+            break
+    rnd = random.Random(seed)
+    selected = rnd.sample(sorted(pool), min(n, len(pool)))
+    return sorted(pool[seq] for seq in selected)
+
+
+def write_bam(sequences, precursors, fn, rnd, expressed=0.8):
+    """
+    Write sequences expressed in one sample as aligned BAM file
+    and sort it by name for *read_bam()*.
+
+    Returns:
+        *(int)*: number of alignments.
+    """
+    names = sorted(set(seq[0] for seq in sequences))
+    header = {'HD': {'VN': '1.0'},
+              'SQ': [{'SN': name,
+                      'LN': len(precursors[name]) - len(fasta.PADDING)}
+                     for name in names]}
+    ref_id = dict((name, idx) for idx, name in enumerate(names))
+    n = 0
+    with pysam.AlignmentFile(fn, "wb", header=header) as out_handle:
+        for idx, (name, start, seq) in enumerate(sequences):
+            if rnd.random() > expressed:
+                continue
+            record = pysam.AlignedSegment()
+            record.query_name = "seq_%s_x%s" % (idx, rnd.randint(1, 1000))
+            record.query_sequence = seq
+            record.flag = 0
+            record.reference_id = ref_id[name]
+            record.reference_start = start
+            record.mapping_quality = 60
+            record.cigartuples = [(0, len(seq))]
+            record.query_qualities = pysam.qualitystring_to_array(
+                "I" * len(seq))
+            out_handle.write(record)
+            n += 1
+    pysam.sort("-n", "-o", "%s_sort.bam" % os.path.splitext(fn)[0], fn)
+    return n
+
+
+def cohort(out_dir, samples=4, sequences=1000, seed=42,
+           hairpin=HAIRPIN, gtf=GTF, sps=SPS):
+    """
+    Write the BAM and GFF files of a synthetic cohort.
+
+    Returns:
+        *(dict)*: with *bam* and *gff* lists of files, *merged* GFF file,
+            the unique *sequences* and the number of *alignments*.
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    precursors = fasta.read_precursor(hairpin, sps)
+    matures = mapper.read_gtf_to_precursor(gtf)
+    seqs = unique_sequences(precursors, matures, sequences, seed)
+    rnd = random.Random(seed)
+    bams = []
+    alignments = 0
+    for idx in range(samples):
+        fn = os.path.join(out_dir, "sample%s.bam" % idx)
+        alignments += write_bam(seqs, precursors, fn, rnd)
+        bams.append(fn)
+    args = argparse.Namespace(files=bams, out=out_dir, hairpin=hairpin,
+                              gtf=gtf, sps=sps, lazy_hairpin=False,
+                              format="BAM", out_format="gtf",
+                              add_extra=False, add_seq=False)
+    gff.reader(args)
+    return {'bam': bams,
+            'gff': [os.path.splitext(fn)[0] + ".gtf" for fn in bams],
+            'merged': os.path.join(out_dir, "mirtop.gtf"),
+            'sequences': seqs,
+            'alignments': alignments}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    data = cohort(sys.argv[1], *[int(a) for a in sys.argv[2:]])
+    print("%s samples, %s unique sequences, %s alignments" % (
+        len(data['bam']), len(data['sequences']), data['alignments']))
@@ -0,0 +1,238 @@
+"""Throughput and peak memory of each step of mirtop over a
+synthetic cohort made by benchmarks/cohort.py.
+
+Each benchmark runs in its own process, so the peak RSS is the one
+of that step (plus the memory of the process when it is forked).
+The best time of *repeat* runs is used, and the inputs are prepared
+again before each run outside of the timing.
+
+Run from the root of the repository:
+
+    python benchmarks/suite.py [--samples N] [--sequences M]
+        [--repeat R] [--json out.json] [benchmark ...]
+"""
+from __future__ import print_function
+
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import cohort
+
+from mirtop import version
+from mirtop.bam import bam, filter
+from mirtop.exporter import isomirs
+from mirtop.gff import body, compare, convert, merge, stats
+from mirtop.mirna import annotate, fasta, mapper, realign
+
+
+def _args(data, **kwargs):
+    args = argparse.Namespace(hairpin=cohort.HAIRPIN, gtf=cohort.GTF,
+                              sps=cohort.SPS, out_format="gtf",
+                              add_extra=False, add_seq=False,
+                              lazy_hairpin=False)
+    args.precursors = data['precursors']
+    args.matures = data['matures']
+    args.database = mapper.guess_database(cohort.GTF)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def _gff_lines(fns):
+    n = 0
+    for fn in fns:
+        with open(fn) as in_handle:
+            n += len([line for line in in_handle if not line.startswith("#")])
+    return n
+
+
+def bench_make_id(data):
+    seqs = [seq[2] for seq in data['sequences']]
+    return len(seqs), lambda: [realign.make_id(seq) for seq in seqs]
+
+
+def bench_align(data):
+    pairs = [(seq, data['precursors'][name][start:start + len(seq)])
+             for name, start, seq in data['sequences']]
+    return len(pairs), lambda: [realign.align(x, y) for x, y in pairs]
+
+
+def bench_tune(data):
+    seqs = data['sequences']
+    precursors = data['precursors']
+
+    def run():
+        for name, start, seq in seqs:
+            filter.tune(seq, precursors[name], start, [(0, len(seq))])
+    return len(seqs), run
+
+
+def _read_bam(data):
+    reads = dict()
+    for fn in data['bam']:
+        reads[fn] = bam.read_bam(fn, _args(data))
+    return reads
+
+
+def bench_read_bam(data):
+    return data['alignments'], lambda: _read_bam(data)
+
+
+def bench_annotate(data):
+    reads = _read_bam(data)
+
+    def run():
+        for fn in reads:
+            annotate.annotate(reads[fn], data['matures'], data['precursors'])
+    return sum(len(reads[fn]) for fn in reads), run
+
+
+def bench_create(data):
+    reads = _read_bam(data)
+    for fn in reads:
+        annotate.annotate(reads[fn], data['matures'], data['precursors'])
+    args = _args(data, add_extra=True)
+
+    def run():
+        for fn in reads:
+            body.create(reads[fn], args.database, fn, args)
+    return sum(len(reads[fn]) for fn in reads), run
+
+
+def bench_merge(data):
+    dts = dict((fn, body.read(fn, None)) for fn in data['gff'])
+    samples = [os.path.splitext(os.path.basename(fn))[0]
+               for fn in data['gff']]
+    return _gff_lines(data['gff']), lambda: merge.merge(dts, samples)
+
+
+def bench_stats(data):
+    def run():
+        for fn in data['gff']:
+            stats._calc_stats(fn)
+    return _gff_lines(data['gff']), run
+
+
+def bench_compare(data):
+    reference = compare.read_reference(data['gff'][0])
+
+    def run():
+        for fn in data['gff'][1:]:
+            compare._compare_to_reference(fn, reference)
+    return _gff_lines(data['gff'][1:]), run
+
+
+def bench_convert(data):
+    out_dir = tempfile.mkdtemp(dir=data['out'])
+    args = _args(data, gff=data['merged'], out=out_dir, add_extra=True)
+    return _gff_lines([data['merged']]), lambda: convert.convert_gff_counts(args)
+
+
+def bench_export(data):
+    out_dir = tempfile.mkdtemp(dir=data['out'])
+    args = _args(data, files=[data['merged']], out=out_dir)
+    return _gff_lines([data['merged']]), lambda: isomirs.convert(args)
+
+
+BENCHMARKS = OrderedDict([
+    ("make_id", bench_make_id),
+    ("align", bench_align),
+    ("tune", bench_tune),
+    ("read_bam", bench_read_bam),
+    ("annotate", bench_annotate),
+    ("create", bench_create),
+    ("merge", bench_merge),
+    ("stats", bench_stats),
+    ("compare", bench_compare),
+    ("convert", bench_convert),
+    ("export", bench_export)])
+
+
+def _run(name, data, repeat, queue):
+    best = None
+    for _ in range(repeat):
+        items, fn = BENCHMARKS[name](copy.copy(data))
+        start = time.time()
+        fn()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss / 1024
+    queue.put((items, best, rss / 1024.0))
+
+
+def run(name, data, repeat=3):
+    """
+    Run one benchmark in a new process.
+
+    Returns:
+        *(dict)*: items, seconds, items_per_sec and peak_rss_mb.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run,
+                                      args=(name, data, repeat, queue))
+    process.start()
+    items, seconds, rss = queue.get()
+    process.join()
+    return OrderedDict([("items", items),
+                        ("seconds", round(seconds, 6)),
+                        ("items_per_sec", round(items / max(seconds, 1e-9), 1)),
+                        ("peak_rss_mb", round(rss, 1))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("benchmarks", nargs="*",
+                        help="benchmarks to run, all by default: %s." %
+                             ", ".join(BENCHMARKS))
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--sequences", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this JSON file.")
+    parser.add_argument("--keep", help="write the cohort to this folder"
+                                       " and keep it.")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % name)
+    out_dir = args.keep or tempfile.mkdtemp()
+    try:
+        data = cohort.cohort(out_dir, args.samples, args.sequences, args.seed)
+        data['out'] = out_dir
+        data['precursors'] = fasta.read_precursor(cohort.HAIRPIN, cohort.SPS)
+        data['matures'] = mapper.read_gtf_to_precursor(cohort.GTF)
+        results = OrderedDict()
+        print("benchmark\titems\tseconds\titems/sec\tpeak_rss_mb")
+        for name in args.benchmarks or BENCHMARKS:
+            results[name] = run(name, data, args.repeat)
+            print("%s\t%s" % (name, "\t".join(map(str, results[name].values()))))
+        if args.json:
+            info = OrderedDict([("version", version.__version__),
+                                ("python", platform.python_version()),
+                                ("samples", args.samples),
+                                ("sequences", args.sequences),
+                                ("seed", args.seed),
+                                ("results", results)])
+            with open(args.json, 'w') as out_handle:
+                json.dump(info, out_handle, indent=2)
+    finally:
+        if not args.keep:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
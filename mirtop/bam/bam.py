@@ -2,17 +2,40 @@
 
 import os.path as op
 import os
+import heapq
+import itertools
+import multiprocessing
+import shutil
+import tempfile
 import pysam
 from collections import defaultdict
 
-from mirtop.libs import do
-from mirtop.libs.utils import file_exists
+from mirtop.libs.utils import file_exists, get_freq
 import mirtop.libs.logger as mylog
+from mirtop.libs import metrics
 from mirtop.mirna.realign import isomir, hits
+from mirtop.mirna.annotate import annotate
+from mirtop.mirna import reference
 from mirtop.bam import filter
 
 logger = mylog.getLogger(__name__)
 
+# arguments and names of reads in many groups of precursors,
+# shared with the forked workers of create_sharded
+_REFERENCE = None
+_SHARED = None
+# shards for each process, to balance precursors with many reads
+SHARDS_BY_THREAD = 4
+# names of reads kept in memory by each process before sorting
+# and writing them to a file, to find reads in many groups
+NAMES_CHUNK = 1000000
+# alignments read to guess if a file without SO:queryname is grouped by name
+GROUPED_RECORDS = 100000
+# GFF attributes added to the alignments by write_bam() as BAM tags,
+# lowercase tags are reserved for users by the SAM specification
+TAGS = [("Name", "mi", str), ("Variant", "va", str), ("UID", "ui", str),
+        ("Hits", "nh", int)]
+
 
 def read_bam(bam_fn, args, clean=True):
     """
@@ -24,7 +47,7 @@ def read_bam(bam_fn, args, clean=True):
         *precursors*: dict with keys being precursor names and values
             being sequences. Come from mirtop.mirna.fasta.read_precursor().
 
-        *clean*: Use mirtop.filter.clean_hits() to remove lower score hits.
+        *clean*: Use mirtop.filter.clean() to remove lower score hits.
 
     Returns:
         *reads (dict)*:
@@ -32,70 +55,528 @@ def read_bam(bam_fn, args, clean=True):
 
     """
     precursors = args.precursors
-    bam_fn = _sam_to_bam(bam_fn)
-    bam_fn = _bam_sort(bam_fn)
-    mode = "r" if bam_fn.endswith("sam") else "rb"
-    handle = pysam.Samfile(bam_fn, mode)
+    threads = io_threads(args)
+    with metrics.timer("sort"):
+        bam_fn, guessed = _bam_sort(bam_fn, threads)
+    try:
+        with metrics.timer("read_bam"):
+            reads = _read_alignments(bam_fn, precursors, clean, threads,
+                                     check=guessed)
+    except NotGroupedError as e:
+        logger.info("%s Sorting it." % e)
+        with metrics.timer("sort"):
+            bam_fn, _ = _bam_sort(bam_fn, threads, guess=False)
+        with metrics.timer("read_bam"):
+            reads = _read_alignments(bam_fn, precursors, clean, threads)
+    logger.info("Hits: %s" % len(reads))
+    return reads
+
+
+class NotGroupedError(ValueError):
+    """Alignments of the same read are not together in the file."""
+
+
+def io_threads(args):
+    """Threads for BGZF (de)compression of BAM files, from --io-threads."""
+    return max(1, getattr(args, "io_threads", 1) or 1)
+
+
+def _read_alignments(bam_fn, precursors, clean=False, threads=1,
+                     check=False):
+    """Read name-sorted BAM file into *mirtop.realign.hits*"""
     reads = defaultdict(hits)
+    for query_name, read in stream_bam(bam_fn, precursors, clean, threads,
+                                       check):
+        reads[query_name] = read
+    return reads
+
+
+def stream_bam(bam_fn, precursors, clean=True, threads=1, check=False):
+    """
+    Read a BAM file sorted or grouped by read name and realign
+    the hits of each read.
+
+    Args:
+        *bam_fn*: a BAM/SAM file with alignments to the precursor.
+
+        *precursors*: dict with keys being precursor names and values
+            being sequences. Come from mirtop.mirna.fasta.read_precursor().
+
+        *clean*: Use mirtop.filter.clean() to remove lower score hits.
+
+        *threads(int)*: threads used by htslib to decompress the file.
+
+        *check(boolean)*: raise *NotGroupedError* if a read comes
+            back after other reads, for files not known to be sorted.
+
+    Returns:
+        *(generator)*: with (read_id, *mirtop.realign.hits*) of each
+            read, as soon as all its alignments are read.
+    """
+    mode = "r" if bam_fn.endswith("sam") else "rb"
+    handle = pysam.Samfile(bam_fn, mode, threads=threads)
+    debug = mylog.is_debug()
+    n_lines = 0
+    n_reads = 0
+    query_name, read = None, None
+    done = set()
     for line in handle:
+        n_lines += 1
         if line.reference_id < 0:
-            logger.debug("Sequence not mapped: %s" % line.reference_id)
+            if debug:
+                logger.debug("Sequence not mapped: %s" % line.reference_id)
             continue
-        query_name = line.query_name
         # if query_name not in reads and line.query_sequence:
         #     continue
         if line.query_sequence and line.query_sequence.find("N") > -1:
             continue
-        if query_name not in reads:
-            reads[query_name].set_sequence(line.query_sequence)
-            reads[query_name].counts = _get_freq(query_name)
+        if line.query_name != query_name:
+            if check:
+                if line.query_name in done:
+                    handle.close()
+                    raise NotGroupedError(
+                        "%s is not grouped by read name at %s." % (
+                            bam_fn, line.query_name))
+                done.add(query_name)
+            if read is not None:
+                n_reads += 1
+                if clean:
+                    filter.clean(read, debug, query_name)
+                yield query_name, read
+            query_name, read = line.query_name, hits()
+            read.set_sequence(line.query_sequence)
+            read.counts = get_freq(query_name)
         if line.is_reverse:
-            logger.debug("Sequence is reverse: %s" % line.query_name)
+            if debug:
+                logger.debug("Sequence is reverse: %s" % line.query_name)
             continue
         chrom = handle.getrname(line.reference_id)
         cigar = line.cigartuples
         iso = isomir()
         iso.align = line
-        iso.set_pos(line.reference_start, len(reads[query_name].sequence))
-        logger.debug("READ::From BAM start %s end %s" % (iso.start, iso.end))
-        if len(precursors[chrom]) < line.reference_start + len(reads[query_name].sequence):
+        iso.set_pos(line.reference_start, len(read.sequence))
+        if debug:
+            logger.debug("READ::From BAM start %s end %s" % (iso.start, iso.end))
+        if len(precursors[chrom]) < line.reference_start + len(read.sequence):
             continue
         iso.subs, iso.add, iso.cigar = filter.tune(
-            reads[query_name].sequence, precursors[chrom],
+            read.sequence, precursors[chrom],
             line.reference_start, cigar)
-        logger.debug("READ::After tune start %s end %s" % (iso.start, iso.end))
+        if debug:
+            logger.debug("READ::After tune start %s end %s" % (iso.start, iso.end))
         if len(iso.subs) < 2:
+            read.set_precursor(chrom, iso)
+    if read is not None:
+        n_reads += 1
+        if clean:
+            filter.clean(read, debug, query_name)
+        yield query_name, read
+    handle.close()
+    metrics.count("read_bam.alignments", n_lines)
+    metrics.count("read_bam.reads", n_reads)
+
+
+def create_sharded(bam_fn, database, sample, args, threads):
+    """
+    Read, realign, annotate and create the GFF lines of a BAM file
+    with many processes, each one fetching the alignments of a group
+    of precursors from the coordinate-sorted and indexed BAM file.
+
+    Reads with alignments in only one group are done by its process.
+    Reads in many groups come back to the main process, that puts
+    their alignments together by name to keep the best hits with
+    *mirtop.filter.clean_hits()* and count the *Hits* attribute.
+
+    Args:
+        *bam_fn*: a BAM file with alignments to the precursor
+
+        *database(str)*: database name.
+
+        *sample(str)*: sample name.
+
+        *args(namedtuple)*: arguments with *precursors* and *matures*.
+            See *mirtop.libs.parse.add_subparser_gff()*.
+
+        *threads(int)*: number of processes.
+
+    Returns:
+        *lines (nested dicts)*: as *mirtop.gff.body.create()*.
+    """
+    global _REFERENCE, _SHARED
+    with metrics.timer("sam_to_bam"):
+        bam_fn = _sam_to_bam(bam_fn, io_threads(args))
+    with metrics.timer("sort"):
+        bam_fn = _bam_index(bam_fn, io_threads(args))
+    shards = _shards(bam_fn, threads * SHARDS_BY_THREAD)
+    jobs = [(bam_fn, shard) for shard in shards]
+    logger.info("Reading %s groups of precursors with %s processes" % (
+        len(shards), threads))
+    # workers map the same reference files instead of copying them
+    _REFERENCE = (database, sample, reference.share(args))
+    folder = tempfile.mkdtemp(prefix="mirtop_names_",
+                              dir=getattr(args, "out", None))
+    try:
+        with metrics.timer("read_names"):
+            files = _map(_shard_names, [
+                (bam_fn, contigs, op.join(folder, "shard%s" % idx))
+                for idx, contigs in enumerate(shards)], threads)
+            _SHARED = _shared_names(files)
+        logger.info("Reads in many groups of precursors: %s" % len(_SHARED))
+        with metrics.timer("read_bam"):
+            parts = _map(_shard_worker, jobs, threads)
+    finally:
+        _REFERENCE, _SHARED = None, None
+        shutil.rmtree(folder, ignore_errors=True)
+    with metrics.timer("reduce"):
+        lines = _reduce(parts, database, sample, args)
+    return lines
+
+
+def _map(fn, jobs, threads):
+    pool = multiprocessing.Pool(max(1, min(threads, len(jobs))))
+    try:
+        return pool.map(fn, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _bam_index(bam_fn, threads=1):
+    """
+    Sort BAM file by coordinates and index it, if it is not yet.
+    Files with SO:coordinate in the header that can't be indexed,
+    because they are not really sorted, are sorted as well.
+    """
+    handle = pysam.AlignmentFile(bam_fn, "rb", threads=threads)
+    sorted_by = handle.header.to_dict().get("HD", {}).get("SO")
+    handle.close()
+    if sorted_by == "coordinate":
+        try:
+            if not file_exists(bam_fn + ".bai"):
+                pysam.index("-@", str(threads - 1), bam_fn)
+            return bam_fn
+        except pysam.utils.SamtoolsError:
+            logger.info("%s is not sorted by coordinates." % bam_fn)
+            if op.exists(bam_fn + ".bai"):
+                os.remove(bam_fn + ".bai")
+    bam_coord = op.splitext(bam_fn)[0] + "_coord.bam"
+    if not file_exists(bam_coord):
+        pysam.sort("-@", str(threads - 1), "-o", bam_coord, bam_fn)
+    if not file_exists(bam_coord + ".bai"):
+        pysam.index("-@", str(threads - 1), bam_coord)
+    return bam_coord
+
+
+def _shards(bam_fn, n):
+    """
+    Split precursors with reads in *n* groups with similar
+    number of alignments.
+
+    Returns:
+        *(list)*: with lists of precursor names.
+    """
+    handle = pysam.AlignmentFile(bam_fn, "rb")
+    stats = sorted([(-stat.mapped, stat.contig)
+                    for stat in handle.get_index_statistics()
+                    if stat.mapped])
+    handle.close()
+    shards = [[0, []] for _ in range(min(n, len(stats)))]
+    for mapped, contig in stats:
+        shard = min(shards, key=lambda shard: shard[0])
+        shard[0] -= mapped
+        shard[1].append(contig)
+    return [shard[1] for shard in shards]
+
+
+def _shard_names(job):
+    """
+    Write the names of the reads of a group of precursors that can
+    be in other groups, sorted, to files of up to *NAMES_CHUNK*
+    names. Reads with the NH:i:1 tag only have one alignment,
+    so they are skipped.
+
+    Returns:
+        *(list)*: files with one name by line.
+    """
+    bam_fn, contigs, prefix = job
+    files = []
+    names = set()
+    handle = pysam.AlignmentFile(bam_fn, "rb",
+                                 threads=io_threads(_REFERENCE[2]))
+    for contig in contigs:
+        for line in handle.fetch(contig):
+            if line.has_tag("NH") and line.get_tag("NH") == 1:
+                continue
+            names.add(line.query_name)
+            if len(names) >= NAMES_CHUNK:
+                files.append(_write_names(names, prefix, len(files)))
+                names = set()
+    handle.close()
+    if names or not files:
+        files.append(_write_names(names, prefix, len(files)))
+    return files
+
+
+def _write_names(names, prefix, idx):
+    fn = "%s_%s.txt" % (prefix, idx)
+    with open(fn, 'w') as out_handle:
+        for name in sorted(names):
+            out_handle.write("%s\n" % name)
+    return fn
+
+
+def _shared_names(parts):
+    """
+    Names of the reads found in more than one group, merging the
+    sorted files of each group from *_shard_names()*, so only those
+    names are kept in memory.
+    """
+    handles = []
+    shared = set()
+    try:
+        names = []
+        for idx, files in enumerate(parts):
+            for fn in files:
+                handles.append(open(fn))
+                names.append(_read_names(handles[-1], idx))
+        merged = heapq.merge(*names)
+        for name, group in itertools.groupby(merged, key=lambda x: x[0]):
+            if len(set(idx for _, idx in group)) > 1:
+                shared.add(name)
+    finally:
+        for handle in handles:
+            handle.close()
+    return shared
+
+
+def _read_names(handle, idx):
+    """Names of a file from *_write_names()* with the group index."""
+    for line in handle:
+        yield line.rstrip("\n"), idx
+
+
+def _shard_worker(job):
+    """
+    Realign and annotate the alignments of a group of precursors
+    and create the GFF lines of reads only found in this group.
+
+    Returns:
+        *(list)*: GFF lines, reads found in other groups as
+            *mirtop.realign.hits* and their alignments without sequence.
+    """
+    from mirtop.gff import body
+    bam_fn, contigs = job
+    database, sample, args = _REFERENCE
+    precursors = args.precursors
+    reads = defaultdict(hits)
+    pending = []
+    n_lines = 0
+    handle = pysam.AlignmentFile(bam_fn, "rb", threads=io_threads(args))
+    for contig in contigs:
+        for line in handle.fetch(contig):
+            n_lines += 1
+            if line.is_reverse:
+                continue
+            query_name = line.query_name
+            sequence = line.query_sequence
+            alignment = (query_name, contig, line.reference_start,
+                         line.cigartuples)
+            if not sequence:
+                # secondary alignments can come without sequence
+                pending.append(alignment)
+                continue
+            if sequence.find("N") > -1:
+                continue
+            if query_name not in reads:
+                reads[query_name].set_sequence(sequence)
+                reads[query_name].counts = get_freq(query_name)
+            _add_hit(reads[query_name], alignment[1:], precursors)
+    handle.close()
+    unknown = [alignment for alignment in pending
+               if alignment[0] not in reads]
+    for alignment in pending:
+        if alignment[0] in reads:
+            _add_hit(reads[alignment[0]], alignment[1:], precursors)
+    reads = annotate(reads, args.matures, precursors)
+    shared = dict((name, reads.pop(name)) for name in list(reads)
+                  if name in _SHARED)
+    logger.debug("SHARD::%s alignments, %s reads in other groups"
+                 " in %s" % (n_lines, len(shared), contigs))
+    lines = body.create(filter.clean_hits(reads), database, sample, args)
+    return [lines, shared, unknown]
+
+
+def _add_hit(read, alignment, precursors):
+    """Realign one alignment as (precursor, start, cigar) of *read*."""
+    chrom, start, cigar = alignment
+    if len(precursors[chrom]) < start + len(read.sequence):
+        return
+    iso = isomir()
+    iso.set_pos(start, len(read.sequence))
+    iso.subs, iso.add, iso.cigar = filter.tune(
+        read.sequence, precursors[chrom], start, cigar)
+    if len(iso.subs) < 2:
+        read.set_precursor(chrom, iso)
+
+
+def _reduce(parts, database, sample, args):
+    """
+    Put together the GFF lines of each group and create the
+    lines of reads found in many groups.
+    """
+    from mirtop.gff import body
+    lines = defaultdict(dict)
+    reads = dict()
+    pending = []
+    for shard_lines, shard_reads, shard_pending in parts:
+        for chrom in shard_lines:
+            for start in shard_lines[chrom]:
+                lines[chrom].setdefault(start, []).extend(
+                    shard_lines[chrom][start])
+        pending.extend(shard_pending)
+        for query_name in shard_reads:
+            if query_name not in reads:
+                reads[query_name] = shard_reads[query_name]
+            else:
+                reads[query_name].precursors.update(
+                    shard_reads[query_name].precursors)
+    realigned = defaultdict(hits)
+    for alignment in pending:
+        if alignment[0] not in reads:
+            continue
+        read = realigned[alignment[0]]
+        read.sequence = reads[alignment[0]].sequence
+        _add_hit(read, alignment[1:], args.precursors)
+    annotate(realigned, args.matures, args.precursors)
+    for query_name in realigned:
+        for chrom, iso in realigned[query_name].precursors.items():
             reads[query_name].set_precursor(chrom, iso)
-    logger.info("Hits: %s" % len(reads))
-    if clean:
-        reads = filter.clean_hits(reads)
-        logger.info("Hits after clean: %s" % len(reads))
-    return reads
+    shared_lines = body.create(filter.clean_hits(reads), database, sample,
+                               args)
+    for chrom in shared_lines:
+        for start in shared_lines[chrom]:
+            lines[chrom].setdefault(start, []).extend(
+                shared_lines[chrom][start])
+    return lines
+
+
+def write_bam(bam_fn, lines, fn_out, threads=1):
+    """
+    Write the alignment of *bam_fn* of each GFF line with its
+    annotation as tags (see *TAGS*), sorted by coordinates and
+    indexed, so they can be region-queried.
 
+    Args:
+        *bam_fn*: the BAM/SAM file used to create *lines*.
+
+        *lines (nested dicts)*: from *mirtop.gff.body.create()*.
+
+        *fn_out(str)*: output BAM file.
+
+        *threads(int)*: threads to decompress and compress the files.
 
-def _sam_to_bam(bam_fn):
+    Returns:
+        *fn_out(str)*: output BAM file.
+    """
+    from mirtop.gff.body import read_gff_line
+    tags = dict()
+    for chrom in lines:
+        for start in lines[chrom]:
+            for hit in lines[chrom][start]:
+                attrb = read_gff_line(hit[4])['attrb']
+                tags[(attrb['Read'], chrom, start)] = [
+                    (tag, fn(attrb[name])) for name, tag, fn in TAGS]
+    mode = "r" if bam_fn.endswith("sam") else "rb"
+    fn_unsorted = "%s.unsorted%s" % op.splitext(fn_out)
+    n_records = 0
+    with pysam.AlignmentFile(bam_fn, mode, threads=threads) as handle:
+        with pysam.AlignmentFile(fn_unsorted, "wb", template=handle,
+                                 threads=threads) as out_handle:
+            for line in handle:
+                if line.reference_id < 0 or line.is_reverse:
+                    continue
+                key = (line.query_name, line.reference_name,
+                       line.reference_start)
+                # only one alignment by GFF line, like read_bam()
+                if key not in tags:
+                    continue
+                for tag, value in tags.pop(key):
+                    line.set_tag(tag, value)
+                out_handle.write(line)
+                n_records += 1
+    pysam.sort("-@", str(threads - 1), "-o", fn_out, fn_unsorted)
+    pysam.index(fn_out)
+    os.remove(fn_unsorted)
+    logger.info("Alignments with annotation: %s" % n_records)
+    metrics.count("write_bam.alignments", n_records)
+    return fn_out
+
+
+def _sam_to_bam(bam_fn, threads=1):
     if not bam_fn.endswith("bam"):
         bam_out = "%s.bam" % os.path.splitext(bam_fn)[0]
-        cmd = "samtools view -Sbh {bam_fn} -o {bam_out}"
-        do.run(cmd.format(**locals()))
+        pysam.view("-@", str(threads - 1), "-b", "-h", "-o", bam_out,
+                   bam_fn, catch_stdout=False)
         return bam_out
     return bam_fn
 
 
-def _bam_sort(bam_fn):
+def _bam_sort(bam_fn, threads=1, guess=True):
+    """
+    Sort BAM/SAM file by read name, unless the header says it is
+    (SO:queryname), or the first *GROUPED_RECORDS* alignments have
+    the reads grouped, like the output of aligners.
+    The sort is done by pysam with the external sort of samtools,
+    that keeps the memory bounded writing temporary files.
+
+    Args:
+        *bam_fn*: a BAM/SAM file.
+
+        *threads(int)*: threads to sort and compress the file.
+
+        *guess(boolean)*: look at the first alignments.
+
+    Returns:
+        *(bam_fn, guessed)*: file to read and whether the grouping
+            was guessed, so it needs to be checked while reading.
+    """
     bam_sort_by_n = op.splitext(bam_fn)[0] + "_sort.bam"
+    if guess and not file_exists(bam_sort_by_n):
+        grouped = _grouped_by_name(bam_fn, threads)
+        if grouped:
+            logger.info("%s is grouped by read name (%s)." % (bam_fn,
+                                                             grouped))
+            return bam_fn, grouped != "queryname"
     if not file_exists(bam_sort_by_n):
-        do.run(("samtools sort -n -o {bam_sort_by_n} {bam_fn}").format(
-            **locals()))
-    return bam_sort_by_n
+        pysam.sort("-n", "-@", str(threads - 1), "-o", bam_sort_by_n,
+                   bam_fn, catch_stdout=False)
+    return bam_sort_by_n, False
 
 
-def _get_freq(name):
+def _grouped_by_name(bam_fn, threads=1, n=GROUPED_RECORDS):
     """
-    Check if name read contains counts (_xNumber)
+    Check if the alignments of each read are together in the file.
+
+    Returns:
+        *(str)*: *queryname* if the header says so, *grouped* if no
+            read of the first *n* alignments comes back after other
+            read, or None.
     """
+    mode = "r" if bam_fn.endswith("sam") else "rb"
+    handle = pysam.AlignmentFile(bam_fn, mode, threads=threads)
     try:
-        counts = int(name.split("_x")[1])
-    except:
-        return 0
-    return counts
+        if handle.header.to_dict().get("HD", {}).get("SO") == "queryname":
+            return "queryname"
+        done = set()
+        last = None
+        for idx, line in enumerate(handle):
+            if idx == n:
+                break
+            if line.query_name != last:
+                if line.query_name in done:
+                    return None
+                done.add(last)
+                last = line.query_name
+    finally:
+        handle.close()
+    return "grouped"
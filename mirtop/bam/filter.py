@@ -3,10 +3,7 @@ import os.path as op
 import os
 import re
 import shutil
-import pandas as pd
-import pysam
-from collections import defaultdict
-from mirtop.mirna.realign import hits, cigar_correction, make_cigar, align
+from mirtop.mirna.realign import cigar_correction, make_cigar, align
 from mirtop.libs import do
 from mirtop.libs.utils import file_exists
 import mirtop.libs.logger as mylog
@@ -22,7 +19,8 @@ def tune(seq, precursor, start, cigar):
     Args:
         *seq (str)*: sequence of the read.
 
-        *precursor (str)*: sequence of the precursor.
+        *precursor (str)*: sequence of the precursor. It is not sliced,
+            only the positions covered by the read are compared.
 
         *start (int)*: start position of sequence on the precursor, +1.
 
@@ -39,7 +37,7 @@ def tune(seq, precursor, start, cigar):
             cigar (str): updated cigar
     """
     if cigar:
-        seq, mature = cigar_correction(cigar, seq, precursor[start:])
+        seq, mature = cigar_correction(cigar, seq, precursor, start)
     else:
         seq, mature, score, p, size = align(seq, precursor[start:start + len(seq)])
         cigar = make_cigar(seq, mature)
@@ -47,7 +45,8 @@ def tune(seq, precursor, start, cigar):
         seq = seq[1:]
     if seq.endswith("-"):
         seq = seq[:-1]
-    logger.debug("TUNE:: %s %s %s" % (cigar, seq, mature))
+    if mylog.is_debug():
+        logger.debug("TUNE:: %s %s %s" % (cigar, seq, mature))
     error = set()
     pattern_addition = [[1, 1, 0], [1, 0, 1], [0, 1, 0], [0, 1, 1], [0, 0, 1], [1, 1, 1]]
     for pos in range(0, len(seq)):
@@ -87,23 +86,41 @@ def clean_hits(reads):
 
     Returns:
 
-        *reads*: same than input but with best hits only.
+        *reads*: same dictionary, each read only with best hits.
     """
-    new_reads = defaultdict(hits)
+    debug = mylog.is_debug()
     for r in reads:
-        world = {}
-        sc = 0
-        for p in reads[r].precursors:
-            world[p] = reads[r].precursors[p].get_score(len(reads[r].sequence))
-            if sc < world[p]:
-                sc = world[p]
-        new_reads[r] = reads[r]
-        for p in world:
-            logger.debug("CLEAN::score %s %s %s" % (r, p, world[p]))
-            if sc != world[p]:
-                logger.debug("CLEAN::remove %s %s %s" % (r, p, world[p]))
-                new_reads[r].remove_precursor(p)
-
-    return new_reads
+        clean(reads[r], debug, r)
+    return reads
 
 
+def clean(read, debug=False, name=None):
+    """
+    Select only best matches of one read, so reads can be cleaned
+    as soon as all their alignments are read.
+
+    Args:
+        *read(mirtop.realign.hits)*: read with all its hits.
+
+        *debug(boolean)*: log the score of each hit.
+
+        *name(str)*: read name for the log, the sequence if None.
+
+    Returns:
+
+        *read*: same object without the hits with lower score.
+    """
+    if name is None:
+        name = read.sequence
+    size = len(read.sequence)
+    scores = [(p, read.precursors[p].get_score(size))
+              for p in list(read.precursors)]
+    best = max([0] + [score for p, score in scores])
+    for p, score in scores:
+        if debug:
+            logger.debug("CLEAN::score %s %s %s" % (name, p, score))
+        if score != best:
+            if debug:
+                logger.debug("CLEAN::remove %s %s %s" % (name, p, score))
+            read.remove_precursor(p)
+    return read
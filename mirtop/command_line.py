@@ -4,14 +4,9 @@ import sys
 
 from mirtop.libs.logger import initialize_logger
 from mirtop.libs.parse import parse_cl
-from mirtop.libs.simulator import simulate
-from mirtop.gff import reader
-from mirtop.gff.stats import stats
-from mirtop.gff.compare import compare
-from mirtop.gff.convert import convert_gff_counts
-from mirtop.exporter import isomirs
-from mirtop.gff import validator
 import mirtop.libs.logger as mylog
+from mirtop.libs import metrics
+from mirtop.libs import profiler
 
 import time
 
@@ -21,29 +16,55 @@ def main(**kwargs):
     initialize_logger(kwargs['args'].out, kwargs['args'].debug,
                       kwargs['args'].print_debug)
     logger = mylog.getLogger(__name__)
+    metrics.reset()
     start = time.time()
+    args = kwargs["args"]
+    sub_cmd = [cmd for cmd in kwargs if cmd != "args"][0]
+    # --profile-samples writes one profile for each sample instead
+    profile_run = args.profile and not getattr(args, "profile_samples", False)
+    with profiler.profile(args.out, "profile_%s" % sub_cmd, profile_run):
+        _run(kwargs)
+    logger.info('It took %.3f minutes' % ((time.time()-start)/60))
+    if args.metrics:
+        metrics.write(args.metrics,
+                      command=" ".join(sys.argv[1:]),
+                      seconds=round(time.time() - start, 3))
+
 
+def _run(kwargs):
+    """Import only the modules of the subcommand, so it starts fast."""
+    logger = mylog.getLogger(__name__)
     if "gff" in kwargs:
+        from mirtop.gff import reader
         logger.info("Run annotation")
         reader(kwargs["args"])
     elif "stats" in kwargs:
+        from mirtop.gff.stats import stats
         logger.info("Run stats.")
         stats(kwargs["args"])
     elif "compare" in kwargs:
+        from mirtop.gff.compare import compare
         logger.info("Run compare.")
         compare(kwargs["args"])
     elif "simulator" in kwargs:
+        from mirtop.libs.simulator import simulate
         logger.info("Run simulation")
         simulate(kwargs["args"])
     elif "counts" in kwargs:
+        from mirtop.gff.convert import convert_gff_counts
         logger.info("Run convert of GFF to TSV containing expression")
         convert_gff_counts(kwargs["args"])
     elif "export" in kwargs:
+        from mirtop.exporter import isomirs
         logger.info("Run export of GFF into other format.")
         isomirs.convert(kwargs["args"])
     elif "validator" in kwargs:
+        from mirtop.gff import validator
         logger.info("Run validator.")
         validator.check_multiple(kwargs["args"])
+    elif "batch" in kwargs:
+        from mirtop.libs.batch import batch
+        logger.info("Run batch.")
+        batch(kwargs["args"])
     elif "query" in kwargs["args"]:
         logger.info("Not yet ready: This will allow queries to GFF files.")
-    logger.info('It took %.3f minutes' % ((time.time()-start)/60))
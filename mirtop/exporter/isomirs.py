@@ -4,11 +4,11 @@ from __future__ import print_function
 import os
 
 import mirtop.libs.logger as mylog
-from mirtop.mirna import fasta, mapper
-from mirtop.gff.body import read_attributes
+from mirtop.mirna import reference
+from mirtop.gff.body import read_attributes, get_sequence
 from mirtop.gff.header import read_samples
 from mirtop.mirna.realign import get_mature_sequence, align_from_variants
-from mirtop.mirna.realign import read_id, variant_to_5p, variant_to_3p, variant_to_add
+from mirtop.mirna.realign import variant_to_5p, variant_to_3p, variant_to_add
 
 logger = mylog.getLogger(__name__)
 
@@ -21,11 +21,10 @@ def convert(args):
       *args*: supported options for this sub-command.
         See *mirtop.libs.parse.add_subparser_export()*.
     """
-    precursors = fasta.read_precursor(args.hairpin, args.sps)
-    matures = mapper.read_gtf_to_precursor(args.gtf)
+    reference.load(args, database=False)
     for fn in args.files:
         logger.info("Reading %s" % fn)
-        _read_file(fn, precursors, matures, args.out)
+        _read_file(fn, args.precursors, args.matures, args.out)
 
 
 def _read_file(fn, precursors, matures, out_dir):
@@ -42,7 +41,7 @@ def _read_file(fn, precursors, matures, out_dir):
                 continue
             cols = line.strip().split("\t")
             attr = read_attributes(line)
-            read = read_id(attr["UID"])
+            read = get_sequence(attr)
             t5 = variant_to_5p(precursors[attr["Parent"]],
                                matures[attr["Parent"]][attr["Name"]],
                                attr["Variant"])
@@ -64,8 +63,8 @@ def _read_file(fn, precursors, matures, out_dir):
             else:
                 mm = "0"
             hit = attr["Hits"] if "Hits" in attr else "1"
-            logger.debug("exporter::isomir::decode %s" % [attr["Variant"],
-                                                          t5, t3, add, mm])
+            logger.debug("exporter::isomir::decode %s", [attr["Variant"],
+                                                         t5, t3, add, mm])
             # Error if attr["Read"] doesn't exist
             line = [read, attr["Read"], "0", attr["Name"], cols[1], cols[2],
                     mm, add, t5, t3, "NA", "NA", "miRNA",  attr["Parent"], hit]
@@ -3,11 +3,11 @@ from __future__ import print_function
 
 import os.path as op
 
-from mirtop.mirna import fasta, mapper
-from mirtop.bam.bam import read_bam
-from mirtop.importer import seqbuster, srnabench, prost, isomirsea
+from mirtop.mirna import reference
+from mirtop.importer import seqbuster, srnabench, prost, isomirsea, fastq
 from mirtop.mirna.annotate import annotate
 from mirtop.gff import body, header, merge
+from mirtop.libs import metrics, prefetch, profiler
 import mirtop.libs.logger as mylog
 logger = mylog.getLogger(__name__)
 
@@ -16,44 +16,74 @@ def reader(args):
     """
     Realign BAM hits to miRBAse to get better accuracy and annotation
     """
+    if args.out_format == "bam" and args.format != "BAM":
+        raise ValueError("--out-format bam only works with BAM files.")
+    if getattr(args, "cohort", False):
+        from mirtop.gff import cohort
+        return cohort.reader(args)
     samples = []
-    database = mapper.guess_database(args.gtf)
-    args.database = database
-    precursors = fasta.read_precursor(args.hairpin, args.sps)
-    args.precursors = precursors
-    matures = mapper.read_gtf_to_precursor(args.gtf)
-    args.matures = matures
+    with metrics.timer("load_reference"):
+        reference.load(args)
+    database = args.database
+    precursors = args.precursors
+    matures = args.matures
     # TODO check numbers of miRNA and precursors read
     # TODO print message if numbers mismatch
     out_dts = dict()
-    for fn in args.files:
-        if args.format != "gff":
+    groups = [_prefetched(fn, args.format) for fn in args.files]
+    with prefetch.prefetch(groups, getattr(args, "prefetch", 0)):
+        for fn in args.files:
             sample = op.splitext(op.basename(fn))[0]
-            samples.append(sample)
-            fn_out = op.join(args.out, sample + ".%s" % args.out_format)
-        if args.format == "BAM":
-            reads = _read_bam(fn, args)
-        elif args.format == "seqbuster":
-            reads = seqbuster.read_file(fn, args)
-        elif args.format == "srnabench":
-            out_dts[fn] = srnabench.read_file(fn, args)
-        elif args.format == "prost":
-            reads = prost.read_file(fn, precursors, database, args.gtf)
-        elif args.format == "isomirsea":
-            out_dts[fn] = isomirsea.read_file(fn, args)
-        elif args.format == "gff":
-            samples.extend(header.read_samples(fn))
-            out_dts[fn] = body.read(fn, args)
-            continue
-        if args.format not in ["isomirsea", "srnabench"]:
-            ann = annotate(reads, matures, precursors)
-            out_dts[fn] = body.create(ann, database, sample, args)
-        h = header.create([sample], database, "")
-        _write(out_dts[fn], h, fn_out)
+            with profiler.profile(args.out, "profile_gff_%s" % sample,
+                                  getattr(args, "profile_samples", False)):
+                if args.format != "gff":
+                    samples.append(sample)
+                    fn_out = op.join(args.out,
+                                     sample + ".%s" % args.out_format)
+                metrics.count("files")
+                if args.format == "BAM" and getattr(args, "threads", 1) > 1:
+                    out_dts[fn] = _create_sharded(fn, database, sample, args)
+                elif args.format == "BAM":
+                    reads = _read_bam(fn, args)
+                elif args.format == "seqbuster":
+                    with metrics.timer("import"):
+                        reads = seqbuster.read_file(fn, args)
+                elif args.format == "fastq":
+                    with metrics.timer("import"):
+                        reads = fastq.read_file(fn, args)
+                elif args.format == "srnabench":
+                    with metrics.timer("import"):
+                        out_dts[fn] = srnabench.read_file(fn, args)
+                elif args.format == "prost":
+                    with metrics.timer("import"):
+                        reads = prost.read_file(fn, args)
+                elif args.format == "isomirsea":
+                    with metrics.timer("import"):
+                        out_dts[fn] = isomirsea.read_file(fn, args)
+                elif args.format == "gff":
+                    samples.extend(header.read_samples(fn))
+                    with metrics.timer("import"):
+                        out_dts[fn] = body.read(fn, args)
+                    continue
+                if fn not in out_dts:
+                    with metrics.timer("annotate"):
+                        ann = annotate(reads, matures, precursors)
+                    metrics.count("annotate.reads", len(ann))
+                    with metrics.timer("create"):
+                        out_dts[fn] = body.create(ann, database, sample, args)
+                with metrics.timer("write"):
+                    if args.out_format == "bam":
+                        _write_bam(fn, out_dts[fn], fn_out, args)
+                    else:
+                        h = header.create([sample], database, "")
+                        _write(out_dts[fn], h, fn_out)
     # merge all reads for all samples into one dict
-    merged = merge.merge(out_dts, samples)
-    fn_merged_out = op.join(args.out, "mirtop.%s" % args.out_format)
-    _write(merged, header.create(samples, database, ""), fn_merged_out)
+    with metrics.timer("merge"):
+        merged = merge.merge(out_dts, samples)
+    out_format = "gff" if args.out_format == "bam" else args.out_format
+    fn_merged_out = op.join(args.out, "mirtop.%s" % out_format)
+    with metrics.timer("write"):
+        _write(merged, header.create(samples, database, ""), fn_merged_out)
 
 
 def _write(lines, header, fn):
@@ -66,11 +96,36 @@ def _write(lines, header, fn):
     out_handle.close()
 
 
-def _read_bam(bam_fn, precursors):
+def _prefetched(fn, input_format):
+    """Text files read by the importer of *input_format*."""
+    if input_format == "srnabench":
+        return [op.join(fn, "reads.annotation"),
+                op.join(fn, "microRNAannotation.txt")]
+    if input_format in ["seqbuster", "prost", "isomirsea", "gff"]:
+        return [fn]
+    return []
+
+
+def _write_bam(bam_fn, lines, fn_out, args):
+    from mirtop.bam.bam import write_bam, io_threads
+    if op.abspath(bam_fn) == op.abspath(fn_out):
+        raise ValueError("Output file is the input file: %s" % fn_out)
+    return write_bam(bam_fn, lines, fn_out, io_threads(args))
+
+
+def _read_bam(bam_fn, args):
+    # pysam is only needed for BAM files
+    from mirtop.bam.bam import read_bam
     if bam_fn.endswith("bam") or bam_fn.endswith("sam"):
         logger.info("Reading %s" % bam_fn)
-        reads = read_bam(bam_fn, precursors)
+        reads = read_bam(bam_fn, args)
     else:
         raise ValueError("Format not recognized."
                          " Only working with BAM/SAM files.")
     return reads
+
+
+def _create_sharded(bam_fn, database, sample, args):
+    from mirtop.bam.bam import create_sharded
+    logger.info("Reading %s with %s processes" % (bam_fn, args.threads))
+    return create_sharded(bam_fn, database, sample, args, args.threads)
@@ -4,6 +4,8 @@ from collections import defaultdict, OrderedDict
 from mirtop.mirna.realign import get_mature_sequence, align_from_variants, \
     read_id, variant_to_5p, variant_to_3p, variant_to_add
 from mirtop.gff.header import read_samples
+from mirtop.libs import metrics
+from mirtop.libs.prefetch import open_file
 
 import mirtop.libs.logger as mylog
 logger = mylog.getLogger(__name__)
@@ -13,7 +15,7 @@ def read(fn, args):
     """Read GTF/GFF file and load into annotate, chrom counts, sample, line"""
     samples = read_samples(fn)
     lines = defaultdict(dict)
-    with open(fn) as inh:
+    with open_file(fn) as inh:
         for line in inh:
             if line.startswith("#"):
                 continue
@@ -46,6 +48,7 @@ def create(reads, database, sample, args):
     if args.add_extra:
         precursors = args.precursors
         matures = args.matures
+    debug = mylog.is_debug()
     for r, read in reads.iteritems():
         hits = set()
         [hits.add(mature.mirna) for mature in read.precursors.values()
@@ -86,10 +89,13 @@ def create(reads, database, sample, args):
                          " Filter {Filter}; Hits {hits};").format(**locals())
                 line = ("{chrom}\t{database}\t{source}\t{start}\t{end}"
                         "\t{score}\t{strand}\t.\t{attrb}").format(**locals())
-                logger.debug("GFF::%s" % line)
+                if debug:
+                    logger.debug("GFF::%s" % line)
                 if args.add_extra:
                     extra = variant_with_nt(line, precursors, matures)
                     line = "%s Changes %s;" % (line, extra)
+                if getattr(args, "add_seq", False):
+                    line = "%s Seq %s;" % (line, seq)
 
                 line = paste_columns(read_gff_line(line), sep=sep)
                 if annotation in seen_ann and seq.find("N") < 0 and (
@@ -99,12 +105,14 @@ def create(reads, database, sample, args):
                         " \n%s and \n%s" % (annotation, line,
                                             seen_ann[annotation]))
                 seen_ann[annotation] = line
-                logger.debug("GFF::external %s" % iso.external)
+                if debug:
+                    logger.debug("GFF::external %s" % iso.external)
                 if start not in lines[chrom]:
                     lines[chrom][start] = []
                 lines[chrom][start].append([annotation, chrom,
                                             counts, sample, line])
-                logger.debug("GFF::%s" % line)
+                if debug:
+                    logger.debug("GFF::%s" % line)
                 n_hits += 1
             else:
                 n_seen += 1
@@ -115,6 +123,11 @@ def create(reads, database, sample, args):
     logger.info("Filtered by being outside miRNA positions:"
                 " %s" % filter_precursor)
     logger.info("Filtered by being low score: %s" % filter_score)
+    metrics.count("create.reads", n_reads)
+    metrics.count("create.hits", n_hits)
+    metrics.count("create.filter_duplicated", n_seen)
+    metrics.count("create.filter_precursor", filter_precursor)
+    metrics.count("create.filter_score", filter_score)
     return lines
 
 
@@ -155,15 +168,15 @@ def read_variant(attrb, sep=" "):
             >>> {'iso_3p': -3, ...}
     """
     gff_dict = OrderedDict()
-    logger.debug("variant: %s" % attrb)
+    logger.debug("variant: %s", attrb)
     for gff_item in attrb.strip().split(","):
         item_pair = gff_item.strip().split(":")
         if len(item_pair) > 1:
             gff_dict[item_pair[0].strip()] = int(item_pair[1].strip())
         else:
             gff_dict[item_pair[0].strip()] = True
-    logger.debug("Keys found: %s" % gff_dict.keys())
-    logger.debug("Values found: %s" % gff_dict.values())
+    logger.debug("Keys found: %s", gff_dict.keys())
+    logger.debug("Values found: %s", gff_dict.values())
     return gff_dict
 
 
@@ -189,17 +202,47 @@ def read_gff_line(line):
     return fields
 
 
+def get_sequence(attr):
+    """
+    Get the sequence of a GFF line from the Seq attribute
+    when it was added with --add-seq, or decoding the UID.
+
+    Args:
+        *attr(dict)*: attributes from *read_attributes()*.
+
+    Returns:
+        *(str)*: nucleotides sequence.
+    """
+    if "Seq" in attr:
+        return attr["Seq"]
+    return read_id(attr["UID"])
+
+
 def variant_with_nt(line, precursors, matures):
     """
     Return nucleotides changes for each variant type
     using Variant attribute, precursor sequences and
     mature position.
     """
-    cols = read_gff_line(line)
-    attr = cols["attrb"]
-    read = read_id(attr["UID"])
-    logger.debug("GFF::BODY::precursors %s" % precursors[attr["Parent"]])
-    logger.debug("GFF:BODY::mature %s" % matures[attr["Parent"]][attr["Name"]])
+    return variant_with_nt_attr(read_gff_line(line)["attrb"],
+                                precursors, matures)
+
+
+def variant_with_nt_attr(attr, precursors, matures):
+    """
+    Same as *variant_with_nt()* from the attributes of a line
+    already parsed or not pasted yet.
+
+    Args:
+        *attr(dict)*: attributes with *Parent*, *Name*, *Variant*
+            and *UID* or *Seq*, as from *read_attributes()*.
+
+    Returns:
+        *(str)*: nucleotides changes for each variant type.
+    """
+    read = get_sequence(attr)
+    logger.debug("GFF::BODY::precursors %s", precursors[attr["Parent"]])
+    logger.debug("GFF:BODY::mature %s", matures[attr["Parent"]][attr["Name"]])
     t5 = variant_to_5p(precursors[attr["Parent"]],
                        matures[attr["Parent"]][attr["Name"]],
                        attr["Variant"])
@@ -211,7 +254,7 @@ def variant_with_nt(line, precursors, matures):
     mature_sequence = get_mature_sequence(
         precursors[attr["Parent"]],
         matures[attr["Parent"]][attr["Name"]])
-    logger.debug("GFF::BODY::mature_sequence %s" % mature_sequence)
+    logger.debug("GFF::BODY::mature_sequence %s", mature_sequence)
     mm = align_from_variants(read,
                              mature_sequence,
                              attr["Variant"])
@@ -0,0 +1,177 @@
+"""Annotate each unique sequence of many samples once"""
+
+import os.path as op
+from collections import defaultdict, OrderedDict
+
+from mirtop.mirna import reference
+from mirtop.mirna.annotate import annotate
+from mirtop.mirna.realign import isomir, hits
+from mirtop.bam import filter
+from mirtop.gff import body, header
+from mirtop.libs import metrics, prefetch
+from mirtop.libs.utils import get_freq
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+FORMATS = ["BAM", "fastq", "seqbuster", "prost"]
+
+
+def reader(args):
+    """
+    Build a table of unique sequences with the counts of each sample,
+    annotate each sequence once and write the merged GFF file,
+    `mirtop.<out_format>`, with one column of counts for each sample.
+    It doesn't write one GFF file for each sample. The lines are the
+    same as in the file of *mirtop.gff.merge.merge()*, but lines with
+    the same start can be in a different order.
+
+    BAM/SAM files don't need to be sorted, and reads without
+    `_x<count>` in the name count as one read.
+
+    Args:
+        *args(namedtuple)*: arguments parsed from command line with
+            *mirtop.libs.parse.add_subparser_gff()*.
+
+    Returns:
+        *fn_out(str)*: merged GFF file.
+    """
+    if args.out_format == "bam":
+        raise ValueError("--cohort only writes the merged GFF/GTF file.")
+    if args.format not in FORMATS:
+        raise ValueError("--cohort only works with %s formats." %
+                         ", ".join(FORMATS))
+    with metrics.timer("load_reference"):
+        reference.load(args)
+    samples = [op.splitext(op.basename(fn))[0] for fn in args.files]
+    table = OrderedDict()
+    counts = defaultdict(lambda: [0] * len(samples))
+    groups = [[fn] if args.format in ["seqbuster", "prost"] else []
+              for fn in args.files]
+    with prefetch.prefetch(groups, getattr(args, "prefetch", 0)):
+        for idx, fn in enumerate(args.files):
+            logger.info("Reading %s" % fn)
+            metrics.count("files")
+            with metrics.timer("import"):
+                _add_sample(fn, idx, table, counts, args)
+    logger.info("Unique sequences: %s" % len(table))
+    metrics.count("cohort.sequences", len(table))
+    with metrics.timer("tune"):
+        reads = _get_hits(table, counts, args)
+    with metrics.timer("annotate"):
+        ann = annotate(reads, args.matures, args.precursors)
+    metrics.count("annotate.reads", len(ann))
+    for r in ann:
+        ann[r].counts = ",".join(map(str, counts[ann[r].sequence]))
+    with metrics.timer("create"):
+        lines = body.create(ann, args.database, "cohort", args)
+    from mirtop.gff import _write
+    fn_out = op.join(args.out, "mirtop.%s" % args.out_format)
+    with metrics.timer("write"):
+        _write(lines, header.create(samples, args.database, ""), fn_out)
+    return fn_out
+
+
+def _add_sample(fn, idx, table, counts, args):
+    """
+    Add counts of sample *idx* to *counts*, and new sequences to *table*
+    with the information needed to place them on the precursors.
+    """
+    if args.format == "BAM":
+        from mirtop.bam.bam import io_threads
+        for seq, name, count, alignments in _read_bam(fn, io_threads(args)):
+            counts[seq][idx] += count
+            if seq not in table:
+                table[seq] = [name, alignments]
+    elif args.format == "fastq":
+        from mirtop.importer import fastq
+        for seq, count in fastq.collapse(fn).items():
+            counts[seq][idx] += count
+            if seq not in table:
+                table[seq] = [None, None]
+    else:
+        from mirtop.importer import seqbuster, prost
+        if args.format == "seqbuster":
+            reads = seqbuster.read_file(fn, args)
+        else:
+            reads = prost.read_file(fn, args)
+        for name in reads:
+            seq = reads[name].sequence
+            counts[seq][idx] += int(reads[name].counts)
+            if seq not in table:
+                table[seq] = [name, reads[name]]
+
+
+def _read_bam(fn, threads=1):
+    """
+    Read BAM/SAM file grouping alignments by read name, with
+    *threads* to decompress it.
+
+    Returns:
+        *(generator)*: sequence, name, counts and
+            alignments as (precursor, start, cigar).
+    """
+    import pysam
+    mode = "r" if fn.endswith("sam") else "rb"
+    reads = OrderedDict()
+    handle = pysam.AlignmentFile(fn, mode, threads=threads)
+    for line in handle:
+        if line.reference_id < 0:
+            continue
+        if line.query_name not in reads:
+            reads[line.query_name] = [None, []]
+        if line.query_sequence:
+            reads[line.query_name][0] = line.query_sequence
+        if not line.is_reverse:
+            reads[line.query_name][1].append(
+                (line.reference_name, line.reference_start,
+                 line.cigartuples))
+    handle.close()
+    for name, (seq, alignments) in reads.items():
+        if not seq or seq.find("N") > -1:
+            continue
+        yield seq, name, get_freq(name) or 1, alignments
+
+
+def _get_hits(table, counts, args):
+    """
+    Place each unique sequence on the precursors. Hits of BAM and
+    FASTQ files keep only the best ones like *mirtop.bam.bam.read_bam()*.
+
+    Returns:
+        *reads*: dictionary where keys are read_id and values are *mirtop.realign.hits*
+    """
+    precursors = args.precursors
+    reads = dict()
+    aligned = defaultdict(hits)
+    unplaced = OrderedDict()
+    debug = mylog.is_debug()
+    for seq, (name, info) in table.items():
+        if name is None:
+            unplaced[seq] = sum(counts[seq])
+            continue
+        # the same name can be used by other sequence in other sample
+        if name in reads or name in aligned:
+            name = "%s_%s" % (name, len(reads) + len(aligned))
+        if isinstance(info, hits):
+            reads[name] = info
+            continue
+        for chrom, start, cigar in info:
+            if len(precursors[chrom]) < start + len(seq):
+                continue
+            iso = isomir()
+            iso.set_pos(start, len(seq))
+            iso.subs, iso.add, iso.cigar = filter.tune(
+                seq, precursors[chrom], start, cigar)
+            if debug:
+                logger.debug("COHORT::%s %s start %s subs %s" % (
+                    name, chrom, start, iso.subs))
+            if len(iso.subs) < 2:
+                if name not in aligned:
+                    aligned[name].set_sequence(seq)
+                aligned[name].set_precursor(chrom, iso)
+    reads.update(filter.clean_hits(aligned))
+    if unplaced:
+        from mirtop.importer import fastq
+        reads.update(fastq.place(unplaced, args))
+    return reads
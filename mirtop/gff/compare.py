@@ -5,13 +5,17 @@ Compare multiple GFF files to a reference
 from __future__ import print_function
 
 import os
+import multiprocessing
 
 from mirtop.gff.body import read_gff_line
-from mirtop.mirna.realign import read_id
+from mirtop.mirna.realign import read_ids
 import mirtop.libs.logger as mylog
 
 logger = mylog.getLogger(__name__)
 
+# reference set shared with the forked workers of _compare_parallel
+_REFERENCE = None
+
 
 def compare(args):
     """
@@ -25,20 +29,25 @@ def compare(args):
     Returns:
         *(out_file)*: comparison of the GFF files with the reference.
     """
-    out = list()
     result = dict()
     reference = read_reference(args.files[0])
     for fn in args.files[1:]:
         if not os.path.exists(fn):
             raise IOError("%s doesn't exist" % fn)
-        result[os.path.basename(fn)] = _compare_to_reference(fn, reference)
+    threads = getattr(args, "threads", 1)
+    if threads > 1 and len(args.files) > 2:
+        result = _compare_parallel(args.files[1:], reference, threads)
+    else:
+        for fn in args.files[1:]:
+            result[os.path.basename(fn)] = _compare_to_reference(fn,
+                                                                 reference)
     if args.out != "tmp_mirtop":
         fn_out = os.path.join(args.out, "summary.txt")
         with open(fn_out, 'w') as outh:
             for fn in result:
                 print("sample\tidu\tseq\ttag\tsame_mirna\t%s" % "\t".join(result[fn][0][3].keys()), file=outh)
-                for line in result[fn]:
-                    read = read_id(line[0])
+                reads = read_ids([line[0] for line in result[fn]])
+                for line, read in zip(result[fn], reads):
                     acc = "\t".join([line[3][v] for v in line[3]])
                     print("%s\t%s\t%s\t%s\t%s\t%s" % (fn, line[0], read, line[1], line[2], acc), file=outh)
 
@@ -63,6 +72,40 @@ def read_reference(fn):
     return srna
 
 
+def _compare_parallel(files, reference, threads):
+    """Compare files to the reference using a pool of processes.
+
+    The reference is stored in a module variable before the pool
+    is created, so the forked workers share it through copy-on-write
+    instead of receiving a pickled copy with each file.
+
+    Args:
+        *files (list)*: GFF files to compare.
+
+        *reference (dict)*: output of *read_reference()*.
+
+        *threads (int)*: number of processes.
+
+    Returns:
+        *result (dict)*: {'file_name': output of *_compare_to_reference()*}
+    """
+    global _REFERENCE
+    _REFERENCE = reference
+    pool = multiprocessing.Pool(min(threads, len(files)))
+    try:
+        tables = pool.map(_compare_worker, files)
+    finally:
+        pool.close()
+        pool.join()
+        _REFERENCE = None
+    return dict(zip([os.path.basename(fn) for fn in files], tables))
+
+
+def _compare_worker(fn):
+    logger.info("Comparing %s" % fn)
+    return _compare_to_reference(fn, _REFERENCE)
+
+
 def _compare_to_reference(fn, reference):
     same = 0
     diff = list()
@@ -122,7 +165,7 @@ def _accuracy(target, reference):
            FN: no in target
            TP: same values
     """
-    logger.debug("COMPARE::ACCURACY::values %s vs %s" % (target, reference))
+    logger.debug("COMPARE::ACCURACY::values %s vs %s", target, reference)
     accuracy = dict()
     types =  ["iso_5p", "iso_3p", "iso_add", "iso_snp",
               "iso_snp_seed", "iso_snp_central",
@@ -132,6 +175,6 @@ def _accuracy(target, reference):
             accuracy[t] = "TP" if t in target else "FN"
         else:
             accuracy[t] = "TN" if t not in target else "FP"
-    logger.debug("COMPARE::ACCURACY::%s" % accuracy.keys())
-    logger.debug("COMPARE::ACCURACY::%s" % accuracy.values())
+    logger.debug("COMPARE::ACCURACY::%s", accuracy.keys())
+    logger.debug("COMPARE::ACCURACY::%s", accuracy.values())
     return accuracy
@@ -4,9 +4,8 @@ from __future__ import print_function
 
 import os.path as op
 
-from mirtop.mirna import fasta, mapper
-from mirtop.mirna.realign import read_id
-from mirtop.gff.body import read_gff_line, variant_with_nt
+from mirtop.mirna import reference
+from mirtop.gff.body import read_gff_line, variant_with_nt, get_sequence
 import mirtop.libs.logger as mylog
 
 logger = mylog.getLogger(__name__)
@@ -27,8 +26,9 @@ def convert_gff_counts(args):
     variant_header = sep.join(['iso_5p', 'iso_3p',
                                'iso_add', 'iso_snp'])
     if args.add_extra:
-        precursors = fasta.read_precursor(args.hairpin, args.sps)
-        matures = mapper.read_gtf_to_precursor(args.gtf)
+        reference.load(args, database=False)
+        precursors = args.precursors
+        matures = args.matures
         variant_header = sep.join([variant_header,
                                    'iso_5p_nt', 'iso_3p_nt',
                                    'iso_add_nt', 'iso_snp_nt'])
@@ -41,6 +41,7 @@ def convert_gff_counts(args):
     missing_parent = 0
     missing_mirna = 0
     unvalid_uid = 0
+    debug = mylog.is_debug()
     with open(out_file, 'w') as outh:
 
         for samples_line in gff_file:
@@ -59,15 +60,16 @@ def convert_gff_counts(args):
             parent = mirna_values["attrb"]["Parent"]
             variant = mirna_values["attrb"]["Variant"]
             try:
-                read_id(UID)
+                get_sequence(mirna_values["attrb"])
             except KeyError:
                 unvalid_uid += 1
                 continue
 
             expression = sep.join(mirna_values["attrb"]["Expression"].strip().split(","))
             cols_variants = sep.join(_expand(variant))
-            logger.debug("COUNTS::Read:%s" % Read)
-            logger.debug("COUNTS::EXTRA:%s" % variant)
+            if debug:
+                logger.debug("COUNTS::Read:%s" % Read)
+                logger.debug("COUNTS::EXTRA:%s" % variant)
             if args.add_extra:
                 if parent not in precursors:
                     missing_parent += 1
@@ -78,11 +80,13 @@ def convert_gff_counts(args):
                 extra = variant_with_nt(mirna_line, precursors, matures)
                 if extra == "Invalid":
                     continue
-                logger.debug("COUNTS::EXTRA:%s" % extra)
+                if debug:
+                    logger.debug("COUNTS::EXTRA:%s" % extra)
                 cols_variants = sep.join([cols_variants] + _expand(extra, True))
             summary = sep.join([UID, Read,  mirna, variant,
                                 cols_variants, expression])
-            logger.debug(summary)
+            if debug:
+                logger.debug(summary)
             print(summary, file=outh)
 
     gff_file.close()
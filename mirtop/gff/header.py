@@ -2,6 +2,7 @@
 
 from mirtop.gff import gff_versions as version
 import mirtop.libs.logger as mylog
+from mirtop.libs.prefetch import open_file
 logger = mylog.getLogger(__name__)
 
 
@@ -60,7 +61,7 @@ def read_samples(fn):
     Returns:
         *(list)*: character list with sample names.
     """
-    with open(fn) as inh:
+    with open_file(fn) as inh:
         for line in inh:
             if line.startswith("## COLDATA"):
                 return line.strip().split(": ")[1].strip().split(",")
@@ -24,14 +24,17 @@ def merge(dts, samples):
     all_data = defaultdict(dict)
     all_lines = defaultdict(list)
     merged_lines = defaultdict(dict)
+    debug = mylog.is_debug()
     for fn in dts:
         for m in dts[fn]:
             for s in dts[fn][m]:
                 for hit in dts[fn][m][s]:
                     idu = hit[0]
-                    logger.debug("MERGE::SAMPLES::counts %s" % [hit[3], hit[2]])
+                    if debug:
+                        logger.debug("MERGE::SAMPLES::counts %s" % [hit[3], hit[2]])
                     formatted_counts = _format_samples_counts(hit[3], hit[2])
-                    logger.debug("MERGE::SAMPLES::fixed %s" % formatted_counts)
+                    if debug:
+                        logger.debug("MERGE::SAMPLES::fixed %s" % formatted_counts)
                     for sample in formatted_counts:
                         all_data[idu][sample] = formatted_counts[sample] # get the expression of the sample from line
                     all_lines[idu] = hit[4] # get the line
@@ -64,7 +64,7 @@ def _calc_stats(fn):
             if line.startswith("#"):
                 continue
             cols = read_gff_line(line)
-            logger.debug("## STATS: attribute %s" % cols['attrb'])
+            logger.debug("## STATS: attribute %s", cols['attrb'])
             attr = cols['attrb']
             if attr['Filter'] != "Pass":
                 continue
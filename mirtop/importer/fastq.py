@@ -0,0 +1,128 @@
+""" Read FASTQ files and place reads on the precursors"""
+
+from collections import defaultdict
+
+import mirtop.libs.logger as mylog
+from mirtop.libs import metrics
+from mirtop.libs.fastq import open_fastq
+from mirtop.libs.utils import get_freq
+from mirtop.mirna import reference
+from mirtop.mirna.realign import isomir, hits
+from mirtop.bam import filter
+
+logger = mylog.getLogger(__name__)
+
+
+def read_file(fn, args):
+    """
+    Collapse reads of a FASTQ/FASTA file and place the unique
+    sequences on the precursors with *mirtop.mirna.index.kmer_index*.
+
+    Args:
+        *fn(str)*: FASTQ or FASTA file, can be gzipped. FASTA names
+            with `_x<count>` are already collapsed reads.
+
+        *args(namedtuple)*: arguments from command line.
+            See *mirtop.libs.parse.add_subparser_gff()*.
+
+    Returns:
+        *reads*: dictionary where keys are read_id and values are *mirtop.realign.hits*
+
+    """
+    with metrics.timer("collapse"):
+        counts = collapse(fn)
+    return place(counts, args)
+
+
+def place(counts, args):
+    """
+    Place unique sequences on the precursors with the k-mer index
+    of *mirtop.mirna.reference.index()* and tune them.
+
+    Args:
+        *counts(dict)*: keys are sequences and values counts,
+            see *collapse()*.
+
+        *args(namedtuple)*: arguments with *precursors*.
+
+    Returns:
+        *reads*: dictionary where keys are `seq_<n>_x<count>` and
+            values are *mirtop.realign.hits*
+    """
+    precursors = args.precursors
+    with metrics.timer("index"):
+        index = reference.index(args)
+    metrics.count("collapse.sequences", len(counts))
+    logger.info("Unique sequences: %s" % len(counts))
+    reads = defaultdict(hits)
+    debug = mylog.is_debug()
+    ordered = sorted(counts.items(), key=lambda seq: (-seq[1], seq[0]))
+    for idx, (seq, count) in enumerate(ordered):
+        query_name = "seq_%s_x%s" % (idx, count)
+        for chrom, start, cigar in index.map(seq):
+            iso = isomir()
+            iso.set_pos(start, len(seq))
+            iso.subs, iso.add, iso.cigar = filter.tune(
+                seq, precursors[chrom], start, cigar)
+            if debug:
+                logger.debug("FASTQ::%s %s start %s subs %s add %s" % (
+                    query_name, chrom, start, iso.subs, iso.add))
+            if len(iso.subs) < 2:
+                if query_name not in reads:
+                    reads[query_name].set_sequence(seq)
+                    reads[query_name].counts = count
+                reads[query_name].set_precursor(chrom, iso)
+    logger.info("Hits: %s" % len(reads))
+    reads = filter.clean_hits(reads)
+    return reads
+
+
+def collapse(fn):
+    """
+    Count identical reads.
+
+    Args:
+        *fn(str)*: FASTQ or FASTA file.
+
+    Returns:
+        *(dict)*: keys are sequences and values counts.
+    """
+    counts = defaultdict(int)
+    handle = open_fastq(fn)
+    try:
+        first = handle.readline()
+        if first.startswith(">"):
+            _collapse_fasta(handle, first, counts)
+        else:
+            _collapse_fastq(handle, first, counts)
+    finally:
+        handle.close()
+    return counts
+
+
+def _collapse_fastq(handle, first, counts):
+    line = first
+    while line:
+        seq = handle.readline().strip().upper()
+        handle.readline()
+        handle.readline()
+        if seq and seq.find("N") < 0:
+            counts[seq.replace("U", "T")] += 1
+        line = handle.readline()
+
+
+def _collapse_fasta(handle, first, counts):
+    name, seq = first, []
+    for line in handle:
+        if line.startswith(">"):
+            _add_fasta(name, seq, counts)
+            name, seq = line, []
+        else:
+            seq.append(line.strip().upper())
+    _add_fasta(name, seq, counts)
+
+
+def _add_fasta(name, seq, counts):
+    seq = "".join(seq).replace("U", "T")
+    if seq and seq.find("N") < 0:
+        counts[seq] += get_freq(name.strip()) or 1
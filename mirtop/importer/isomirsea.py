@@ -1,9 +1,11 @@
 """ Read isomiR GFF files"""
 
+import bisect
 import os
 from collections import defaultdict, Counter
 
 import mirtop.libs.logger as mylog
+from mirtop.libs.prefetch import open_file
 from mirtop.mirna import mapper
 from mirtop.mirna.realign import expand_cigar, make_id
 from mirtop.gff.body import read_attributes, paste_columns
@@ -11,6 +13,9 @@ from mirtop.gff.body import variant_with_nt, read_gff_line
 
 logger = mylog.getLogger(__name__)
 
+# transcript_index of each GTF file
+_INDEX = dict()
+
 
 def header(fn):
     """
@@ -43,15 +48,17 @@ def read_file(fn, args):
 
     """
     database = args.database
-    gtf = args.gtf
     sep = " " if args.out_format == "gtf" else "="
-    map_mir = mapper.read_gtf_to_mirna(gtf)
+    index = _cached_index(args.gtf)
     reads = defaultdict(dict)
     reads_in = 0
     sample = os.path.splitext(os.path.basename(fn))[0]
-    hits = _get_hits(fn)
+    # lines are kept until all hits of each UID are counted
+    hits = Counter()
+    buffered = []
     logger.debug("ISOMIRSEA::SAMPLE::%s" % sample)
-    with open(fn) as handle:
+    debug = mylog.is_debug()
+    with open_file(fn) as handle:
         for line in handle:
             cols = line.strip().split("\t")
             attr = read_attributes(line, "=")
@@ -69,15 +76,17 @@ def read_file(fn, args):
             # logger.debug("SEQBUSTER:: cigar {cigar}".format(**locals()))
             cigar = attr['CI'].replace("U", "T")
             idu = make_id(query_sequence)
+            hits[idu] += 1
             isoformat = cigar2variants(cigar, query_sequence, attr['ISO'])
-            logger.debug("\nISOMIRSEA::NEW::query: {query_sequence}\n"
-                         "  precursor {chrom}\n"
-                         "  name: {query_name}\n"
-                         "  idu: {idu}\n"
-                         "  start: {start}\n"
-                         "  cigar: {cigar}\n"
-                         "  iso: {isoformat}\n"
-                         "  variant: {isoformat}".format(**locals()))
+            if debug:
+                logger.debug("\nISOMIRSEA::NEW::query: {query_sequence}\n"
+                             "  precursor {chrom}\n"
+                             "  name: {query_name}\n"
+                             "  idu: {idu}\n"
+                             "  start: {start}\n"
+                             "  cigar: {cigar}\n"
+                             "  iso: {isoformat}\n"
+                             "  variant: {isoformat}".format(**locals()))
             source = "isomiR" if isoformat != "NA" else "ref_miRNA"
             strand = "+"
             database = cols[1]
@@ -86,51 +95,57 @@ def read_file(fn, args):
             score = "."
             Filter = attr['FILTER']
             isotag = attr['ISO']
-            tchrom, tstart = _genomic2transcript(map_mir[mirName],
-                                                 chrom, start)
+            tchrom, tstart = index.transcript(mirName, chrom, start)
             start = start if not tstart else tstart
             chrom = chrom if not tstart else tchrom
             end = start + len(query_sequence)
-            hit = hits[idu]
-            attrb = ("Read {query_sequence}; UID {idu}; Name {mirName};"
-                     " Parent {preName}; Variant {isoformat};"
-                     " Isocode {isotag}; Cigar {cigar}; Expression {counts};"
-                     " Filter {Filter}; Hits {hit};").format(**locals())
-            line = ("{chrom}\t{database}\t{source}\t{start}\t{end}\t"
-                    "{score}\t{strand}\t.\t{attrb}").format(**locals())
-            if args.add_extra:
-                extra = variant_with_nt(line, args.precursors, args.matures)
-                line = "%s Changes %s;" % (line, extra)
-
-            line = paste_columns(read_gff_line(line), sep=sep)
             if start not in reads[chrom]:
                 reads[chrom][start] = []
             if Filter == "Pass":
-                reads_in += 1
-                reads[chrom][start].append([idu, chrom, counts, sample, line])
+                buffered.append(dict(
+                    query_sequence=query_sequence, idu=idu, mirName=mirName,
+                    preName=preName, isoformat=isoformat, isotag=isotag,
+                    cigar=cigar, counts=counts, Filter=Filter, chrom=chrom,
+                    database=database, source=source, start=start, end=end,
+                    score=score, strand=strand))
+
+    for fields in buffered:
+        hit = hits[fields['idu']]
+        attrb = ("Read {query_sequence}; UID {idu}; Name {mirName};"
+                 " Parent {preName}; Variant {isoformat};"
+                 " Isocode {isotag}; Cigar {cigar}; Expression {counts};"
+                 " Filter {Filter}; Hits {hit};").format(hit=hit, **fields)
+        line = ("{chrom}\t{database}\t{source}\t{start}\t{end}\t"
+                "{score}\t{strand}\t.\t{attrb}").format(attrb=attrb,
+                                                        **fields)
+        if args.add_extra:
+            extra = variant_with_nt(line, args.precursors, args.matures)
+            line = "%s Changes %s;" % (line, extra)
+        if getattr(args, "add_seq", False):
+            line = "%s Seq %s;" % (line, fields['query_sequence'])
+
+        line = paste_columns(read_gff_line(line), sep=sep)
+        reads_in += 1
+        reads[fields['chrom']][fields['start']].append(
+            [fields['idu'], fields['chrom'], fields['counts'], sample, line])
 
     logger.info("Hits: %s" % reads_in)
     return reads
 
 
-def _get_hits(fn):
-    hits = Counter()
-    with open(fn) as handle:
-        for line in handle:
-            attr = read_attributes(line, "=")
-            query_sequence = attr['TS'].replace("U", "T")
-            if query_sequence and query_sequence.find("N") > -1:
-                continue
-            idu = make_id(query_sequence)
-            hits[idu] += 1
-    return hits
+def _cached_index(gtf):
+    """*transcript_index* of the GTF file, built once by process."""
+    if gtf not in _INDEX:
+        _INDEX[gtf] = transcript_index(mapper.read_gtf_to_mirna(gtf))
+    return _INDEX[gtf]
 
 
 def cigar2variants(cigar, sequence, tag):
     """From cigar to Variants in GFF format"""
     pos = 0
     iso5p = 0
-    logger.debug("\nISOMIRSEA:: expanded: %s" % expand_cigar(cigar))
+    if mylog.is_debug():
+        logger.debug("\nISOMIRSEA:: expanded: %s" % expand_cigar(cigar))
     for l in expand_cigar(cigar):
         if l == "I":
             iso5p += 1
@@ -169,7 +184,7 @@ def cigar2variants(cigar, sequence, tag):
 
 def _define_snp(subs):
     value = ""
-    logger.debug("\nISOMIRSEA:: subs %s" % subs)
+    logger.debug("\nISOMIRSEA:: subs %s", subs)
     for sub in subs:
         if sub:
             if sub[0] > 1 and sub[0] < 8:
@@ -191,32 +206,60 @@ def _fix(n):
     return n
 
 
-def _genomic2transcript(code, chrom, pos):
-    for ref in code:
-        if _is_chrom(chrom, code[ref][0]):
-            if _is_inside(pos, code[ref][1:3]):
-                return [ref, _transcript(pos, code[ref][1:4])]
-    return [None, None]
-
+class transcript_index(object):
+    """
+    Precursors of each chromosome sorted by genomic start, to find
+    the precursor of a miRNA containing a genomic position with
+    a binary search instead of checking all of them.
 
-def _is_chrom(chrom, annotated):
-    logger.debug("TRANSCRIPT::CHROM::read position %s and db position %s" % (chrom, annotated))
-    if chrom == annotated:
-        return True
-    if chrom == annotated.replace("chr", ""):
-        return True
-    return False
+    Chromosomes are found with and without the `chr` prefix of
+    the GTF file.
 
+    Args:
+        *map_mir(dict)*: from *mirtop.mirna.mapper.read_gtf_to_mirna()*.
+    """
 
-def _is_inside(pos, annotated):
-    logger.debug("TRANSCRIPT::INSIDE::read position %s and db position %s" % (pos, annotated))
-    if pos > annotated[0] and pos < annotated[1]:
-        return True
-    return False
+    def __init__(self, map_mir):
+        self.mirnas = dict()
+        intervals = defaultdict(dict)
+        for mirna in map_mir:
+            self.mirnas[mirna] = list(map_mir[mirna])
+            for ref, (chrom, start, end, strand) in map_mir[mirna].items():
+                for name in set([chrom, chrom.replace("chr", "")]):
+                    intervals[name][ref] = (start, end, strand, ref)
+        self.intervals = dict()
+        self.starts = dict()
+        self.size = dict()
+        for chrom in intervals:
+            self.intervals[chrom] = sorted(intervals[chrom].values())
+            self.starts[chrom] = [i[0] for i in self.intervals[chrom]]
+            self.size[chrom] = max(i[1] - i[0] for i in self.intervals[chrom])
+
+    def transcript(self, mirna, chrom, pos):
+        """
+        Get the position in the precursor of *mirna* of a
+        genomic position, if it is inside one.
+
+        Returns:
+            *(list)*: precursor and position, or [None, None].
+        """
+        if chrom not in self.starts or mirna not in self.mirnas:
+            return [None, None]
+        intervals = self.intervals[chrom]
+        inside = dict()
+        idx = bisect.bisect_left(self.starts[chrom], pos) - 1
+        while idx >= 0 and intervals[idx][0] >= pos - self.size[chrom]:
+            if pos < intervals[idx][1]:
+                inside[intervals[idx][3]] = intervals[idx][:3]
+            idx -= 1
+        for ref in self.mirnas[mirna]:
+            if ref in inside:
+                return [ref, _transcript(pos, inside[ref])]
+        return [None, None]
 
 
 def _transcript(pos, annotated):
-    logger.debug("TRANSCRIPT::TRANSCRIPT::read position %s and db position %s" % (pos, annotated))
+    logger.debug("TRANSCRIPT::TRANSCRIPT::read position %s and db position %s", pos, annotated)
     if annotated[2] == "+":
         return pos - annotated[0]
     elif annotated[2] == "-":
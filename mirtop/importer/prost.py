@@ -1,15 +1,19 @@
 """ Read prost! files"""
 
-import os
 from collections import defaultdict
 
-from mirtop.mirna import mapper
+from mirtop.mirna import reference
 import mirtop.libs.logger as mylog
+from mirtop.libs.prefetch import open_file
 from mirtop.mirna.realign import isomir, hits, get_mature_sequence, align
 from mirtop.bam import filter
 
 logger = mylog.getLogger(__name__)
 
+# sequences placed on the precursors by _place()
+_PLACED = dict()
+CACHE_SIZE = 1000000
+
 
 def header():
     """
@@ -22,16 +26,20 @@ def header():
     return ""
 
 
-def read_file(fn, hairpins, database, mirna_gtf):
+def read_file(fn, args):
     """
     Read PROST! file and convert to mirtop GFF format.
 
+    The file is read once: miRNA and precursors of each annotation
+    group are collected while the sequences are read, and sequences
+    are placed on the precursors at the end, since the names of a
+    group can be in any line of the file.
+
     Args:
         *fn(str)*: file name with PROST output information.
 
-        *database(str)*: database name.
-
-        *args(namedtuple)*: arguments from command line.
+        *args(namedtuple)*: arguments from command line with the
+            references of *mirtop.mirna.reference.load()*.
             See *mirtop.libs.parse.add_subparser_gff()*.
 
     Returns:
@@ -39,58 +47,64 @@ def read_file(fn, hairpins, database, mirna_gtf):
 
     """
     reads = defaultdict(hits)
-    sample = os.path.splitext(os.path.basename(fn))[0]
-    genomics = mapper.read_gtf_to_mirna(mirna_gtf)
-    matures = mapper.read_gtf_to_precursor(mirna_gtf)
+    hairpins = args.precursors
+    matures = args.matures
+    index = reference.index(args)
     non_mirna = 0
     non_chromosome_mirna = 0
     outside_mirna = 0
     lines_read = 0
-    ann, ann_type = _group_seqs_by_ann(fn)
-    with open(fn) as handle:
+    ann_type = defaultdict(lambda: ["", ""])
+    sequences = []
+    debug = mylog.is_debug()
+    with open_file(fn) as handle:
         handle.readline()
         for line in handle:
             lines_read += 1
             cols = line.strip().split("\t")
-            query_name = cols[0]
-            query_sequence = cols[0]
-            if not ann[query_sequence]:
+            _add_ann(cols, ann_type)
+            if not cols[4]:
                 non_mirna += 1
                 continue
-            miRNA = ann_type[ann[query_sequence]][1]
-            preNames = ann_type[ann[query_sequence]][0]
-            if query_name not in reads and query_sequence==None:
+            if cols[0] and cols[0].find("N") > -1:
+                continue
+            sequences.append((cols[0], cols[9], cols[4]))
+    for query_sequence, counts, group in sequences:
+        query_name = query_sequence
+        miRNA = ann_type[group][1]
+        preNames = ann_type[group][0]
+        reads[query_name].set_sequence(query_sequence)
+        reads[query_name].counts = counts
+        for preName in preNames.split(","):
+            if preName in reads[query_name].precursors:
                 continue
-            if query_sequence and query_sequence.find("N") > -1:
+            if preName not in hairpins:
+                non_chromosome_mirna += 1
                 continue
-            reads[query_name].set_sequence(query_sequence)
-            reads[query_name].counts = cols[9]
-            for preName in preNames.split(","):
-                if preName in reads[query_name].precursors:
-                    continue
-                if preName not in hairpins:
-                    non_chromosome_mirna += 1
-                    continue
-                reference_start = _align_to_mature(query_sequence, hairpins[preName], matures[preName][miRNA])
+            reference_start, cigar = _place(
+                query_sequence, preName, hairpins,
+                matures[preName][miRNA], index, miRNA)
+            if debug:
                 logger.debug("\nPROST!::NEW::query: {query_sequence}\n"
                              "  precursor {preName}\n"
                              "  name:  {query_name}\n"
                              "  reference_start: {reference_start}\n"
                              "  mirna: {miRNA}".format(**locals()))
-                iso = isomir()
-                iso.align = line
-                iso.set_pos(reference_start, len(reads[query_name].sequence))
+            iso = isomir()
+            iso.set_pos(reference_start, len(reads[query_name].sequence))
+            if debug:
                 logger.debug("PROST!:: start %s end %s" % (iso.start, iso.end))
-                if len(hairpins[preName]) < reference_start + len(reads[query_name].sequence):
-                    continue
-                iso.subs, iso.add, iso.cigar = filter.tune(
-                    reads[query_name].sequence,
-                    hairpins[preName],
-                    reference_start, None)
+            if len(hairpins[preName]) < reference_start + len(reads[query_name].sequence):
+                continue
+            iso.subs, iso.add, iso.cigar = filter.tune(
+                reads[query_name].sequence,
+                hairpins[preName],
+                reference_start, cigar)
+            if debug:
                 logger.debug("PROST!::After tune start %s end %s" % (
                     iso.start, iso.end))
-                if len(iso.subs) < 2:
-                    reads[query_name].set_precursor(preName, iso)
+            if len(iso.subs) < 2:
+                reads[query_name].set_precursor(preName, iso)
     logger.info("Lines loaded: %s" % lines_read)
     logger.info("Skipped lines because non miRNA in line: %s" % non_mirna)
     logger.info("Skipped lines because non chromosome in GTF:"
@@ -100,24 +114,40 @@ def read_file(fn, hairpins, database, mirna_gtf):
     return reads
 
 
-def _group_seqs_by_ann(fn):
-    """Read file once to group sequences to same miRNA sequence"""
-    ann = dict()
-    ann_type = defaultdict(list)
-    with open(fn) as inh:
-        inh.readline()
-        for line in inh:
-            cols = line.strip().split("\t")
-            ann[cols[0]] = cols[4]
-            mirna = cols[11] if cols[11] else cols[13]
-            hairpin = cols[15]
-            if not cols[4] in ann_type:
-                ann_type[cols[4]] = ["", ""]
-            if mirna:
-                ann_type[cols[4]][1] = mirna
-            if hairpin:
-                ann_type[cols[4]][0] = hairpin
-    return [ann, ann_type]
+def _add_ann(cols, ann_type):
+    """Keep the last miRNA and precursors of each annotation group"""
+    mirna = cols[11] if cols[11] else cols[13]
+    hairpin = cols[15]
+    if mirna:
+        ann_type[cols[4]][1] = mirna
+    if hairpin:
+        ann_type[cols[4]][0] = hairpin
+
+
+def _place(seq, preName, hairpins, mature, index, mirna=None):
+    """
+    Get start and cigar of seq on the precursor with the k-mer index,
+    the closest to the mature if there are many. It aligns
+    seq to the mature if the index doesn't place it.
+
+    Results are kept by (seq, precursor, miRNA), since the same
+    sequences are in the files of many samples.
+    """
+    key = (seq, preName, mirna, hairpins[preName], mature[0], mature[1])
+    if key not in _PLACED:
+        if len(_PLACED) >= CACHE_SIZE:
+            _PLACED.clear()
+        _PLACED[key] = _find(seq, preName, hairpins, mature, index)
+    return _PLACED[key]
+
+
+def _find(seq, preName, hairpins, mature, index):
+    found = sorted((abs(start - int(mature[0])), start, cigar)
+                   for name, start, cigar in index.map(seq)
+                   if name == preName)
+    if found:
+        return found[0][1], found[0][2]
+    return _align_to_mature(seq, hairpins[preName], mature), None
 
 
 def _align_to_mature(seq, hairpin, mature):
@@ -125,8 +155,8 @@ def _align_to_mature(seq, hairpin, mature):
     mirna = get_mature_sequence(hairpin, mature)
     hit = align(seq, mirna)
     start = hit[0][:8].count("-") - 4 + int(mature[0])
-    logger.debug("PROST::align:sequence to mature %s" % hit[0])
-    logger.debug("PROST::align:start: %s -> %s" % (mature[0], start))
+    logger.debug("PROST::align:sequence to mature %s", hit[0])
+    logger.debug("PROST::align:start: %s -> %s", mature[0], start)
     return start
 
 
@@ -136,7 +166,7 @@ def _cigar_to_variants(seq, mature, cigar):
 
 
 def _make_variant(cols):
-    logger.debug("PROST::variant: %s" % cols)
+    logger.debug("PROST::variant: %s", cols)
     variant = []
     if cols[0] != "0":
         variant.append("iso_5p:%s" % cols[0])
@@ -3,6 +3,8 @@
 from collections import defaultdict
 
 import mirtop.libs.logger as mylog
+from mirtop.libs.prefetch import open_file
+from mirtop.libs.utils import get_freq
 from mirtop.mirna.realign import isomir, hits
 from mirtop.bam import filter
 
@@ -39,7 +41,8 @@ def read_file(fn, args):
     """
     precursors = args.precursors
     reads = defaultdict(hits)
-    with open(fn) as handle:
+    debug = mylog.is_debug()
+    with open_file(fn) as handle:
         handle.readline()
         for line in handle:
             cols = line.strip().split("\t")
@@ -53,36 +56,28 @@ def read_file(fn, args):
                 continue
             if query_name not in reads:
                 reads[query_name].set_sequence(query_sequence)
-                reads[query_name].counts = _get_freq(query_name)
+                reads[query_name].counts = get_freq(query_name)
             chrom = cols[13]
-            logger.debug("\nSEQBUSTER::NEW::query: {query_sequence}\n"
-                         "  precursor {chrom}\n"
-                         "  name:  {query_name}\n"
-                         "  start: {reference_start}\n"
-                         "  iso: {seqbuster_iso}".format(**locals()))
+            if debug:
+                logger.debug("\nSEQBUSTER::NEW::query: {query_sequence}\n"
+                             "  precursor {chrom}\n"
+                             "  name:  {query_name}\n"
+                             "  start: {reference_start}\n"
+                             "  iso: {seqbuster_iso}".format(**locals()))
             # logger.debug("SEQBUSTER:: cigar {cigar}".format(**locals()))
             iso = isomir()
             iso.align = line
             iso.set_pos(reference_start, len(reads[query_name].sequence))
-            logger.debug("SEQBUSTER:: start %s end %s" % (iso.start, iso.end))
+            if debug:
+                logger.debug("SEQBUSTER:: start %s end %s" % (iso.start, iso.end))
             if len(precursors[chrom]) < reference_start + len(reads[query_name].sequence):
                 continue
             iso.subs, iso.add, iso.cigar = filter.tune(reads[query_name].sequence,
                                                        precursors[chrom],
                                                        reference_start, None)
-            logger.debug("SEQBUSTER::After tune start %s end %s" % (iso.start, iso.end))
+            if debug:
+                logger.debug("SEQBUSTER::After tune start %s end %s" % (iso.start, iso.end))
             if len(iso.subs) < 2:
                 reads[query_name].set_precursor(chrom, iso)
     logger.info("Hits: %s" % len(reads))
     return reads
-
-
-def _get_freq(name):
-    """
-    Check if name read contains counts (_xNumber)
-    """
-    try:
-        counts = int(name.split("_x")[1])
-    except:
-        return 0
-    return counts
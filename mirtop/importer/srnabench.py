@@ -3,8 +3,14 @@
 import os
 from collections import defaultdict
 
+try:
+    intern
+except NameError:
+    from sys import intern
+
 import mirtop.libs.logger as mylog
-from mirtop.gff.body import paste_columns, variant_with_nt, read_gff_line
+from mirtop.libs.prefetch import open_file
+from mirtop.gff.body import variant_with_nt_attr
 from mirtop.mirna.realign import make_cigar, make_id
 
 logger = mylog.getLogger(__name__)
@@ -45,7 +51,8 @@ def read_file(folder, args):
 
     source_iso = _read_iso(reads_iso)
     logger.info("Reads with isomiR information %s" % len(source_iso))
-    with open(reads_anno) as handle:
+    debug = mylog.is_debug()
+    with open_file(reads_anno) as handle:
         for sequence in handle:
             cols = sequence.strip().split("\t")
             query_name = cols[0]
@@ -62,28 +69,31 @@ def read_file(folder, args):
             counts = int(cols[1])
 
             hit = len(set([mirna.split("#")[1] for mirna in cols[4].split("$")]))
+            idu = make_id(query_sequence)
 
             for nhit in cols[4].split("$"):
-                logger.debug("SRNABENCH::line hit: %s" % nhit)
+                if debug:
+                    logger.debug("SRNABENCH::line hit: %s" % nhit)
                 hit_info = nhit.split("#")
                 pos_info = hit_info[3].split(",")
                 start = int(pos_info[1]) - 1
                 end = start + len(query_sequence)  # int(pos_info[2]) - 1
                 chrom = pos_info[0]
-                mirName = hit_info[1]
+                mirName = intern(hit_info[1])
                 if chrom not in precursors or chrom not in matures:
                     n_notindb += 1
                 if mirName not in matures[chrom]:
                     n_notindb += 1
-                if (query_sequence, mirName) in seen:
+                key = (idu, mirName)
+                if key in seen:
                     continue
 
-                seen.add((query_sequence, mirName))
+                seen.add(key)
 
-                if (query_sequence, mirName) not in source_iso:
+                if key not in source_iso:
                     continue
 
-                isoformat = source_iso[(query_sequence, mirName)]
+                isoformat = source_iso[key]
 
                 if isoformat == "mv":
                     n_notassign += 1
@@ -91,13 +101,14 @@ def read_file(folder, args):
 
                 source = "isomiR" if isoformat != "NA" else "ref_miRNA"
 
-                logger.debug("SRNABENCH::query: {query_sequence}\n"
-                             "  precursor {chrom}\n"
-                             "  name:  {query_name}\n"
-                             "  start: {start}\n"
-                             "  external: {isoformat}\n"
-                             "  hit: {hit}".format(**locals()))
-                logger.debug("SRNABENCH:: start %s end %s" % (start, end))
+                if debug:
+                    logger.debug("SRNABENCH::query: {query_sequence}\n"
+                                 "  precursor {chrom}\n"
+                                 "  name:  {query_name}\n"
+                                 "  start: {start}\n"
+                                 "  external: {isoformat}\n"
+                                 "  hit: {hit}".format(**locals()))
+                    logger.debug("SRNABENCH:: start %s end %s" % (start, end))
                 if len(precursors[chrom]) < start + len(query_sequence):
                     n_out += 1
                     continue
@@ -105,22 +116,18 @@ def read_file(folder, args):
                 Filter = "Pass"
                 cigar = make_cigar(query_sequence,
                                    precursors[chrom][start:end])
-                preName = chrom
-                score = "."
-                strand = "+"
-                idu = make_id(query_sequence)
-                attrb = ("Read {query_sequence}; UID {idu}; Name {mirName};"
-                         " Parent {preName}; Variant {isoformat};"
-                         " Cigar {cigar}; Expression {counts};"
-                         " Filter {Filter}; Hits {hit};").format(**locals())
-                line = ("{chrom}\t{database}\t{source}\t{start}\t{end}\t"
-                        "{score}\t{strand}\t.\t{attrb}").format(**locals())
+                attrb = [("Read", query_sequence), ("UID", idu),
+                         ("Name", mirName), ("Parent", chrom),
+                         ("Variant", isoformat), ("Cigar", cigar),
+                         ("Expression", counts), ("Filter", Filter),
+                         ("Hits", hit)]
                 if args.add_extra:
-                    extra = variant_with_nt(line, args.precursors,
-                                            args.matures)
-                    line = "%s Changes %s;" % (line, extra)
-
-                line = paste_columns(read_gff_line(line), sep=sep)
+                    attrb.append(("Changes", variant_with_nt_attr(
+                        dict(attrb), precursors, matures)))
+                if getattr(args, "add_seq", False):
+                    attrb.append(("Seq", query_sequence))
+                line = _paste(chrom, database, source, start, end,
+                              attrb, sep)
                 if start not in reads[chrom]:
                     reads[chrom][start] = []
                 if Filter == "Pass":
@@ -137,15 +144,38 @@ def read_file(folder, args):
     return reads
 
 
+def _paste(chrom, database, source, start, end, attrb, sep):
+    """
+    GFF line with the attributes in *attrb* as (name, value),
+    as *mirtop.gff.body.paste_columns()* after *read_gff_line()*.
+    Attributes without value are skipped like *read_attributes()* does.
+    """
+    attrb = "; ".join("%s%s%s" % (name, sep, value)
+                      for name, value in attrb if value != "")
+    return "\t".join([chrom, database, source, str(start), str(end),
+                      ".", "+", ".", attrb])
+
+
 def _read_iso(fn):
     """
-    Read definitions of isomiRs by srnabench
+    Read definitions of isomiRs by srnabench.
+
+    Keys are the UID of the sequence from *mirtop.mirna.realign.make_id()*
+    and the miRNA name, interned as the variants, since a few names and
+    variants repeat in all the lines of large files.
+
+    Returns:
+        *iso(dict)*: (UID, miRNA) to Variant attribute,
+            "NA" for reference miRNAs and "mv" for multiple variants.
     """
     iso = dict()
-    with open(fn) as inh:
+    debug = mylog.is_debug()
+    with open_file(fn) as inh:
         inh.readline()
         for line in inh:
             cols = line.strip().split("\t")
+            if cols[0].find("N") > -1:
+                continue
             label = cols[3].split("$")
             mirnas = cols[1].split("$")
             if len(mirnas) == 1 and len(label) > 1:
@@ -153,19 +183,23 @@ def _read_iso(fn):
             if len(mirnas) != len(label):
                 label = label * (len(mirnas) - len(label))
             anno = dict(zip(mirnas, label))
-            logger.debug("TRANSLATE::%s with %s" % (mirnas, label))
+            if debug:
+                logger.debug("TRANSLATE::%s with %s" % (mirnas, label))
+            idu = make_id(cols[0])
             for m in anno:
-                iso[(cols[0], m)] = _translate(anno[m], cols[4])
-                logger.debug("TRANSLATE::code %s" % iso[(cols[0], m)])
+                key = (idu, intern(m))
+                iso[key] = intern(_translate(anno[m], cols[4]))
+                if debug:
+                    logger.debug("TRANSLATE::code %s" % iso[key])
     return iso
 
 
 def _translate(isomirs, description):
     iso = []
     labels = isomirs.split("@")
-    logger.debug("TRANSLATE::label:%s" % isomirs)
+    logger.debug("TRANSLATE::label:%s", isomirs)
     for label in labels:
-        logger.debug("TRANSLATE::label:%s" % label)
+        logger.debug("TRANSLATE::label:%s", label)
         if label == "exact":
             return "NA"
         if label.find("mv") > -1:
@@ -184,11 +218,11 @@ def _translate(isomirs, description):
             iso.append("iso_add:%s" % number_nts)
         if label.find("NucVar") > -1:
             for nt in description.split(","):
-                logger.debug("TRANSLATE::change:%s" % description)
+                logger.debug("TRANSLATE::change:%s", description)
                 if nt == "-" or nt == "NA":
                     return "notsure"
                 iso.extend(_iso_snp(int(nt.split(":")[0])))
-        logger.debug("TRANSLATE::iso:%s" % iso)
+        logger.debug("TRANSLATE::iso:%s", iso)
     return ",".join(iso)
 
 
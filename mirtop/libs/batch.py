@@ -0,0 +1,134 @@
+"""Run many commands in one process sharing the references"""
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import shlex
+import time
+import traceback
+
+from mirtop.libs.parse import parse_cl
+from mirtop.mirna import reference
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+COMMANDS = ["gff", "counts", "export", "stats", "compare", "validator"]
+
+
+def batch(args):
+    """
+    Run the jobs of a manifest file. References used by the jobs
+    are loaded before the workers start, so they are read once
+    and shared by all the jobs. With many workers, each job runs
+    in one process ignoring its *--threads*.
+
+    Args:
+        *args(namedtuple)*: arguments parsed from command line with
+            *mirtop.libs.parse.add_subparser_batch()*.
+
+    Returns:
+        *(out_file)*: `batch_summary.tsv` with name, command, status
+            and seconds of each job.
+    """
+    jobs = read_manifest(args.manifest)
+    logger.info("Jobs in manifest: %s" % len(jobs))
+    for job in jobs:
+        if job[2]["args"].out and not os.path.exists(job[2]["args"].out):
+            os.makedirs(job[2]["args"].out)
+        if _needs_reference(job[1], job[2]["args"]):
+            reference.load(job[2]["args"], database=job[1] == "gff")
+    threads = max(1, min(args.threads, len(jobs)))
+    if threads > 1:
+        # workers get the references as memory-mapped files, not copies
+        for job in jobs:
+            if getattr(job[2]["args"], "threads", 1) > 1:
+                # daemonic workers can't start their own processes
+                logger.warning("Job %s runs with 1 process, batch runs"
+                               " %s jobs in parallel." % (job[0], threads))
+                job[2]["args"].threads = 1
+            if _needs_reference(job[1], job[2]["args"]):
+                job[2]["args"] = reference.share(job[2]["args"])
+        pool = multiprocessing.Pool(threads)
+        try:
+            summary = pool.map(_run_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        summary = [_run_job(job) for job in jobs]
+    fn_out = os.path.join(args.out, "batch_summary.tsv")
+    with open(fn_out, 'w') as out_handle:
+        print("name\tcommand\tstatus\tseconds", file=out_handle)
+        for line in summary:
+            print("\t".join(map(str, line)), file=out_handle)
+    failed = [line[0] for line in summary if line[2] != "done"]
+    logger.info("Jobs done: %s, failed: %s" % (len(summary) - len(failed),
+                                               len(failed)))
+    if failed:
+        raise ValueError("Jobs failed: %s. See %s" % (", ".join(failed),
+                                                      fn_out))
+    return fn_out
+
+
+def read_manifest(fn):
+    """
+    Read jobs from a manifest. The TSV format has the columns
+    name, command and arguments as in the command line:
+
+        >>> sample1    gff    --format seqbuster --sps hsa ... -o out s1.mirna
+
+    The JSON format is a list of objects with the same keys,
+    *args* can be a string or a list:
+
+        >>> [{"name": "sample1", "command": "gff", "args": [...]}]
+
+    Args:
+        *fn(str)*: manifest file, JSON if it ends with `.json`.
+
+    Returns:
+        *jobs(list)*: [name, command, kwargs from *parse_cl()*].
+    """
+    with open(fn) as in_handle:
+        if fn.endswith(".json"):
+            values = [[job.get("name", ""), job["command"], job["args"]]
+                      for job in json.load(in_handle)]
+        else:
+            values = [line.rstrip("\n").split("\t", 2) for line in in_handle
+                      if line.strip() and not line.startswith("#")]
+    jobs = []
+    for idx, job in enumerate(values):
+        if len(job) != 3:
+            raise ValueError("Job %s needs name, command and arguments:"
+                             " %s" % (idx + 1, job))
+        name, command, job_args = job
+        if command not in COMMANDS:
+            raise ValueError("Job %s: %s is not supported, use %s" % (
+                idx + 1, command, ", ".join(COMMANDS)))
+        if not isinstance(job_args, list):
+            job_args = shlex.split(job_args)
+        jobs.append([name or "job%s" % (idx + 1), command,
+                     parse_cl([command] + job_args)])
+    return jobs
+
+
+def _needs_reference(command, args):
+    if command == "gff" or command == "export":
+        return True
+    return command == "counts" and args.add_extra
+
+
+def _run_job(job):
+    """Run one job and return [name, command, status, seconds]"""
+    from mirtop.command_line import _run
+    name, command, kwargs = job
+    start = time.time()
+    status = "done"
+    logger.info("Job %s: %s" % (name, command))
+    try:
+        _run(kwargs)
+    except Exception:
+        logger.error("Job %s failed:\n%s" % (name, traceback.format_exc()))
+        status = "failed"
+    return [name, command, status, round(time.time() - start, 3)]
@@ -10,6 +10,26 @@ def getLogger(name):
     return logging.getLogger(__name__)
 
 
+def is_debug():
+    """
+    Return True if debug messages are emitted.
+
+    Call it once before loops over reads and only build debug
+    messages that format objects when it is True:
+
+        >>> debug = is_debug()
+        >>> for read in reads:
+        >>>     if debug:
+        >>>         logger.debug("READ::%s" % read.format())
+
+    Simple messages can pass the arguments to the logger,
+    so the string is only formatted when it is emitted:
+
+        >>> logger.debug("READ::%s %s", start, end)
+    """
+    return logging.getLogger(__name__).isEnabledFor(logging.DEBUG)
+
+
 def set_format(frmt, frmt_col=None, datefmt=None):
     if frmt_col:
         try:
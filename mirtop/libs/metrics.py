@@ -0,0 +1,105 @@
+"""Timers and counters for each step of a run"""
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+_TIMERS = OrderedDict()
+_COUNTERS = OrderedDict()
+RATES = ["alignments", "reads", "hits"]
+
+
+def reset():
+    """Remove all timers and counters."""
+    _TIMERS.clear()
+    _COUNTERS.clear()
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Add the time spent inside the block to the timer *name*.
+
+        >>> with metrics.timer("annotate"):
+        >>>     reads = annotate(reads, matures, precursors)
+
+    Args:
+        *name(str)*: step name. Times of the same step are added.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_time(name, time.time() - start)
+
+
+def add_time(name, seconds):
+    """Add *seconds* to the timer *name* and count one call."""
+    if name not in _TIMERS:
+        _TIMERS[name] = [0.0, 0]
+    _TIMERS[name][0] += seconds
+    _TIMERS[name][1] += 1
+
+
+def count(name, value=1):
+    """
+    Add *value* to the counter *name*.
+
+    Counters named as `step.item` where *step* is a timer and
+    *item* is in *RATES* get a rate of items per second
+    in *summary()*.
+    """
+    _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+
+def summary():
+    """
+    Get timers, counters and rates of the run.
+
+    Returns:
+        *(dict)*: with keys:
+            >>> {'timers': {step: {'seconds': 0.1, 'calls': 1}},
+            >>>  'counters': {'read_bam.reads': 10},
+            >>>  'rates': {'read_bam.reads_per_sec': 100.0}}
+    """
+    timers = OrderedDict()
+    for name in _TIMERS:
+        timers[name] = OrderedDict([('seconds', round(_TIMERS[name][0], 6)),
+                                    ('calls', _TIMERS[name][1])])
+    rates = OrderedDict()
+    for name in _COUNTERS:
+        step, item = (name.rsplit(".", 1) + [None])[:2]
+        if item in RATES and step in _TIMERS and _TIMERS[step][0] > 0:
+            rates["%s_per_sec" % name] = round(
+                _COUNTERS[name] / _TIMERS[step][0], 3)
+    return OrderedDict([('timers', timers),
+                        ('counters', OrderedDict(_COUNTERS)),
+                        ('rates', rates)])
+
+
+def write(fn, **info):
+    """
+    Write *summary()* as JSON file.
+
+    Args:
+        *fn(str)*: output file.
+
+        *info*: other values to add to the file,
+            like the command or the total time.
+    """
+    values = OrderedDict(sorted(info.items()))
+    values.update(summary())
+    out_dir = os.path.dirname(fn)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(fn, 'w') as out_handle:
+        json.dump(values, out_handle, indent=2)
+    logger.info("Metrics written to %s" % fn)
+    return fn
@@ -7,7 +7,6 @@ import sys
 def parse_cl(in_args):
     """Function to parse the subcommands arguments.
     """
-    print(in_args)
     sub_cmds = {"gff": _add_subparser_gff,
                 "stats": _add_subparser_stats,
                 "compare": _add_subparser_compare,
@@ -15,7 +14,8 @@ def parse_cl(in_args):
                 "simulator": _add_subparser_simulator,
                 "counts": _add_subparser_counts,
                 "export": _add_subparser_export,
-                "validator": _add_subparser_validator
+                "validator": _add_subparser_validator,
+                "batch": _add_subparser_batch
                 }
     parser = argparse.ArgumentParser(description="small RNA analysis")
     sub_cmd = None
@@ -26,7 +26,7 @@ def parse_cl(in_args):
     else:
         print("use %s" % sub_cmds.keys())
         sys.exit(0)
-    args = parser.parse_args()
+    args = parser.parse_args(in_args)
     if "files" in args:
         if not args.files:
             print("use %s -h to see help." % in_args[0])
@@ -42,6 +42,12 @@ def _add_debug_option(parser):
                         dest="debug", help="max verbosity mode", default=False)
     parser.add_argument("-vd", "--print_debug", action="store_true",
                         help="print debug messages on terminal", default=False)
+    parser.add_argument("--metrics",
+                        help="JSON file to write the time and counts"
+                             " of each step of the run.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run the command with cProfile and write"
+                             " .pstats and collapsed stacks to --out.")
     return parser
 
 
@@ -60,6 +66,9 @@ def _add_subparser_compare(subparsers):
                                                  "First will be used as reference.")
     parser.add_argument("-o", "--out", dest="out", default="tmp_mirtop",
                         help="folder of output files")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="number of processes to compare files"
+                             " against the reference in parallel.")
     parser = _add_debug_option(parser)
     return parser
 
@@ -72,15 +81,54 @@ def _add_subparser_gff(subparsers):
     parser.add_argument("--sps",
                         help="species")
     parser.add_argument("--hairpin", help="hairpin.fa")
+    parser.add_argument("--lazy-hairpin", action="store_true",
+                        help="Read hairpin sequences on demand from the"
+                             " memory-mapped hairpin.fa instead of"
+                             " loading all of them.")
     parser.add_argument("--gtf",
                         help="GFF file with precursor and mature position to genome.")
-    parser.add_argument("--format", help="Input format, default BAM file.",
+    parser.add_argument("--index-cache",
+                        help="folder to save the k-mer index of the"
+                             " precursors used by fastq and prost"
+                             " formats, and read it in the next runs.")
+    parser.add_argument("--format", help="Input format, default BAM file."
+                                         " fastq reads are collapsed and"
+                                         " placed on the precursors.",
                         choices=['BAM', 'seqbuster', 'srnabench',
-                                 'prost', 'isomirsea', 'gff'], default="BAM")
-    parser.add_argument("--out-format", help="Supported formats: gff3 or gtf",
-                        choices = ["gff", "gft"], default="gff")
+                                 'prost', 'isomirsea', 'gff', 'fastq'],
+                        default="BAM")
+    parser.add_argument("--out-format", help="Supported formats: gff3, gtf"
+                                             " or bam, that writes the"
+                                             " BAM alignments of each"
+                                             " sample with their"
+                                             " annotation as tags and the"
+                                             " merged mirtop.gff.",
+                        choices = ["gff", "gtf", "bam"], default="gff")
     parser.add_argument("--add-extra", help="Add extra attributes to gff",
                         action="store_true")
+    parser.add_argument("--add-seq", action="store_true",
+                        help="Add Seq attribute with the sequence to gff,"
+                             " so other commands don't decode the UID.")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="number of processes to read and annotate"
+                             " each BAM file by groups of precursors.")
+    parser.add_argument("--io-threads", type=int, default=1,
+                        help="number of threads to decompress and"
+                             " compress BAM files, used by pysam and"
+                             " samtools.")
+    parser.add_argument("--cohort", action="store_true",
+                        help="Annotate each unique sequence of all the"
+                             " files once and only write the merged"
+                             " file. Formats: BAM, fastq, seqbuster"
+                             " and prost.")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="number of samples whose text files are"
+                             " read in the background while the current"
+                             " one is converted. Their whole content is"
+                             " kept in memory, disabled by default.")
+    parser.add_argument("--profile-samples", action="store_true",
+                        help="Write one profile for each input file"
+                             " instead of one for the whole run.")
     parser = _add_debug_option(parser)
     return parser
 
@@ -123,6 +171,32 @@ def _add_subparser_simulator(subparsers):
                         help="dir of output files")
     parser.add_argument("-r", "--reference", dest="ref",
                         help="reference fasta file with index"),
+    parser.add_argument("--gtf",
+                        help="GFF file with mature positions to center"
+                             " reads on them, otherwise 22 nts at 5 nts"
+                             " of each end of the precursor.")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="number of samples.")
+    parser.add_argument("--reads", type=int, default=12000,
+                        help="mean number of reads for each precursor"
+                             " and sample.")
+    parser.add_argument("--isomir-rate", type=float, default=0.3,
+                        help="probability of trimming at each end.")
+    parser.add_argument("--snp-rate", type=float, default=0.05,
+                        help="probability of one nucleotide change.")
+    parser.add_argument("--addition-rate", type=float, default=0.1,
+                        help="probability of 1-3 non-template"
+                             " nucleotides at 3' end.")
+    parser.add_argument("--noise-rate", type=float, default=0.15,
+                        help="fraction of degradation reads along"
+                             " the precursor.")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="seed of the random generator.")
+    parser.add_argument("--gzip", action="store_true",
+                        help="compress output files.")
+    parser.add_argument("--bam", action="store_true",
+                        help="write one BAM file for each sample with"
+                             " the reads aligned to the precursors.")
     parser = _add_debug_option(parser)
     return parser
 
@@ -151,3 +225,19 @@ def _add_subparser_validator(subparsers):
                         help="folder of output files")
     parser = _add_debug_option(parser)
     return parser
+
+
+def _add_subparser_batch(subparsers):
+    parser = subparsers.add_parser("batch", help="run many commands in one"
+                                                 " process sharing references")
+    parser.add_argument("manifest",
+                        help="TSV file with name, command and arguments"
+                             " of each job, or JSON file with a list of"
+                             " {name, command, args}.")
+    parser.add_argument("-o", "--out", dest="out", default="tmp_mirtop",
+                        help="folder of output files")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="number of jobs to run in parallel,"
+                             " jobs run with one process if it is > 1.")
+    parser = _add_debug_option(parser)
+    return parser
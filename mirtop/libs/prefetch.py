@@ -0,0 +1,130 @@
+"""Read the input files of the next samples while the current one is converted"""
+
+import gzip
+import io
+from multiprocessing.pool import ThreadPool
+
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+# samples read ahead by default, mirtop gff uses it only with --prefetch
+IN_FLIGHT = 2
+# prefetch active in this process, used by open_file()
+_ACTIVE = None
+
+
+class prefetch(object):
+    """
+    Read the files of the next samples in background threads,
+    so opening many small files in a slow (network) file system
+    overlaps with the conversion of the current sample.
+
+    Files are kept in memory, decompressed if they end with `.gz`,
+    from the moment they are read until the importer moves to a
+    file of the next samples, so up to *limit* + 1 samples are in
+    memory at once. Importers get them with *open_file()*:
+
+        >>> with prefetch([["sample1.mirna"], ["sample2.mirna"]]):
+        >>>     for fn in ["sample1.mirna", "sample2.mirna"]:
+        >>>         seqbuster.read_file(fn, args)
+
+    Args:
+        *groups(list)*: files of each sample, in the order they are used.
+
+        *limit(int)*: samples read ahead of the current one,
+            0 to read the files when they are opened.
+    """
+
+    def __init__(self, groups, limit=IN_FLIGHT):
+        self.groups = groups
+        self.limit = limit
+        self._where = dict((fn, idx) for idx, group in enumerate(groups)
+                           for fn in group)
+        self._jobs = dict()
+        self._pool = None
+        self._current = 0
+
+    def __enter__(self):
+        global _ACTIVE
+        if self.limit > 0 and any(self.groups):
+            self._pool = ThreadPool(self.limit)
+            self._schedule(0)
+            _ACTIVE = self
+        return self
+
+    def __exit__(self, *exc):
+        global _ACTIVE
+        _ACTIVE = None
+        self._jobs.clear()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _schedule(self, current):
+        """Forget samples before *current* and read the next ones."""
+        self._current = current
+        for idx in list(self._jobs):
+            if idx < current:
+                del self._jobs[idx]
+        last = min(current + self.limit + 1, len(self.groups))
+        for idx in range(current, last):
+            if idx not in self._jobs:
+                self._jobs[idx] = self._pool.apply_async(
+                    _read_group, (self.groups[idx],))
+
+    def open(self, fn):
+        """
+        Get the content of *fn* as a file handle.
+
+        Returns:
+            *(file)*: in-memory file, or None if *fn* is not prefetched.
+        """
+        idx = self._where.get(fn)
+        if self._pool is None or idx is None or idx < self._current:
+            return None
+        if idx != self._current:
+            self._schedule(idx)
+        logger.debug("PREFETCH::open %s" % fn)
+        return _buffer(self._jobs[idx].get()[fn])
+
+
+def open_file(fn):
+    """
+    Open a text file from the active *prefetch*, or from disk if
+    it isn't prefetched, with gzip if it ends with `.gz`.
+
+    Args:
+        *fn(str)*: file name.
+
+    Returns:
+        *(file)*: file handle to use with `with`.
+    """
+    if _ACTIVE is not None:
+        handle = _ACTIVE.open(fn)
+        if handle is not None:
+            return handle
+    if fn.endswith(".gz"):
+        return _buffer(_read(fn))
+    return open(fn)
+
+
+def _read_group(group):
+    return dict((fn, _read(fn)) for fn in group)
+
+
+def _read(fn):
+    if fn.endswith(".gz"):
+        with gzip.open(fn, 'rb') as handle:
+            content = handle.read()
+    else:
+        with open(fn, 'rb') as handle:
+            content = handle.read()
+    return content if isinstance(content, str) else content.decode()
+
+
+def _buffer(content):
+    if isinstance(content, bytes):
+        return io.BytesIO(content)
+    return io.StringIO(content, newline=None)
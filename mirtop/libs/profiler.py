@@ -0,0 +1,97 @@
+"""Profile commands with cProfile"""
+import contextlib
+import cProfile
+import os
+import pstats
+
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def profile(out_dir, name, enabled=True):
+    """
+    Profile the code inside the block and write the
+    output of *write()* into *out_dir*.
+
+        >>> with profiler.profile(args.out, "mirtop", args.profile):
+        >>>     reader(args)
+
+    Args:
+        *out_dir(str)*: folder of output files.
+
+        *name(str)*: prefix of the output files.
+
+        *enabled(boolean)*: if False, only run the block.
+    """
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        write(profiler, out_dir, name)
+
+
+def write(profiler, out_dir, name):
+    """
+    Write *name*.pstats to open with `pstats` or `snakeviz`
+    and *name*.collapsed.txt to use with `flamegraph.pl`.
+
+    Args:
+        *profiler(cProfile.Profile)*: stopped profiler.
+
+        *out_dir(str)*: folder of output files.
+
+        *name(str)*: prefix of the output files.
+
+    Returns:
+        *(list)*: with the two output files.
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    stats_fn = os.path.join(out_dir, "%s.pstats" % name)
+    profiler.dump_stats(stats_fn)
+    collapsed_fn = os.path.join(out_dir, "%s.collapsed.txt" % name)
+    with open(collapsed_fn, 'w') as out_handle:
+        for line in collapse(pstats.Stats(stats_fn)):
+            out_handle.write(line + "\n")
+    logger.info("Profile written to %s and %s" % (stats_fn, collapsed_fn))
+    return [stats_fn, collapsed_fn]
+
+
+def collapse(stats):
+    """
+    Convert stats to collapsed stack lines: `caller;callee value`.
+
+    cProfile only keeps the caller of each function, not the full
+    stack, so stacks have two levels. The value is the time in
+    microseconds spent in the callee itself when called from that
+    caller, functions without callers use their own time.
+
+    Args:
+        *stats(pstats.Stats)*: stats of a profile.
+
+    Returns:
+        *(list)*: lines sorted by value, the highest first.
+    """
+    lines = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            lines.append((int(tt * 1e6), _label(func)))
+        for caller, values in callers.items():
+            lines.append((int(values[2] * 1e6), "%s;%s" % (_label(caller),
+                                                           _label(func))))
+    return ["%s %s" % (stack, value)
+            for value, stack in sorted(lines, reverse=True) if value > 0]
+
+
+def _label(func):
+    fn, line, name = func
+    if fn == "~":
+        return name
+    return "%s:%s(%s)" % (os.path.basename(fn), line, name)
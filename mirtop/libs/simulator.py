@@ -1,91 +1,90 @@
 """simulate cluster over the genome"""
 from __future__ import print_function
-import random
+
+import gzip
+
+import numpy as np
+
 from mirtop.libs.read import get_fasta
+from mirtop.mirna import fasta, mapper
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+NTS = "ACGT"
+# reads are generated and collapsed in chunks of this size
+CHUNK = 1000000
+# size of the mature miRNA when there is no GTF file
+MATURE_SIZE = 22
+# fields of the integer key that encodes each read, see _encode()
+_ADD_MAX = 3
+_SNP_MAX = 64
 
 
 def simulate(args):
     """Main function that manage simulation of small RNAs
 
+    Args:
+        *args(namedtuple)*: arguments parsed from command line with
+            *mirtop.libs.parse.add_subparser_simulator()*.
+
+    Returns:
+        *(list)*: output files: `.ma` with counts for each sample,
+            `.fasta` with unique sequences, `.txt` with the real
+            position of each sequence and one BAM file for each
+            sample if *args.bam*.
     """
-    reads = dict()
-    if args.fasta:
-        name = None
-        seq = ""
-        with open(args.fasta) as in_handle:
-            for line in in_handle:
-                if line.startswith(">"):
-                    if name:
-                        reads.update(_generate_reads(seq, name))
-                    seq = ""
-                    name = line[1:-1]
-                else:
-                    seq += line.strip()
-
-        reads.update(_generate_reads(seq, name))
-    if reads:
-         _write_reads(reads, args.out)
-
-
-def _generate_reads(seq, name):
-    """Main function that create reads from precursors"""
-    reads = dict()
-    if len(seq) < 150 and len(seq) > 70:
-        reads.update(_mature(seq[:40], 0, name))
-        reads.update(_mature(seq[-40:], len(seq) - 40, name))
-        reads.update(_noise(seq, name))
-        reads.update(_noise(seq, name, 25))
-    return reads
-
-
-def _mature(subseq, absolute, c,  size=33, total=5000):
-    """Create mature sequences around start/end"""
-    reads = dict()
-    probs = [0.1, 0.2, 0.4, 0.2, 0.1]
-    end = 5 + size
-    error = [-2, -1, 0, 1, 2]
-    for error5 in error:
-        for error3 in error:
-            s = 5 - error5
-            e = end - error3
-            seen = subseq[s:e]
-            counts = int(probs[error5 + 2] * probs[error3 + 2] * total) + 1
-            name = "seq_%s_%s_%s_x%s" % (c, s + absolute, e + absolute, counts)
-            reads[name] = (seen, counts)
-    return reads
-
-
-def _noise(seq, c, size=33, total=1000):
-    """Create mature sequences around start/end"""
-    reads = dict()
-    seen = 0
-    while seen < total:
-        s = random.randint(0, len(seq) - size)
-        e = s + size + random.randint(-5,5)
-        p = random.uniform(0, 0.1)
-        counts = int(p * total) + 1
-        seen += counts
-        name = "seq_%s_%s_%s_x%s" % (c, s, e, counts)
-        reads[name] = (seq[s:e], counts)
-    return reads
-
-
-def _write_reads(reads, prefix):
+    if args.bed and args.ref:
+        args.fasta = _get_precursor(args.bed, args.ref,
+                                    args.out + ".precursors.fa")
+    if not args.fasta:
+        raise ValueError("Use --fasta or --bed with --reference.")
+    precursors = read_precursors(args.fasta)
+    matures = mapper.read_gtf_to_precursor(args.gtf) if args.gtf else {}
+    rates = {'isomir': args.isomir_rate, 'snp': args.snp_rate,
+             'addition': args.addition_rate, 'noise': args.noise_rate}
+    rng = np.random.RandomState(args.seed)
+    names = sorted(precursors)
+    spots = dict((name, _get_spot(precursors[name], matures.get(name)))
+                 for name in names)
+    # lognormal abundance of each precursor with mean args.reads
+    abundance = rng.lognormal(0, 1, len(names))
+    abundance = abundance / abundance.mean() * args.reads
+    samples = ["sample%s" % (idx + 1) for idx in range(args.samples)]
+    sequences = dict()
+    counts = []
+    for sample in samples:
+        logger.info("Simulating %s" % sample)
+        sample_counts = dict()
+        for name, size in zip(names, rng.poisson(abundance)):
+            keys, key_counts = _random_sequences(
+                rng, len(precursors[name]), spots[name], size, rates)
+            for key, n in zip(keys.tolist(), key_counts.tolist()):
+                read = _decode(key, precursors[name])
+                if read[0] not in sequences:
+                    sequences[read[0]] = [len(sequences), name] + read[1:]
+                idx = sequences[read[0]][0]
+                sample_counts[idx] = sample_counts.get(idx, 0) + n
+        counts.append(sample_counts)
+    logger.info("Simulated %s reads and %s unique sequences" % (
+        sum(sum(c.values()) for c in counts), len(sequences)))
+    out_files = _write_reads(sequences, samples, counts, args.out, args.gzip)
+    if args.bam:
+        for sample, sample_counts in zip(samples, counts):
+            out_files.append(_write_bam(
+                sequences, sample_counts, precursors,
+                "%s_%s.bam" % (args.out, sample)))
+    return out_files
+
+
+def read_precursors(fn):
     """
-    Write fasta file, ma file and real position
+    Read precursor sequences without the padding
+    added by *mirtop.mirna.fasta.read_precursor()*.
     """
-    out_ma = prefix + ".ma"
-    out_fasta = prefix + ".fasta"
-    out_real = prefix + ".txt"
-    with open(out_ma, 'w') as ma_handle:
-        print("id\tseq\tsample", file=ma_handle)
-        with open(out_fasta, 'w') as fa_handle:
-            with open(out_real, 'w') as read_handle:
-                for idx, r in enumerate(reads):
-                    info = r.split("_")
-                    print("seq_%s\t%s\t%s" % (idx, reads[r][0], reads[r][1]), file=ma_handle)
-                    print(">seq_%s\n%s" % (idx, reads[r][0]), file=fa_handle)
-                    print("%s\t%s\t%s\t%s\t%s\t%s\t%s" % (idx, r, reads[r][0], reads[r][1], info[1], info[2], info[3]), file=read_handle)
+    precursors = fasta.read_precursor(fn)
+    return dict((name, precursors[name][:-len(fasta.PADDING)])
+                for name in precursors)
 
 
 def _get_precursor(bed_file, reference, out_fa):
@@ -93,26 +92,207 @@ def _get_precursor(bed_file, reference, out_fa):
     get sequence precursor from position
     """
     get_fasta(bed_file, reference, out_fa)
-    return 0
+    return out_fa
 
 
-def _get_spot(precursor):
+def _get_spot(precursor, matures=None):
     """
     get spot that will be enriched
+
+    Args:
+        *precursor(str)*: precursor sequence.
+
+        *matures(dict)*: mature positions on the precursor from
+            *mirtop.mirna.mapper.read_gtf_to_precursor()*. If None,
+            one mature of *MATURE_SIZE* nts at 5 nts of each end.
+
+    Returns:
+        *(np.array)*: with [start, end) of each mature.
     """
-    return 0
+    if matures:
+        spots = [[start, end + 1] for start, end in sorted(matures.values())
+                 if end < len(precursor)]
+    else:
+        spots = [[5, 5 + MATURE_SIZE],
+                 [len(precursor) - 5 - MATURE_SIZE, len(precursor) - 5]]
+    spots = [spot for spot in spots if spot[0] >= 0]
+    return np.array(spots or [[0, min(MATURE_SIZE, len(precursor))]])
 
 
-def _get_type(pob):
+def _get_type(rng, n, prob):
     """
     randomly decide if is small rna or degradation
+
+    Returns:
+        *(np.array)*: True for degradation reads.
     """
-    return 0
+    return rng.random_sample(n) < prob
 
 
-def _random_sequences(precursor, start= None, end=None):
+def _random_sequences(rng, length, spots, n, rates):
     """
     randomly get sequences around some nucleotides.
     It could be enriched in some positions
+
+    Args:
+        *rng(np.random.RandomState)*: random generator.
+
+        *length(int)*: size of the precursor.
+
+        *spots(np.array)*: positions of matures from *_get_spot()*.
+
+        *n(int)*: number of reads.
+
+        *rates(dict)*: probabilities of *isomir* (for each end),
+            *snp*, non-template *addition* and *noise* reads.
+
+    Returns:
+        *(list)*: unique keys of the reads, see *_encode()*,
+            and number of reads for each key.
+    """
+    keys, counts = [], []
+    for size in [CHUNK] * (n // CHUNK) + [n % CHUNK]:
+        if not size:
+            continue
+        spot = spots[rng.randint(0, len(spots), size)]
+        start = spot[:, 0] + _shift(rng, size, rates['isomir'])
+        end = spot[:, 1] + _shift(rng, size, rates['isomir'])
+        noise = _get_type(rng, size, rates['noise'])
+        n_noise = noise.sum()
+        if n_noise:
+            noise_size = rng.randint(18, 31, n_noise)
+            noise_start = (rng.random_sample(n_noise) *
+                           np.maximum(length - noise_size + 1, 1))
+            start[noise] = noise_start.astype(int)
+            end[noise] = start[noise] + noise_size
+        start = np.clip(start, 0, length - 1)
+        end = np.clip(end, start + 1, np.minimum(start + 63, length))
+        add = np.where(rng.random_sample(size) < rates['addition'],
+                       rng.randint(1, _ADD_MAX + 1, size), 0)
+        add = np.minimum(add, length - end)
+        add_code = rng.randint(0, 4 ** _ADD_MAX, size) % (4 ** add)
+        snp = rng.random_sample(size) < rates['snp']
+        snp_pos = np.where(snp, (rng.random_sample(size) *
+                                 np.minimum(end - start, _SNP_MAX)).astype(int),
+                           -1)
+        snp_change = np.where(snp, rng.randint(1, 4, size), 0)
+        key, count = np.unique(_encode(start, end - start, add, add_code,
+                                       snp_pos, snp_change),
+                               return_counts=True)
+        keys.append(key)
+        counts.append(count)
+    if not keys:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    keys, counts = np.concatenate(keys), np.concatenate(counts)
+    unique, index = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(index, weights=counts).astype(np.int64)
+
+
+def _shift(rng, n, prob):
+    """Random trimming of -2, -1, +1 or +2 nts with probability *prob*"""
+    return np.where(rng.random_sample(n) < prob,
+                    rng.choice([-2, -1, 1, 2], n), 0)
+
+
+def _encode(start, size, add, add_code, snp_pos, snp_change):
+    """Encode each read into one integer to collapse them with np.unique"""
+    key = start.astype(np.int64) * 64 + size
+    key = key * (_ADD_MAX + 1) + add
+    key = key * 4 ** _ADD_MAX + add_code
+    key = key * (_SNP_MAX + 1) + snp_pos + 1
+    return key * 4 + snp_change
+
+
+def _decode(key, precursor):
+    """
+    Get the sequence from the key of *_encode()*.
+
+    Returns:
+        *(list)*: sequence, start, end, non-template addition
+            and snp as `position:reference>change` (1-based
+            position on the read) or `-` if none.
+    """
+    key, snp_change = divmod(key, 4)
+    key, snp_pos = divmod(key, _SNP_MAX + 1)
+    key, add_code = divmod(key, 4 ** _ADD_MAX)
+    key, add = divmod(key, _ADD_MAX + 1)
+    start, size = divmod(key, 64)
+    seq = precursor[start:start + size]
+    snp = "-"
+    if snp_pos:
+        pos = snp_pos - 1
+        change = NTS[(NTS.find(seq[pos]) + snp_change) % 4]
+        snp = "%s:%s>%s" % (pos + 1, seq[pos], change)
+        seq = seq[:pos] + change + seq[pos + 1:]
+    addition = "".join(NTS[(add_code // 4 ** i) % 4] for i in range(add))
+    return [seq + addition, start, start + size, addition or "-", snp]
+
+
+def _open(fn, compress=False):
+    if compress:
+        return gzip.open(fn + ".gz", 'wb')
+    return open(fn, 'w', 1024 * 1024)
+
+
+def _write_reads(sequences, samples, counts, prefix, compress=False):
+    """
+    Write fasta file, ma file and real position
+    """
+    out_ma = prefix + ".ma"
+    out_fasta = prefix + ".fasta"
+    out_real = prefix + ".txt"
+    ordered = sorted(sequences.items(), key=lambda seq: seq[1][0])
+    with _open(out_ma, compress) as ma_handle:
+        ma_handle.write("id\tseq\t%s\n" % "\t".join(samples))
+        for block in _blocks(ordered):
+            ma_handle.write("".join(
+                "seq_%s\t%s\t%s\n" % (info[0], seq, "\t".join(
+                    str(c.get(info[0], 0)) for c in counts))
+                for seq, info in block))
+    with _open(out_fasta, compress) as fa_handle:
+        for block in _blocks(ordered):
+            fa_handle.write("".join(">seq_%s\n%s\n" % (info[0], seq)
+                                    for seq, info in block))
+    with _open(out_real, compress) as read_handle:
+        for block in _blocks(ordered):
+            read_handle.write("".join(
+                "%s\tseq_%s_%s_%s_x%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
+                    idx, name, start, end, total, seq, total,
+                    name, start, end, addition, snp)
+                for seq, (idx, name, start, end, addition, snp), total in
+                [(seq, info, sum(c.get(info[0], 0) for c in counts))
+                 for seq, info in block]))
+    ext = ".gz" if compress else ""
+    return [out_ma + ext, out_fasta + ext, out_real + ext]
+
+
+def _blocks(items, size=10000):
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
+
+def _write_bam(sequences, counts, precursors, fn):
+    """
+    Write the sequences of one sample aligned to the precursors.
+    The name of each read is `seq_<idx>_x<counts>`.
     """
-    return 0
+    import pysam
+    names = sorted(precursors)
+    header = {'HD': {'VN': '1.0'},
+              'SQ': [{'SN': name, 'LN': len(precursors[name])}
+                     for name in names]}
+    ref_id = dict((name, idx) for idx, name in enumerate(names))
+    with pysam.AlignmentFile(fn, "wb", header=header) as out_handle:
+        for seq, info in sorted(sequences.items(), key=lambda s: s[1][0]):
+            if not counts.get(info[0]):
+                continue
+            record = pysam.AlignedSegment()
+            record.query_name = "seq_%s_x%s" % (info[0], counts[info[0]])
+            record.query_sequence = seq
+            record.flag = 0
+            record.reference_id = ref_id[info[1]]
+            record.reference_start = info[2]
+            record.mapping_quality = 60
+            record.cigartuples = [(0, len(seq))]
+            out_handle.write(record)
+    return fn
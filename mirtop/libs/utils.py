@@ -41,3 +41,13 @@ def file_exists(fname):
         return fname and os.path.exists(fname) and os.path.getsize(fname) > 0
     except OSError:
         return False
+
+def get_freq(name):
+    """Get counts from the read name (name_xNumber), 0 if it has none.
+    Used for reads of BAM, seqbuster and collapsed FASTA files.
+    """
+    try:
+        counts = int(name.split("_x")[1])
+    except (IndexError, ValueError):
+        return 0
+    return counts
@@ -17,9 +17,11 @@ def _coord(sequence, start, mirna, precursor, iso):
     if iso.subs:
         deletion = 1 if iso.subs[0][1] == "-" else 0
     end = (iso.end - len(iso.add) - insertion + deletion)
-    logger.debug("COOR:: s:%s len:%s end:%s fixedEnd:%s mirna:%s iso:%s" % (
-        start, len(sequence), iso.end, end, mirna, iso.format())
-        )
+    debug = mylog.is_debug()
+    if debug:
+        logger.debug("COOR:: s:%s len:%s end:%s fixedEnd:%s mirna:%s iso:%s" % (
+            start, len(sequence), iso.end, end, mirna, iso.format())
+            )
     dif = abs(mirna[0] - start)
     if start < mirna[0]:
         iso.t5 = sequence[:dif].upper()
@@ -28,9 +30,10 @@ def _coord(sequence, start, mirna, precursor, iso):
     elif start == mirna[0]:
         iso.t5 = 0
     if dif > 4:
-        logger.debug("COOR::start > 3 %s %s %s %s %s" % (
-                        start, len(sequence),
-                        dif, mirna, iso.format()))
+        if debug:
+            logger.debug("COOR::start > 3 %s %s %s %s %s" % (
+                            start, len(sequence),
+                            dif, mirna, iso.format()))
         return None
 
     dif = abs(mirna[1] - end)
@@ -46,8 +49,9 @@ def _coord(sequence, start, mirna, precursor, iso):
     elif end == mirna[1]:
         iso.t3 = 0
     if dif > 4:
-        logger.debug("COOR::end > 3 %s %s %s %s %s" % (
-            len(sequence), end, dif, mirna, iso.format()))
+        if debug:
+            logger.debug("COOR::end > 3 %s %s %s %s %s" % (
+                len(sequence), end, dif, mirna, iso.format()))
         return None
     return True
 
@@ -72,24 +76,28 @@ def annotate(reads, mature_ref, precursors):
             values are *mirtop.realign.hits*
     """
     n_iso = 0
+    debug = mylog.is_debug()
     for r in reads:
         for p in reads[r].precursors:
             start = reads[r].precursors[p].start
             end = reads[r].precursors[p].end
             for mature in mature_ref[p]:
                 mi = mature_ref[p][mature]
-                logger.debug(("\nANN::NEW::read:{s}\n pre:{p} start:{start} end: {end} "
-                              "cigar: {cigar} "
-                              "\n mir:{mature} mir_pos:{mi}\n mir_seqs:{mature_s}"
-                              ).format(s=reads[r].sequence,
-                                       mature_s = precursors[p][mi[0]:mi[1] + 1],
-                                       cigar = reads[r].precursors[p].cigar,
-                                       **locals()))
-                iso_copy =  copy.deepcopy(reads[r].precursors[p])
+                if debug:
+                    logger.debug(("\nANN::NEW::read:{s}\n pre:{p} start:{start} end: {end} "
+                                  "cigar: {cigar} "
+                                  "\n mir:{mature} mir_pos:{mi}\n mir_seqs:{mature_s}"
+                                  ).format(s=reads[r].sequence,
+                                           mature_s = precursors[p][mi[0]:mi[1] + 1],
+                                           cigar = reads[r].precursors[p].cigar,
+                                           **locals()))
+                # _coord only re-assigns attributes, a shallow copy is enough
+                iso_copy = copy.copy(reads[r].precursors[p])
                 is_iso = _coord(reads[r].sequence, start, mi, precursors[p], iso_copy)
-                logger.debug(("ANN::is_iso:{is_iso}").format(**locals()))
-                logger.debug("ANN::annotation:%s iso:%s" % (r, reads[r].precursors[p].format()))
-                logger.debug("ANN::annotation:%s Variant:%s" % (r, reads[r].precursors[p].formatGFF()))
+                if debug:
+                    logger.debug(("ANN::is_iso:{is_iso}").format(**locals()))
+                    logger.debug("ANN::annotation:%s iso:%s" % (r, reads[r].precursors[p].format()))
+                    logger.debug("ANN::annotation:%s Variant:%s" % (r, reads[r].precursors[p].formatGFF()))
                 if is_iso:
                     n_iso += 1
                     reads[r].precursors[p] = iso_copy
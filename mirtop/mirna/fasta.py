@@ -1,13 +1,16 @@
 """Read precursor fasta file"""
 
+import mmap
 from collections import defaultdict
 
 import mirtop.libs.logger as mylog
 
 logger = mylog.getLogger(__name__)
 
+PADDING = "NNNNNNNNNNNN"
 
-def read_precursor(precursor, sps=None):
+
+def read_precursor(precursor, sps=None, lazy=False):
     """
     Load precursor file for that species
 
@@ -17,25 +20,208 @@ def read_precursor(precursor, sps=None):
         *sps(str)*: if any, select species to keep.
             It'll do a `header_sequence.find(sps)`.
 
+        *lazy(boolean)*: return a *precursor_index* that reads
+            the sequences on demand instead of loading all of them.
+
     Returns:
         *hairpin(dict)*: keys are precursor names and
             values are precursor sequences.
     """
+    if lazy:
+        return precursor_index(precursor, sps)
     hairpin = defaultdict(str)
     name = None
+    seq = []
     with open(precursor) as in_handle:
         for line in in_handle:
             if line.startswith(">"):
-                if name in hairpin:
-                    hairpin[name] = hairpin[name] + "NNNNNNNNNNNN"
+                if name and seq:
+                    hairpin[name] = "".join(seq) + PADDING
+                seq = []
                 if not sps or line.find(sps) > -1:
                     name = line.strip().replace(">", " ").split()[0]
                 else:
                     name = None
                 logger.debug(name)
             elif name:
-                hairpin[name] += line.strip().replace("U", "T")
-                logger.debug(hairpin[name])
+                seq.append(line.strip().replace("U", "T"))
         if name:
-            hairpin[name] = hairpin[name] + "NNNNNNNNNNNN"
+            hairpin[name] = "".join(seq) + PADDING
     return hairpin
+
+
+class precursor_index(object):
+    """
+    Dict-like access to precursor sequences of a fasta file.
+
+    The fasta file is memory-mapped and indexed like `samtools faidx`
+    does, so only the offsets are kept in memory and the sequences
+    are decoded when they are requested. The `NNNNNNNNNNNN` padding
+    added by *read_precursor()* is virtual: it is only returned as
+    part of the sequence, never stored.
+
+    It supports the operations used over *args.precursors*:
+
+        >>> precursors["hsa-let-7a-1"]
+        >>> "hsa-let-7a-1" in precursors
+        >>> precursors.fetch("hsa-let-7a-1", 5, 27)
+
+    Missing precursors return an empty sequence as the
+    `defaultdict(str)` of *read_precursor()* does.
+    """
+
+    def __init__(self, fn, sps=None, cache_size=1024):
+        self.fn = fn
+        self.sps = sps
+        self.cache_size = cache_size
+        self._cache = dict()
+        self._open()
+        self._index = _index_fasta(self._map, sps)
+
+    def _open(self):
+        self._handle = open(self.fn, 'rb')
+        try:
+            self._map = mmap.mmap(self._handle.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            self._map = ""
+
+    def __getstate__(self):
+        """Pickle only the index, workers will map the file again."""
+        return {'fn': self.fn, 'sps': self.sps,
+                'cache_size': self.cache_size, '_index': self._index}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = dict()
+        self._open()
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def get(self, name, default=None):
+        if name not in self._index:
+            return default
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            return ""
+        if name not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[name] = self._read(name, 0,
+                                           self._index[name][2]) + PADDING
+        return self._cache[name]
+
+    def length(self, name):
+        """Length of the precursor including the virtual padding."""
+        if name not in self._index:
+            return 0
+        return self._index[name][2] + len(PADDING)
+
+    def fetch(self, name, start=0, end=None):
+        """
+        Get a slice of the precursor, positions are 0-based
+        and *end* is not included, like `sequence[start:end]`.
+
+        Args:
+            *name(str)*: precursor name.
+
+            *start(int)*: first position.
+
+            *end(int)*: last position, None means the end
+                of the precursor including the padding.
+
+        Returns:
+            *(str)*: sequence of the slice.
+        """
+        size = self.length(name)
+        start, end, _ = slice(start, end).indices(size)
+        if start >= end:
+            return ""
+        length = self._index[name][2]
+        seq = self._read(name, min(start, length), min(end, length))
+        return seq + "N" * (end - max(start, length) if end > length else 0)
+
+    def _read(self, name, start, end):
+        seq_start, seq_end, length, line_bases, line_width = self._index[name]
+        if start >= end:
+            return ""
+        if line_bases:
+            raw_start = seq_start + (start // line_bases) * line_width + \
+                start % line_bases
+            raw_end = seq_start + (end // line_bases) * line_width + \
+                end % line_bases
+        else:
+            raw_start, raw_end = seq_start, seq_end
+        raw = self._map[raw_start:raw_end]
+        if not isinstance(raw, str):
+            raw = raw.decode()
+        seq = raw.replace("\n", "").replace("\r", "").replace("U", "T")
+        if not line_bases:
+            seq = seq[start:end]
+        return seq
+
+
+def _index_fasta(handle, sps=None):
+    """
+    Index the fasta file as `samtools faidx` does.
+
+    Args:
+        *handle(mmap)*: memory-mapped fasta file.
+
+        *sps(str)*: if any, select species to keep.
+
+    Returns:
+        *index(dict)*: keys are precursor names and values are
+            [seq_start, seq_end, length, line_bases, line_width].
+            line_bases is 0 when the lines of the record have
+            different sizes and the record needs to be read entirely.
+    """
+    index = dict()
+    record = None
+    offset = 0
+    size = len(handle)
+    while offset < size:
+        end = handle.find(b"\n", offset)
+        end = size if end < 0 else end + 1
+        line = handle[offset:end]
+        if not isinstance(line, str):
+            line = line.decode()
+        if line.startswith(">"):
+            if record:
+                index[record[0]] = _close_record(record[1:], offset)
+            record = None
+            if not sps or line.find(sps) > -1:
+                name = line.strip().replace(">", " ").split()[0]
+                record = [name, end, 0, [], []]
+        elif record:
+            bases = len(line.rstrip("\r\n"))
+            record[2] += bases
+            record[3].append(bases)
+            record[4].append(len(line))
+        offset = end
+    if record:
+        index[record[0]] = _close_record(record[1:], size)
+    logger.debug("FASTA::index %s precursors" % len(index))
+    return index
+
+
+def _close_record(record, seq_end):
+    seq_start, length, bases, widths = record
+    line_bases, line_width = 0, 0
+    if bases and len(set(bases[:-1])) < 2 and len(set(widths[:-1])) < 2 \
+            and bases[-1] <= bases[0]:
+        line_bases, line_width = bases[0], widths[0]
+    return [seq_start, seq_end, length, line_bases, line_width]
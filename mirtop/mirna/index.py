@@ -0,0 +1,264 @@
+"""k-mer index of precursors to place reads without an aligner"""
+
+import os
+import sys
+from collections import defaultdict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+KMER = 8
+# nts at the 3' end that can be non-template additions, see filter.tune()
+ADDITION = 3
+# max number of insertions or deletions in the banded alignment
+BAND = 1
+# change it when the format of the file written by save() changes
+FORMAT = 1
+
+
+class kmer_index(object):
+    """
+    Hash of k-mers to positions in the precursors.
+
+    Every k-mer of a read is looked up, so a read with one mismatch
+    still has exact seeds when it is at least *2 * k* nts long.
+    Each seed gives a candidate start on the precursor, that is
+    verified comparing the read with the precursor without gaps,
+    and with *banded_align()* if there are too many mismatches and
+    the first *k* nts match, so gaps are only found after them.
+
+    Args:
+        *precursors(dict)*: keys are precursor names and values
+            sequences, from *mirtop.mirna.fasta.read_precursor()*.
+
+        *k(int)*: size of the k-mers.
+
+        *kmers(dict)*: k-mers already computed, from *load()*.
+    """
+
+    def __init__(self, precursors, k=KMER, kmers=None):
+        self.k = k
+        self.precursors = precursors
+        if kmers is None:
+            kmers = defaultdict(list)
+            for name in precursors:
+                seq = precursors[name]
+                for pos in range(0, len(seq) - k + 1):
+                    kmer = seq[pos:pos + k]
+                    if kmer.find("N") < 0:
+                        kmers[kmer].append((name, pos))
+            kmers = dict(kmers)
+        self.kmers = kmers
+        logger.debug("INDEX::kmers %s" % len(self.kmers))
+
+    def candidates(self, seq):
+        """
+        Starts on precursors sharing at least one k-mer with *seq*.
+
+        Returns:
+            *(set)*: with (precursor, start).
+        """
+        k = self.k
+        kmers = self.kmers
+        found = set()
+        for pos in range(0, len(seq) - k + 1):
+            for name, start in kmers.get(seq[pos:pos + k], ()):
+                found.add((name, start - pos))
+        return found
+
+    def map(self, seq, max_subs=1, band=BAND):
+        """
+        Place a read on the precursors.
+
+        Args:
+            *seq(str)*: read sequence.
+
+            *max_subs(int)*: mismatches or gaps allowed out of the
+                last *ADDITION* nts, that can be non-template additions.
+
+            *band(int)*: max gaps, 0 to skip the banded alignment.
+
+        Returns:
+            *(list)*: with (precursor, start, cigar) sorted by position.
+                *cigar* is a list of (operation, length) like pysam
+                *cigartuples*, used by *mirtop.bam.filter.tune()*.
+        """
+        hits = []
+        k = self.k
+        size = len(seq)
+        body = size - ADDITION
+        query = seq[:body]
+        for name, start in self.candidates(seq):
+            precursor = self.precursors[name]
+            if start < 0 or start + size > len(precursor):
+                continue
+            target = precursor[start:start + body]
+            subs = 0
+            if target != query:
+                for pos in range(body):
+                    if query[pos] != target[pos]:
+                        subs += 1
+                        if subs > max_subs:
+                            break
+            if subs <= max_subs:
+                hits.append((name, start, [(0, size)]))
+            elif band and query[:k] == target[:k]:
+                cigar = banded_align(seq[:body], precursor, start,
+                                     max_subs, band)
+                if cigar:
+                    hits.append((name, start, _add_tail(cigar, size - body)))
+        return sorted(hits)
+
+
+def banded_align(seq, target, start, max_edits=1, band=BAND):
+    """
+    Align all *seq* to *target* starting at *start*, only
+    allowing up to *band* gaps, and *max_edits* mismatches plus gaps.
+
+    The nts matching before the first mismatch are not aligned again,
+    and alignments starting or ending with a gap are not returned,
+    since they are the same alignment from other start.
+
+    Returns:
+        *(list)*: cigar as (operation, length) or None if the
+            alignment needs more than *max_edits*.
+    """
+    size = len(seq)
+    exact = 0
+    while exact < size and start + exact < len(target) and \
+            seq[exact] == target[start + exact]:
+        exact += 1
+    if exact == size:
+        return [(0, size)]
+    inf = max_edits + 1
+    # score[i][d]: edits aligning seq[:exact + i] to
+    # target[start:start + exact + i + d]
+    width = 2 * band + 1
+    rows = size - exact + 1
+    score = [[inf] * width for _ in range(rows)]
+    trace = [[None] * width for _ in range(rows)]
+    score[0][band] = 0
+    for i in range(rows):
+        row, last = score[i], score[i - 1]
+        for col in range(width):
+            j = exact + i + col - band
+            if j < 0 or start + j > len(target):
+                continue
+            best = row[col]
+            if i and last[col] < inf:
+                cost = last[col] + (seq[exact + i - 1] != target[start + j - 1])
+                if cost < best:
+                    best, trace[i][col] = cost, 0
+            if i and col + 1 < width and last[col + 1] + 1 < best:
+                best, trace[i][col] = last[col + 1] + 1, 1
+            if col and row[col - 1] + 1 < best:
+                best, trace[i][col] = row[col - 1] + 1, 2
+            row[col] = best
+        if min(row) >= inf:
+            return None
+    ends = [(score[-1][col], col) for col in range(width)
+            if score[-1][col] < inf and trace[-1][col] == 0]
+    if not ends:
+        return None
+    i, col = rows - 1, min(ends)[1]
+    ops = []
+    while i or col != band:
+        op = trace[i][col]
+        ops.append(op)
+        if op == 0:
+            i -= 1
+        elif op == 1:
+            i, col = i - 1, col + 1
+        else:
+            col -= 1
+    ops.extend([0] * exact)
+    ops.reverse()
+    if ops[0] != 0:
+        return None
+    return _compress(ops)
+
+
+def _compress(ops):
+    cigar = []
+    for op in ops:
+        if cigar and cigar[-1][0] == op:
+            cigar[-1] = (op, cigar[-1][1] + 1)
+        else:
+            cigar.append((op, 1))
+    return cigar
+
+
+def _add_tail(cigar, size):
+    if not size:
+        return cigar
+    if cigar[-1][0] == 0:
+        return cigar[:-1] + [(0, cigar[-1][1] + size)]
+    return cigar + [(0, size)]
+
+
+def load(precursors, fn=None, sps=None, k=KMER, cache=None):
+    """
+    Get the *kmer_index* of the precursors, read from the *cache*
+    folder if it was saved there before for the same fasta file,
+    species and *k*. Otherwise it is built, and saved in *cache* as
+    `<fasta name>.<sps>.k<k>.idx` when it is given.
+
+    Args:
+        *precursors(dict)*: from *mirtop.mirna.fasta.read_precursor()*.
+
+        *fn(str)*: fasta file of the precursors.
+
+        *sps(str)*: species used to read the precursors.
+
+        *k(int)*: size of the k-mers.
+
+        *cache(str)*: folder to save the index, None to not cache it.
+
+    Returns:
+        *(kmer_index)*: index of the precursors.
+    """
+    if not fn or not cache:
+        return kmer_index(precursors, k)
+    fn_idx = os.path.join(cache, "%s.%s.k%s.idx" % (
+        os.path.basename(fn), sps or "all", k))
+    key = _cache_key(fn, sps, k)
+    if os.path.exists(fn_idx):
+        try:
+            with open(fn_idx, 'rb') as in_handle:
+                if pickle.load(in_handle) == key:
+                    logger.debug("INDEX::load %s" % fn_idx)
+                    return kmer_index(precursors, k, pickle.load(in_handle))
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            logger.debug("INDEX::can't read %s" % fn_idx)
+    index = kmer_index(precursors, k)
+    save(index, fn_idx, key)
+    return index
+
+
+def save(index, fn_idx, key):
+    """Write the k-mers of *index* to *fn_idx*, skip if not writable."""
+    tmp = "%s.%s.tmp" % (fn_idx, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(fn_idx)):
+            os.makedirs(os.path.dirname(fn_idx))
+        with open(tmp, 'wb') as out_handle:
+            pickle.dump(key, out_handle, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(index.kmers, out_handle, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, fn_idx)
+        logger.debug("INDEX::saved %s" % fn_idx)
+    except (IOError, OSError):
+        logger.debug("INDEX::can't write %s" % fn_idx)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _cache_key(fn, sps, k):
+    info = os.stat(fn)
+    return [FORMAT, sys.version_info[0], k, sps, os.path.abspath(fn),
+            info.st_size, int(info.st_mtime)]
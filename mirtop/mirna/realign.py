@@ -1,5 +1,3 @@
-from Bio import pairwise2
-from Bio.Seq import Seq
 from collections import defaultdict
 
 from mirtop.mirna.keys import CODE2NT, NT2CODE
@@ -132,6 +130,15 @@ class isomir:
         return False
 
 
+# codes for pairs of trinucleotides, to translate 6 nts with one lookup
+NT2CODE_PAIR = dict((nt1 + nt2, NT2CODE[nt1] + NT2CODE[nt2])
+                    for nt1 in NT2CODE for nt2 in NT2CODE)
+# decoded sequences shared by all the read_id calls of the process,
+# it is emptied when it reaches UID_CACHE_SIZE elements.
+UID_CACHE_SIZE = 500000
+UID_CACHE = dict()
+
+
 def read_id(idu):
     """
     Read a unique identifier for the sequence and
@@ -143,12 +150,24 @@ def read_id(idu):
     Inspared in MINTplate: https://cm.jefferson.edu/MINTbase
     https://github.com/TJU-CMC-Org/MINTmap/tree/master/MINTplates
 
+    Decoded sequences are kept in *UID_CACHE*.
+
     Args:
         *idu(str)*: unique identifier for the sequence.
 
     Returns:
         *seq(str)*: nucleotides sequences.
     """
+    seq = UID_CACHE.get(idu)
+    if seq is None:
+        seq = _read_id(idu)
+        if len(UID_CACHE) >= UID_CACHE_SIZE:
+            UID_CACHE.clear()
+        UID_CACHE[idu] = seq
+    return seq
+
+
+def _read_id(idu):
     seq = ""
     for i in idu:
         if i == "1" or i == "2":
@@ -158,6 +177,19 @@ def read_id(idu):
     return seq
 
 
+def read_ids(idus):
+    """
+    Batch version of *read_id()*.
+
+    Args:
+        *idus(list)*: unique identifiers for the sequences.
+
+    Returns:
+        *seqs(list)*: nucleotides sequences in the same order.
+    """
+    return [read_id(idu) for idu in idus]
+
+
 def make_id(seq):
     """
     Create a unique identifier for the sequence from the nucleotides,
@@ -174,24 +206,34 @@ def make_id(seq):
     Returns:
         *idName(str)*: unique identifier for the sequence.
     """
-    start = 0
-    idu = ""
     if not seq:
         raise ValueError("Length of sequence is Empty.")
-    for i in range(0, len(seq) + 1, 3):
-        if i == 0:
-            continue
-        trint = seq[start:i]
-        idu += NT2CODE[trint]
-        start = i
-    if len(seq) > i:
-        dummy = "A" * (3 - (len(seq) - i))
-        trint = seq[i:len(seq)]
-        idu += NT2CODE["%s%s" % (trint, dummy)]
+    size = len(seq)
+    pairs = size - size % 6
+    idu = "".join([NT2CODE_PAIR[seq[i:i + 6]] for i in range(0, pairs, 6)])
+    if size - pairs >= 3:
+        idu += NT2CODE[seq[pairs:pairs + 3]]
+    rest = size % 3
+    if rest:
+        dummy = "A" * (3 - rest)
+        idu += NT2CODE["%s%s" % (seq[size - rest:], dummy)]
         idu += str(len(dummy))
     return idu
 
 
+def make_ids(seqs):
+    """
+    Batch version of *make_id()*.
+
+    Args:
+        *seqs(list)*: nucleotides sequences.
+
+    Returns:
+        *idus(list)*: unique identifiers in the same order.
+    """
+    return [make_id(seq) for seq in seqs]
+
+
 def align(x, y, local=False):
     """
     Pairwise alignments between two sequenes.
@@ -207,6 +249,7 @@ def align(x, y, local=False):
     Returns:
         *aligned_x(hit)*: alignment information, socre and positions.
     """
+    from Bio import pairwise2
     if local:
         aligned_x = pairwise2.align.localxx(x, y)[0]
     else:
@@ -274,7 +317,7 @@ def make_cigar(seq, mature):
     return short
 
 
-def cigar_correction(cigarLine, query, target):
+def cigar_correction(cigarLine, query, target, target_start=0):
     """
     Read from CIGAR in BAM file to define mismatches.
 
@@ -285,11 +328,14 @@ def cigar_correction(cigarLine, query, target):
 
         *target(str)*: target sequence.
 
+        *target_start(int)*: position of the target where the
+            alignment starts, to avoid slicing long targets.
+
     Returns:
         *(list)*: [query_nts, target_nts]
     """
     query_pos = 0
-    target_pos = 0
+    target_pos = target_start
     query_fixed = []
     target_fixed = []
     for (cigarType, cigarLength) in cigarLine:
@@ -391,6 +437,7 @@ def reverse_complement(seq):
 
         >>> ATGC
     """
+    from Bio.Seq import Seq
     return Seq(seq).reverse_complement()
 
 
@@ -435,14 +482,14 @@ def align_from_variants(sequence, mature, variants):
     Returns:
         *snp(list)*: [[pos, target, reference]]
     """
-    init_log = "iso:%s -> %s\nref:%s" % (sequence, variants, mature)
+    init_seq, init_mature = sequence, mature
     snps = []
     k = [v.split(":")[0] for v in variants.split(",") if v.find(":") > -1]
     v = [int(v.split(":")[1]) for v in variants.split(",") if v.find(":") > -1]
     var_dict = dict(zip(k, v))
-    logger.debug("realign::align_from_variants::sequence %s" % sequence)
-    logger.debug("realign::align_from_variants::mature %s" % mature)
-    logger.debug("realign::align_from_variants::variants %s" % variants)
+    logger.debug("realign::align_from_variants::sequence %s", sequence)
+    logger.debug("realign::align_from_variants::mature %s", mature)
+    logger.debug("realign::align_from_variants::variants %s", variants)
     # snp = [v for v in variants.split(",") if v.find("snp") > -1]
     snp = ["iso_snp" for v in variants.split(",") if v.find("snp") > -1]
     fix_5p = 4
@@ -453,11 +500,13 @@ def align_from_variants(sequence, mature, variants):
         sequence = sequence[:-1 * var_dict["iso_add"]]
     if "iso_3p" in k and var_dict["iso_3p"] > 0:
         sequence = sequence[:-1 * var_dict["iso_3p"]]
-    logger.debug("realign::align_from_variants::snp %s" % snp)
-    logger.debug("realign::align_from_variants::sequence %s" % sequence)
-    logger.debug("realign::align_from_variants::mature %s" % mature)
+    logger.debug("realign::align_from_variants::snp %s", snp)
+    logger.debug("realign::align_from_variants::sequence %s", sequence)
+    logger.debug("realign::align_from_variants::mature %s", mature)
     if len(sequence) > len(mature):
-        logger.warning("Invalid isomiR definition:\n%s\niso:%s\nref:%s" % (init_log, sequence, mature))
+        logger.warning("Invalid isomiR definition:\niso:%s -> %s\nref:%s"
+                       "\niso:%s\nref:%s" % (init_seq, variants, init_mature,
+                                            sequence, mature))
         return "Invalid"
     for p in range(0, len(sequence)):
         if sequence[p] != mature[p]:
@@ -476,10 +525,10 @@ def align_from_variants(sequence, mature, variants):
             #    value = "iso_snp_central_supp"
             #else:
             #    value = "iso_snp"
-            logger.debug("realign::align_from_variants::value %s at %s" % (value, pos))
+            logger.debug("realign::align_from_variants::value %s at %s", value, pos)
             if value in snp:
                 snps.append([pos, sequence[p], mature[p]])
-    logger.debug("realign::align_from_variants::snps %s" % snps)
+    logger.debug("realign::align_from_variants::snps %s", snps)
     return snps
 
 
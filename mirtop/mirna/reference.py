@@ -0,0 +1,120 @@
+"""Load and cache precursor and mature references"""
+
+import atexit
+import copy
+
+from mirtop.mirna import fasta, mapper
+from mirtop.mirna import index as kmer
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+# references already loaded, shared by all the jobs of one process
+_CACHE = dict()
+# references packed in files for other processes, see share()
+_SHARED = dict()
+
+
+def load(args, database=True):
+    """
+    Set *args.precursors*, *args.matures* and *args.database*
+    from *args.hairpin*, *args.sps* and *args.gtf*.
+
+    Files already loaded by this process are not read again,
+    so many commands run by *mirtop batch* share them. References
+    from *share()* are kept, so workers use the memory-mapped files.
+
+    Args:
+        *args(namedtuple)*: arguments with *hairpin*, *sps* and *gtf*.
+            *lazy_hairpin* is used if present.
+
+        *database(boolean)*: guess the database name from *args.gtf*,
+            it raises an error if it is not found.
+
+    Returns:
+        *args(namedtuple)*: same object with references.
+    """
+    lazy = getattr(args, "lazy_hairpin", False)
+    if database:
+        args.database = _cached(("database", args.gtf),
+                                mapper.guess_database, args.gtf)
+    if getattr(args, "shared_references", False):
+        return args
+    args.precursors = _cached(("hairpin", args.hairpin, args.sps, lazy),
+                              fasta.read_precursor,
+                              args.hairpin, args.sps, lazy)
+    args.matures = _cached(("gtf", args.gtf),
+                           mapper.read_gtf_to_precursor, args.gtf)
+    return args
+
+
+def index(args):
+    """
+    Set *args.index* with the *mirtop.mirna.index.kmer_index* of
+    *args.precursors*. It is shared by the jobs of this process,
+    and cached on disk in *args.index_cache* if it is set.
+
+    Args:
+        *args(namedtuple)*: arguments with *precursors*, and
+            *hairpin*, *sps* and *index_cache* to cache the index.
+
+    Returns:
+        *(kmer_index)*: index of the precursors.
+    """
+    if getattr(args, "index", None) is not None:
+        return args.index
+    hairpin = getattr(args, "hairpin", None)
+    sps = getattr(args, "sps", None)
+    if not hairpin:
+        args.index = kmer.load(args.precursors)
+    else:
+        lazy = getattr(args, "lazy_hairpin", False)
+        args.index = _cached(("index", hairpin, sps, lazy), kmer.load,
+                             args.precursors, hairpin, sps, kmer.KMER,
+                             getattr(args, "index_cache", None))
+    return args.index
+
+
+def share(args):
+    """
+    Get a copy of *args* with *precursors* and *matures* packed
+    by *mirtop.mirna.shared.pack()*, to give them to worker processes
+    without a copy of the references for each one. Files are written
+    once by process and removed at exit.
+
+    Args:
+        *args(namedtuple)*: arguments with references from *load()*.
+
+    Returns:
+        *args(namedtuple)*: copy of *args* with the shared references.
+    """
+    lazy = getattr(args, "lazy_hairpin", False)
+    key = (getattr(args, "hairpin", None),
+           getattr(args, "sps", None), lazy, getattr(args, "gtf", None))
+    if key not in _SHARED:
+        _SHARED[key] = _pack(args.precursors, args.matures)
+    packed = copy.copy(args)
+    packed.precursors, packed.matures = _SHARED[key]
+    packed.shared_references = True
+    return packed
+
+
+def _pack(precursors, matures):
+    # numpy is only needed with many processes
+    from mirtop.mirna import shared
+    folder = shared.temp_folder()
+    atexit.register(shared.remove, folder)
+    return shared.pack(precursors, matures, folder)
+
+
+def clear():
+    """Remove all references from the cache."""
+    _CACHE.clear()
+    _SHARED.clear()
+
+
+def _cached(key, fn, *args):
+    if key not in _CACHE:
+        logger.debug("REFERENCE::load %s", key)
+        _CACHE[key] = fn(*args)
+    return _CACHE[key]
@@ -0,0 +1,157 @@
+"""Read-only references in memory-mapped files shared by many processes"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from mirtop.mirna.fasta import precursor_index, PADDING
+import mirtop.libs.logger as mylog
+
+logger = mylog.getLogger(__name__)
+
+# memory-backed folder of linux, files there don't go to disk
+SHM = "/dev/shm"
+
+
+def pack(precursors, matures, folder):
+    """
+    Write precursors and matures to *folder*, and map them back.
+
+    Precursors are written as a fasta file with one line by sequence,
+    read with *mirtop.mirna.fasta.precursor_index*, and matures as a
+    NumPy record array read with *mature_table*. Both only pickle
+    the file name and the offsets of each precursor, so the processes
+    receiving them map the same files instead of getting a copy of
+    all the sequences, and the pages are shared by all of them.
+
+    Args:
+        *precursors(dict)*: from *mirtop.mirna.fasta.read_precursor()*.
+
+        *matures(dict)*: from *mirtop.mirna.mapper.read_gtf_to_precursor()*.
+
+        *folder(str)*: folder to write the files, see *temp_folder()*.
+
+    Returns:
+        *(precursors, matures)*: *precursor_index* and *mature_table*.
+    """
+    if not isinstance(precursors, precursor_index):
+        fn = os.path.join(folder, "hairpin.fa")
+        with open(fn, 'w') as out_handle:
+            for name in sorted(precursors):
+                seq = precursors[name]
+                if seq.endswith(PADDING):
+                    seq = seq[:-len(PADDING)]
+                out_handle.write(">%s\n%s\n" % (name, seq))
+        precursors = precursor_index(fn)
+    if matures is not None:
+        fn = os.path.join(folder, "matures.npy")
+        np.save(fn, _to_records(matures))
+        matures = mature_table(fn)
+    logger.debug("SHARED::packed references in %s" % folder)
+    return precursors, matures
+
+
+def temp_folder():
+    """Temporary folder in memory if possible, remove it with *remove()*"""
+    base = SHM if os.path.isdir(SHM) and os.access(SHM, os.W_OK) else None
+    return tempfile.mkdtemp(prefix="mirtop_", dir=base)
+
+
+def remove(folder):
+    """Remove the files of *pack()*."""
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+class mature_table(object):
+    """
+    Dict-like access to the positions of the matures of each
+    precursor, like *mirtop.mirna.mapper.read_gtf_to_precursor()*:
+
+        >>> matures["hsa-let-7a-1"]
+        {'hsa-let-7a-5p': [5, 26], 'hsa-let-7a-3p': [56, 76]}
+
+    The positions are a NumPy record array memory-mapped from *fn*,
+    with one row by mature sorted by precursor, and the rows of each
+    precursor are decoded when they are requested. Missing precursors
+    return an empty dict as the `defaultdict(dict)` of the GTF reader.
+    """
+
+    def __init__(self, fn, cache_size=1024):
+        self.fn = fn
+        self.cache_size = cache_size
+        self._open()
+
+    def _open(self):
+        self._cache = dict()
+        self._table = np.load(self.fn, mmap_mode="r")
+        self._index = _index_records(self._table)
+
+    def __getstate__(self):
+        """Pickle only the file name, workers will map it again."""
+        return {'fn': self.fn, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def items(self):
+        return [(name, self[name]) for name in self._index]
+
+    def get(self, name, default=None):
+        if name not in self._index:
+            return default
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            return dict()
+        if name not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            first, last = self._index[name]
+            self._cache[name] = dict(
+                (_str(row['mature']), [int(row['start']), int(row['end'])])
+                for row in self._table[first:last])
+        return self._cache[name]
+
+
+def _to_records(matures):
+    """Matures as a record array sorted by precursor."""
+    rows = [(precursor, mature, pos[0], pos[1])
+            for precursor in sorted(matures)
+            for mature, pos in matures[precursor].items()]
+    size = max([len(row[0]) for row in rows] + [1])
+    size_mature = max([len(row[1]) for row in rows] + [1])
+    return np.array(rows, dtype=[('precursor', 'S%s' % size),
+                                 ('mature', 'S%s' % size_mature),
+                                 ('start', 'i8'), ('end', 'i8')])
+
+
+def _index_records(table):
+    """First and last row of each precursor."""
+    index = dict()
+    for idx, name in enumerate(table['precursor']):
+        name = _str(name)
+        if name not in index:
+            index[name] = [idx, idx + 1]
+        else:
+            index[name][1] = idx + 1
+    return index
+
+
+def _str(value):
+    return value if isinstance(value, str) else value.decode()
@@ -0,0 +1 @@
+__version__ = "0.3.17"
\ No newline at end of file
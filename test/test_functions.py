@@ -5,6 +5,7 @@ Inspired in bcbio-nextgen code
 """
 from __future__ import print_function;
 import os
+import re
 import unittest
 
 from nose.plugins.attrib import attr
@@ -68,6 +69,32 @@ class FunctionsTest(unittest.TestCase):
         # read data/aligments/let7-perfect.bam
         return True
 
+    @attr(read_index=True)
+    def test_read_index(self):
+        """testing indexed precursor fasta"""
+        import pickle
+        from mirtop.mirna import fasta
+        fn = "data/examples/annotate/hairpin.fa"
+        for sps in ["hsa", None]:
+            loaded = fasta.read_precursor(fn, sps)
+            index = fasta.read_precursor(fn, sps, lazy=True)
+            if sorted(loaded.keys()) != sorted(index.keys()):
+                raise ValueError("Index has different precursors.")
+            for name in loaded:
+                if loaded[name] != index[name]:
+                    raise ValueError("%s is different: %s" % (name,
+                                                              index[name]))
+                for start, end in [(0, 10), (55, 70), (80, None), (3, 1)]:
+                    if loaded[name][start:end] != index.fetch(name, start,
+                                                              end):
+                        raise ValueError("%s:%s-%s is different: %s" % (
+                            name, start, end, index.fetch(name, start, end)))
+        if index["missing"] != "" or "missing" in index:
+            raise ValueError("Missing precursors should be empty.")
+        copy = pickle.loads(pickle.dumps(index))
+        if copy["hsa-let-7f-1"] != loaded["hsa-let-7f-1"]:
+            raise ValueError("Pickled index is different.")
+
     @attr(read_genomic=True)
     def test_read_genomic(self):
         from mirtop.mirna import mapper
@@ -105,6 +132,41 @@ class FunctionsTest(unittest.TestCase):
         _convert("@#%$@2", "AAACCCTTTGGGA", True)
         _convert("@#%$g1", "AAACCCTTTGGGAT", True)
 
+    @attr(code=True)
+    def test_code_batch(self):
+        """testing code functions give the same ids than the first version"""
+        import random
+        from mirtop.mirna.keys import NT2CODE
+        from mirtop.mirna.realign import make_id, make_ids, read_id, read_ids
+
+        def _make_id(seq):
+            start = 0
+            idu = ""
+            for i in range(0, len(seq) + 1, 3):
+                if i == 0:
+                    continue
+                idu += NT2CODE[seq[start:i]]
+                start = i
+            if len(seq) > i:
+                dummy = "A" * (3 - (len(seq) - i))
+                idu += NT2CODE["%s%s" % (seq[i:len(seq)], dummy)]
+                idu += str(len(dummy))
+            return idu
+
+        rnd = random.Random(42)
+        seqs = ["".join(rnd.choice("ACGT") for _ in range(rnd.randint(1, 40)))
+                for _ in range(2000)]
+        seqs.extend(seqs[:100])
+        idus = [_make_id(seq) for seq in seqs]
+        if [make_id(seq) for seq in seqs] != idus:
+            raise ValueError("make_id differs from first version.")
+        if make_ids(seqs) != idus:
+            raise ValueError("make_ids differs from first version.")
+        if [read_id(idu) for idu in idus] != seqs:
+            raise ValueError("read_id doesn't decode make_id.")
+        if read_ids(idus) != seqs:
+            raise ValueError("read_ids doesn't decode make_id.")
+
     @attr(cigar=True)
     def test_cigar(self):
         """testing cigar correction function"""
@@ -260,6 +322,33 @@ class FunctionsTest(unittest.TestCase):
         print("\naddition\n")
         annotate("data/examples/seqbuster/readsAdd.mirna", seqbuster.read_file)
 
+    @attr(seqbuster=True)
+    def test_seq_attribute(self):
+        """testing Seq attribute matches the decoded UID"""
+        from mirtop.gff.body import read_attributes, get_sequence
+        from mirtop.mirna.realign import read_id
+        from mirtop.importer import seqbuster
+        from mirtop.mirna import annotate, reference
+        from mirtop.gff import body
+        import argparse
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3", add_extra=True,
+            add_seq=True, out_format="gtf")
+        reference.load(args)
+        reads = seqbuster.read_file("data/examples/seqbuster/reads20.mirna",
+                                    args)
+        ann = annotate.annotate(reads, args.matures, args.precursors)
+        lines = body.create(ann, "miRBase21", "Example", args)
+        for chrom in lines:
+            for start in lines[chrom]:
+                for hit in lines[chrom][start]:
+                    attr = read_attributes(hit[4], " ")
+                    if "Seq" not in attr:
+                        raise ValueError("Seq attribute missing: %s" % hit[4])
+                    if get_sequence(attr) != read_id(attr["UID"]):
+                        raise ValueError("Seq doesn't match UID: %s" % hit[4])
+
     @attr(srnabench=True)
     def test_srnabench(self):
         """testing reading seqbuster files function"""
@@ -269,19 +358,46 @@ class FunctionsTest(unittest.TestCase):
         from mirtop.importer import srnabench
         annotate("data/examples/srnabench", srnabench.read_file, create=False)
 
+    @attr(srnabench_iso=True)
+    def test_srnabench_iso(self):
+        """testing sRNAbench isomiRs lookup and lines pasted directly"""
+        import mirtop.gff
+        from mirtop.importer import srnabench
+        from mirtop.gff.body import paste_columns, read_gff_line
+        from mirtop.mirna.realign import make_id
+        iso = srnabench._read_iso(
+            "data/examples/srnabench/microRNAannotation.txt")
+        key = (make_id("ATGAGGTAGTAGGTTGTATAGTTTTT"), "hsa-let-7a-5p")
+        if iso[key] != "iso_add:+1,iso_5p:+1":
+            raise ValueError("Wrong isomiR for %s: %s" % (key, iso[key]))
+        attrb = [("Read", "TGAGGTAGTAGGTTGTATAGTT"), ("Name", "let-7a"),
+                 ("Variant", ""), ("Expression", 10)]
+        for sep in [" ", "="]:
+            line = srnabench._paste("let-7a-1", "miRBase", "isomiR", 5, 26,
+                                    attrb, sep)
+            old = ("let-7a-1\tmiRBase\tisomiR\t5\t26\t.\t+\t.\t"
+                   "Read TGAGGTAGTAGGTTGTATAGTT; Name let-7a; Variant ;"
+                   " Expression 10;")
+            if line != paste_columns(read_gff_line(old), sep=sep):
+                raise ValueError("Wrong line: %s" % line)
+
     @attr(prost=True)
     def test_prost(self):
         """testing reading prost files function"""
         from mirtop.libs import logger
         logger.initialize_logger("test", True, True)
         logger = logger.getLogger(__name__)
-        from mirtop.mirna import fasta
-        precursors = fasta.read_precursor("data/examples/annotate/hairpin.fa",
-                                          "hsa")
+        import argparse
+        from mirtop.mirna import reference
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3")
+        reference.load(args)
         fn = "data/examples/prost/prost.example.txt"
         from mirtop.importer import prost
-        reads = prost.read_file(
-            fn, precursors, "miRBasev21", "data/examples/annotate/hsa.gff3")
+        reads = prost.read_file(fn, args)
+        if prost.read_file(fn, args).keys() != reads.keys():
+            raise ValueError("Different reads with placed sequences.")
         annotate("data/example/prost/prost.example.txt", reads, True)
 
     @attr(gff=True)
@@ -355,3 +471,551 @@ class FunctionsTest(unittest.TestCase):
         _check_file("data/examples/gff/2samples.gff")
         _check_file("data/examples/gff/coldata_missing.gff")
         _check_file("data/examples/gff/3wrong_type.gff")
+
+    @attr(compare=True)
+    def test_compare(self):
+        """testing compare function with one and multiple processes"""
+        from mirtop.gff import compare
+        ref = "data/examples/compare/reference.gff"
+        files = ["data/examples/compare/target.gff", ref]
+        reference = compare.read_reference(ref)
+        serial = dict((os.path.basename(fn),
+                       compare._compare_to_reference(fn, reference))
+                      for fn in files)
+        parallel = compare._compare_parallel(files, reference, 2)
+        if serial != parallel:
+            raise ValueError("Parallel comparison differs from serial one.")
+
+    @attr(metrics=True)
+    def test_metrics(self):
+        """testing timers and counters written as JSON"""
+        import json
+        from mirtop.libs import metrics
+        from mirtop.importer import seqbuster
+        metrics.reset()
+        with metrics.timer("create"):
+            annotate("data/examples/seqbuster/reads20.mirna",
+                     seqbuster.read_file)
+        fn = metrics.write("test/test_automated_output/metrics.json",
+                           command="test")
+        with open(fn) as in_handle:
+            values = json.load(in_handle)
+        if values["timers"]["create"]["calls"] != 1:
+            raise ValueError("Timer not recorded: %s" % values["timers"])
+        if values["counters"]["create.hits"] < 1:
+            raise ValueError("Counter not recorded: %s" % values["counters"])
+        if "create.hits_per_sec" not in values["rates"]:
+            raise ValueError("Rate not computed: %s" % values["rates"])
+
+    @attr(profile=True)
+    def test_profile(self):
+        """testing profile files are written"""
+        from mirtop.libs import profiler
+        from mirtop.mirna import fasta
+        out_dir = "test/test_automated_output"
+        with profiler.profile(out_dir, "profile_test"):
+            fasta.read_precursor("data/examples/annotate/hairpin.fa", "hsa")
+        stats_fn = os.path.join(out_dir, "profile_test.pstats")
+        collapsed_fn = os.path.join(out_dir, "profile_test.collapsed.txt")
+        if not os.path.exists(stats_fn):
+            raise ValueError("pstats file not found: %s" % stats_fn)
+        with open(collapsed_fn) as in_handle:
+            stacks = [line.strip().rsplit(" ", 1)[0] for line in in_handle]
+        if not [s for s in stacks if s.endswith("(read_precursor)")]:
+            raise ValueError("read_precursor not in profile: %s" % stacks)
+
+    @attr(simulator=True)
+    def test_simulator(self):
+        """testing simulation of reads is reproducible and correct"""
+        import argparse
+        import pysam
+        from mirtop.libs import simulator
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        args = argparse.Namespace(
+            fasta="data/examples/annotate/hairpin.fa", bed=None, ref=None,
+            gtf="data/examples/annotate/hsa.gff3", samples=2, reads=2000,
+            isomir_rate=0.3, snp_rate=0.05, addition_rate=0.1,
+            noise_rate=0.15, seed=42, gzip=False, bam=True,
+            out=os.path.join(out_dir, "sim"))
+        out_files = simulator.simulate(args)
+        with open(out_files[0]) as in_handle:
+            first = in_handle.read()
+        simulator.simulate(args)
+        with open(out_files[0]) as in_handle:
+            if first != in_handle.read():
+                raise ValueError("Simulation with the same seed differs.")
+        precursors = simulator.read_precursors(args.fasta)
+        with open(out_files[2]) as in_handle:
+            for line in in_handle:
+                cols = line.strip().split("\t")
+                seq, chrom, start, end = cols[2], cols[4], cols[5], cols[6]
+                if cols[7] == "-" and cols[8] == "-" and \
+                        precursors[chrom][int(start):int(end)] != seq:
+                    raise ValueError("Wrong position: %s" % line)
+        expressed = len([line for line in first.split("\n")[1:]
+                         if line and line.split("\t")[2] != "0"])
+        bam = [r for r in pysam.AlignmentFile(out_files[3], "rb")]
+        if len(bam) != expressed:
+            raise ValueError("BAM has %s reads and sample1 %s" % (
+                len(bam), expressed))
+
+    @attr(imports=True)
+    def test_imports(self):
+        """testing subcommands only import their own dependencies"""
+        import subprocess
+        import sys
+        from mirtop.libs.parse import parse_cl
+        kwargs = parse_cl(["validator", "data/examples/gff/correct_file.gff"])
+        if kwargs["args"].files != ["data/examples/gff/correct_file.gff"]:
+            raise ValueError("parse_cl doesn't use the given arguments.")
+        code = ("import sys; import mirtop.command_line; "
+                "import mirtop.gff, mirtop.gff.validator, mirtop.gff.compare, "
+                "mirtop.gff.convert, mirtop.exporter.isomirs; "
+                "print(','.join(m for m in ['pandas', 'pysam', 'Bio', 'numpy']"
+                " if m in sys.modules))")
+        loaded = subprocess.check_output([sys.executable, "-c", code]).strip()
+        if loaded:
+            raise ValueError("Modules loaded at startup: %s" % loaded)
+
+    @attr(batch=True)
+    def test_batch(self):
+        """testing jobs of a manifest run with one and multiple processes"""
+        import argparse
+        import shutil
+        from mirtop.libs import batch
+        from mirtop.mirna import reference
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        manifest = os.path.join(out_dir, "manifest.tsv")
+        shutil.copy("data/aligments/let7-perfect.sam", out_dir)
+        with open(manifest, 'w') as out_handle:
+            out_handle.write("# name\tcommand\targuments\n")
+            for sample in ["reads", "reads20"]:
+                out_handle.write(
+                    "%s\tgff\t--format seqbuster --sps hsa"
+                    " --hairpin data/examples/annotate/hairpin.fa"
+                    " --gtf data/examples/annotate/hsa.gff3"
+                    " -o %s/batch_%s data/examples/seqbuster/%s.mirna\n" % (
+                        sample, out_dir, sample, sample))
+            out_handle.write(
+                "sam\tgff\t-t 2 --format BAM --sps hsa"
+                " --hairpin data/examples/annotate/hairpin.fa"
+                " --gtf data/examples/annotate/hsa.gff3"
+                " -o %s/batch_sam %s/let7-perfect.sam\n" % (out_dir, out_dir))
+            out_handle.write("valid\tvalidator\t-o %s/batch_valid"
+                             " data/examples/gff/correct_file.gff\n" % out_dir)
+        for threads in [1, 2]:
+            reference.clear()
+            args = argparse.Namespace(manifest=manifest, out=out_dir,
+                                      threads=threads)
+            with open(batch.batch(args)) as in_handle:
+                status = [line.split("\t")[2] for line in in_handle][1:]
+            if status != ["done"] * 4:
+                raise ValueError("Jobs failed: %s" % status)
+            fn = os.path.join(out_dir, "batch_reads20", "reads20.gff")
+            if not os.path.exists(fn):
+                raise ValueError("Job output not found: %s" % fn)
+        if len(reference._CACHE) != 3:
+            raise ValueError("References not shared: %s" % reference._CACHE.keys())
+
+    @attr(fastq=True)
+    def test_fastq(self):
+        """testing reads of FASTQ files are collapsed and placed"""
+        import argparse
+        from mirtop.importer import fastq
+        from mirtop.mirna import fasta
+        from mirtop.mirna.index import kmer_index
+        precursors = fasta.read_precursor("data/examples/annotate/hairpin.fa",
+                                          "hsa")
+        counts = fastq.collapse("data/examples/fastq/reads.fastq")
+        if len(counts) != 23 or sum(counts.values()) != 47:
+            raise ValueError("Wrong collapse: %s" % counts)
+        index = kmer_index(precursors)
+        with open("data/examples/annotate/sim_isomir.sam") as in_handle:
+            for line in in_handle:
+                cols = line.split("\t")
+                if line.startswith("@") or int(cols[1]) & 256 or \
+                        not cols[5].endswith("M") or cols[5].find("D") > -1:
+                    continue
+                hits = [hit[:2] for hit in index.map(cols[9])]
+                if (cols[2], int(cols[3]) - 1) not in hits:
+                    raise ValueError("Read not placed: %s" % line)
+        args = argparse.Namespace(precursors=precursors)
+        reads = fastq.read_file("data/examples/fastq/reads.fastq", args)
+        if sum(reads[r].counts for r in reads) != 47:
+            raise ValueError("Counts lost: %s" % len(reads))
+
+    @attr(index=True)
+    def test_index(self):
+        """testing k-mer index placement and cache on disk"""
+        import shutil
+        from mirtop.mirna import fasta, index
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        fn = os.path.join(out_dir, "hairpin.fa")
+        shutil.copy("data/examples/annotate/hairpin.fa", fn)
+        precursors = fasta.read_precursor(fn, "hsa")
+        cache = os.path.join(out_dir, "index_cache")
+        idx = index.load(precursors, fn, "hsa")
+        if os.path.exists(fn + ".hsa.k8.idx"):
+            raise ValueError("Index saved next to the fasta file.")
+        idx = index.load(precursors, fn, "hsa", cache=cache)
+        if not os.path.exists(os.path.join(cache, "hairpin.fa.hsa.k8.idx")):
+            raise ValueError("Index not saved on disk.")
+        if index.load(precursors, fn, "hsa", cache=cache).kmers != idx.kmers:
+            raise ValueError("Index from disk is different.")
+        read = precursors["hsa-let-7a-1"][5:27]
+        if ("hsa-let-7a-1", 5, [(0, 22)]) not in idx.map(read):
+            raise ValueError("Exact read not placed: %s" % idx.map(read))
+        deletion = read[:12] + read[13:]
+        if ("hsa-let-7a-1", 5) not in [hit[:2] for hit in idx.map(deletion)
+                                       if (2, 1) in hit[2]]:
+            raise ValueError("Deletion not placed: %s" % idx.map(deletion))
+        if index.banded_align(read[:10] + "AA" + read[12:],
+                              precursors["hsa-let-7a-1"], 5):
+            raise ValueError("Two mismatches should not align.")
+
+    @attr(cohort=True)
+    def test_cohort(self):
+        """testing unique sequences of all samples are annotated once"""
+        import argparse
+        import shutil
+        from mirtop.gff import cohort
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3", format="BAM",
+            out=out_dir, out_format="gff", add_extra=False, add_seq=False,
+            files=["data/merge/samples1.sam", "data/merge/samples2.sam"])
+        with open(cohort.reader(args)) as in_handle:
+            expression = sorted(line.split("Expression=")[1].split(";")[0]
+                                for line in in_handle
+                                if not line.startswith("#"))
+        if expression != ["2,4", "33,66"]:
+            raise ValueError("Wrong counts: %s" % expression)
+        fn = os.path.join(out_dir, "copy.fastq")
+        shutil.copy("data/examples/fastq/reads.fastq", fn)
+        args.format = "fastq"
+        args.files = ["data/examples/fastq/reads.fastq", fn]
+        with open(cohort.reader(args)) as in_handle:
+            for line in in_handle:
+                if line.startswith("#"):
+                    continue
+                counts = line.split("Expression=")[1].split(";")[0].split(",")
+                if counts[0] != counts[1]:
+                    raise ValueError("Same file with different counts: %s" %
+                                     line)
+
+        def _lines(fn):
+            with open(fn) as in_handle:
+                return sorted(re.sub("Read=[^;]*; ", "", line)
+                              for line in in_handle
+                              if not line.startswith("#"))
+        from mirtop.gff import reader
+        from mirtop.libs.parse import parse_cl
+        files = ["data/examples/seqbuster/reads.mirna",
+                 "data/examples/seqbuster/reads20.mirna"]
+        for mode in ["samples", "cohort"]:
+            args = parse_cl(["gff", "--format", "seqbuster", "--sps", "hsa",
+                             "--hairpin", "data/examples/annotate/hairpin.fa",
+                             "--gtf", "data/examples/annotate/hsa.gff3",
+                             "-o", os.path.join(out_dir, mode)] + files +
+                            (["--cohort"] if mode == "cohort" else []))["args"]
+            if not os.path.exists(args.out):
+                os.makedirs(args.out)
+            if mode == "cohort":
+                cohort.reader(args)
+            else:
+                reader(args)
+        # same lines, but the order of lines with the same start can change
+        if _lines(os.path.join(out_dir, "samples", "mirtop.gff")) != \
+                _lines(os.path.join(out_dir, "cohort", "mirtop.gff")):
+            raise ValueError("Cohort lines are different from samples.")
+
+    @attr(sharded=True)
+    def test_sharded(self):
+        """testing BAM file read by groups of precursors in many processes"""
+        import argparse
+        import shutil
+        from mirtop.bam import bam
+        from mirtop.bam.filter import clean_hits
+        from mirtop.gff import body
+        from mirtop.mirna import reference
+        from mirtop.mirna.annotate import annotate
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        fn = os.path.join(out_dir, "sim_isomir.bam")
+        shutil.copy("data/examples/annotate/sim_isomir_sort.bam", fn)
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3", out_format="gff",
+            add_extra=False, add_seq=False)
+        reference.load(args)
+        reads = annotate(clean_hits(bam._read_alignments(fn, args.precursors)),
+                         args.matures, args.precursors)
+        lines = body.create(reads, args.database, "sim", args)
+        bam.NAMES_CHUNK = 50
+        try:
+            sharded = bam.create_sharded(fn, args.database, "sim", args, 2)
+        finally:
+            bam.NAMES_CHUNK = 1000000
+
+        def _flat(lines):
+            return sorted(hit[4] for chrom in lines for start in lines[chrom]
+                          for hit in lines[chrom][start])
+        if _flat(lines) != _flat(sharded):
+            raise ValueError("Sharded lines are different:\n%s\n%s" % (
+                _flat(lines), _flat(sharded)))
+        folder = os.path.join(out_dir, "names")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        parts = [[bam._write_names(set(["a", "c"]), "%s/s0" % folder, 0),
+                  bam._write_names(set(["b", "d"]), "%s/s0" % folder, 1)],
+                 [bam._write_names(set(["b", "e"]), "%s/s1" % folder, 0)],
+                 [bam._write_names(set(["d"]), "%s/s2" % folder, 0)]]
+        if bam._shared_names(parts) != set(["b", "d"]):
+            raise ValueError("Wrong shared names: %s" %
+                             bam._shared_names(parts))
+        parts = [[bam._write_names(set(["a"]), "%s/s3" % folder, 0),
+                  bam._write_names(set(["a"]), "%s/s3" % folder, 1)]]
+        if bam._shared_names(parts) != set():
+            raise ValueError("Names of one group are not shared.")
+
+    @attr(clean=True)
+    def test_clean(self):
+        """testing streaming of BAM reads keeping only best hits"""
+        import argparse
+        from mirtop.bam import bam
+        from mirtop.bam.filter import clean, clean_hits
+        from mirtop.mirna import reference
+        from mirtop.mirna.realign import isomir, hits
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3")
+        reference.load(args)
+        fn = "data/examples/annotate/sim_isomir_sort.bam"
+        reads = clean_hits(bam._read_alignments(fn, args.precursors))
+        streamed = dict(bam.stream_bam(fn, args.precursors))
+        if sorted(reads) != sorted(streamed):
+            raise ValueError("Different reads: %s" % sorted(streamed))
+        for name in reads:
+            if sorted(reads[name].precursors) != \
+                    sorted(streamed[name].precursors):
+                raise ValueError("Different hits for %s" % name)
+        read = hits()
+        read.set_sequence("TGAGGTAGTAGGTTGTATAGTT")
+        for chrom, subs, add in [("a", [], []), ("b", [[1, "A", "T"]], []),
+                                 ("c", [], "GG")]:
+            iso = isomir()
+            iso.subs, iso.add = subs, add
+            read.set_precursor(chrom, iso)
+        if list(clean(read).precursors) != ["a"]:
+            raise ValueError("Lower score hits not removed: %s" %
+                             list(read.precursors))
+
+    @attr(io_threads=True)
+    def test_io_threads(self):
+        """testing BAM reading with many threads for decompression"""
+        import argparse
+        from mirtop.bam import bam
+        from mirtop.mirna import reference
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3", io_threads=3)
+        reference.load(args)
+        if bam.io_threads(args) != 3 or \
+                bam.io_threads(argparse.Namespace()) != 1:
+            raise ValueError("Wrong number of threads.")
+        fn = "data/examples/annotate/sim_isomir_sort.bam"
+        single = dict(bam.stream_bam(fn, args.precursors))
+        threaded = dict(bam.stream_bam(fn, args.precursors, threads=3))
+        if sorted(single) != sorted(threaded):
+            raise ValueError("Different reads with threads: %s" %
+                             sorted(threaded))
+
+    @attr(out_bam=True)
+    def test_out_bam(self):
+        """testing BAM output with annotation as tags"""
+        import argparse
+        import pysam
+        from mirtop.bam import bam
+        from mirtop.gff import body
+        from mirtop.mirna import reference
+        from mirtop.mirna.annotate import annotate
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3", out_format="bam",
+            add_extra=False, add_seq=False)
+        reference.load(args)
+        fn = "data/examples/annotate/sim_isomir_sort.bam"
+        reads = annotate(bam._read_alignments(fn, args.precursors, True),
+                         args.matures, args.precursors)
+        lines = body.create(reads, args.database, "sim", args)
+        fn_out = bam.write_bam(fn, lines, os.path.join(out_dir, "sim.bam"))
+        n_lines = sum(len(lines[chrom][start]) for chrom in lines
+                      for start in lines[chrom])
+        handle = pysam.AlignmentFile(fn_out, "rb")
+        records = list(handle.fetch("hsa-let-7a-1"))
+        if len(list(pysam.AlignmentFile(fn_out, "rb"))) != n_lines:
+            raise ValueError("Different number of alignments and lines.")
+        if not records or records[0].get_tag("mi") != "hsa-let-7a-5p":
+            raise ValueError("Wrong tags: %s" % records[0].get_tags())
+
+    @attr(grouped=True)
+    def test_grouped(self):
+        """testing BAM files grouped by read name are not sorted"""
+        import argparse
+        import pysam
+        from mirtop.bam import bam
+        from mirtop.mirna import reference
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3")
+        reference.load(args)
+        fn = "data/examples/annotate/sim_isomir_sort.bam"
+        if bam._bam_sort(fn) != (fn, False):
+            raise ValueError("SO:queryname file should not be sorted.")
+        handle = pysam.AlignmentFile(fn, "rb")
+        header = handle.header.to_dict()
+        lines = list(handle)
+        del header["HD"]
+        # the first read is at the start and at the end
+        fn_moved = os.path.join(out_dir, "moved.sam")
+        with pysam.AlignmentFile(fn_moved, "w", header=header) as out_handle:
+            first = [line for line in lines
+                     if line.query_name == lines[0].query_name]
+            for line in lines + first:
+                out_handle.write(line)
+        if bam._grouped_by_name(fn_moved, n=len(lines)) != "grouped" or \
+                bam._grouped_by_name(fn_moved) is not None:
+            raise ValueError("Wrong guess of grouped reads.")
+        try:
+            bam._read_alignments(fn_moved, args.precursors, check=True)
+            raise AssertionError("NotGroupedError not raised.")
+        except bam.NotGroupedError:
+            pass
+        expected = bam.read_bam(fn, args)
+        reads = bam.read_bam(fn_moved, args)
+        if sorted(reads) != sorted(expected):
+            raise ValueError("Different reads after sorting: %s" %
+                             sorted(reads))
+
+    @attr(shared=True)
+    def test_shared(self):
+        """testing references packed in files for many processes"""
+        import argparse
+        import pickle
+        from mirtop.mirna import reference, shared
+        args = argparse.Namespace(
+            hairpin="data/examples/annotate/hairpin.fa", sps="hsa",
+            gtf="data/examples/annotate/hsa.gff3")
+        reference.load(args)
+        folder = shared.temp_folder()
+        try:
+            precursors, matures = shared.pack(args.precursors, args.matures,
+                                              folder)
+            precursors, matures = pickle.loads(pickle.dumps(
+                (precursors, matures), pickle.HIGHEST_PROTOCOL))
+            for name in args.precursors:
+                if precursors[name] != args.precursors[name]:
+                    raise ValueError("Different precursor %s" % name)
+            for name in args.matures:
+                if matures[name] != args.matures[name]:
+                    raise ValueError("Different matures %s: %s" % (
+                        name, matures[name]))
+            if matures["missing"] != {} or "missing" in matures:
+                raise ValueError("Missing precursor should be empty.")
+        finally:
+            shared.remove(folder)
+        packed = reference.share(args)
+        if packed is args or packed.precursors is args.precursors or \
+                reference.share(args).matures is not packed.matures:
+            raise ValueError("References should be packed once.")
+        from mirtop.libs import batch
+        from mirtop.libs.parse import parse_cl
+        from mirtop.mirna.fasta import precursor_index
+        kwargs = parse_cl(["gff", "--format", "seqbuster", "--sps", "hsa",
+                           "--hairpin", args.hairpin, "--gtf", args.gtf,
+                           "-o", "test/test_automated_output/shared",
+                           "data/examples/seqbuster/reads20.mirna"])
+        if not os.path.exists(kwargs["args"].out):
+            os.makedirs(kwargs["args"].out)
+        reference.load(kwargs["args"])
+        kwargs["args"] = reference.share(kwargs["args"])
+        status = batch._run_job(["shared", "gff", kwargs])[2]
+        if status != "done" or \
+                not isinstance(kwargs["args"].precursors, precursor_index) or \
+                not isinstance(kwargs["args"].matures, shared.mature_table):
+            raise ValueError("Job didn't use the shared references: %s %s" % (
+                status, type(kwargs["args"].matures)))
+
+    @attr(prefetch=True)
+    def test_prefetch(self):
+        """testing files of the next samples are read in the background"""
+        import gzip
+        from mirtop.libs import prefetch
+        out_dir = "test/test_automated_output"
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        files = []
+        for idx in range(5):
+            fn = os.path.join(out_dir, "sample%s.txt" % idx)
+            with open(fn, 'w') as out_handle:
+                out_handle.write("sample%s\nline2\n" % idx)
+            files.append(fn)
+        fn_gz = os.path.join(out_dir, "sample5.txt.gz")
+        with gzip.open(fn_gz, 'wb') as out_handle:
+            out_handle.write(b"sample5\nline2\n")
+        files.append(fn_gz)
+        groups = [[fn] for fn in files] + [["missing.txt"]]
+        with prefetch.prefetch(groups, 2) as reader:
+            for idx, fn in enumerate(files):
+                with prefetch.open_file(fn) as handle:
+                    lines = [line.strip() for line in handle]
+                if lines != ["sample%s" % idx, "line2"]:
+                    raise ValueError("Wrong content of %s: %s" % (fn, lines))
+                if len(reader._jobs) > 3 or min(reader._jobs) != idx:
+                    raise ValueError("Wrong samples in flight: %s" %
+                                     sorted(reader._jobs))
+            try:
+                prefetch.open_file("missing.txt")
+                raise AssertionError("Missing file should raise IOError.")
+            except IOError:
+                pass
+        if prefetch._ACTIVE is not None:
+            raise ValueError("Prefetch should be closed.")
+
+    @attr(isomirsea=True)
+    def test_isomirsea(self):
+        """testing genomic positions of isomiR-SEA to precursors"""
+        import mirtop.gff  # the importers are loaded by mirtop.gff
+        from mirtop.importer.isomirsea import transcript_index
+        from mirtop.mirna import mapper
+        index = transcript_index(
+            mapper.read_gtf_to_mirna("data/examples/annotate/hsa.gff3"))
+        expected = {("chr9", 94175963): ["hsa-let-7a-1", 6],
+                    ("9", 94175963): ["hsa-let-7a-1", 6],
+                    ("chr9", 94175957): [None, None],
+                    ("chr9", 94176036): [None, None],
+                    ("chr15", 94175963): [None, None],
+                    ("chr11", 122146570): ["hsa-let-7a-2", 23]}
+        for (chrom, pos), value in expected.items():
+            result = index.transcript("hsa-let-7a-5p", chrom, pos)
+            if result != value:
+                raise ValueError("%s:%s is %s instead of %s" % (
+                    chrom, pos, result, value))
+        if index.transcript("hsa-let-7a-3p", "chr11", 122146570)[0]:
+            raise ValueError("hsa-let-7a-3p is not in hsa-let-7a-2")